@@ -0,0 +1,248 @@
+"""
+Persistent cache of process_query answers, backed by SQLite.
+
+Entries are keyed by the normalized query plus the route that answered it,
+so each route can have its own TTL: calculations never change, search
+answers go stale quickly. The database is bounded by the total size of the
+stored answers; the least recently used entries are evicted first.
+
+The database is opened on first use, and SQLite errors (a corrupt, locked,
+full or unwritable file) are logged and treated as a miss: the cache can
+slow nothing down and break nothing but itself.
+"""
+import logging
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import unicodedata
+
+from fast_router import normalize_query
+
+# Characters that change the meaning of a calculation; all other punctuation is folded away
+_KEEP_PUNCTUATION = set("+-*/^().%=<>")
+
+# Whitespace next to a symbol carries no meaning ("1 + 2" == "1+2", "首都 ?" == "首都?")
+_SPACE_AROUND_SYMBOL = re.compile(r"\s*([^\w\s])\s*")
+
+# Answers that depend on when the question is asked are never cached
+_TIME_SENSITIVE = re.compile(
+    r"今天|今日|明天|昨天|现在|目前|当前|最新|今年|本周|几点|几号|星期几"
+    r"|\b(?:today|tomorrow|yesterday|now|current(?:ly)?|latest|this (?:week|month|year))\b"
+)
+
+logger = logging.getLogger(__name__)
+
+# A hit refreshes an entry's last_access (its LRU position) at most this often,
+# so repeated hits on a hot answer stay reads instead of a write and commit each
+ACCESS_UPDATE_INTERVAL = 300
+
+DEFAULT_ROUTE_TTLS = {
+    "calculate": 0,                # permanent
+    "search": 3600,
+    "no tool needed": 24 * 3600,
+}
+
+
+def normalize_answer_key(query):
+    """
+    Fold differences that don't change the question.
+
+    On top of ``normalize_query`` (NFKC, so full-width characters become
+    half-width, case and whitespace folding, trailing ?!。) punctuation other
+    than arithmetic symbols is removed and spaces around symbols are dropped.
+    """
+    text = normalize_query(query)
+    text = "".join(
+        ch for ch in text
+        if ch in _KEEP_PUNCTUATION or not unicodedata.category(ch).startswith("P")
+    )
+    return " ".join(_SPACE_AROUND_SYMBOL.sub(r"\1", text).split())
+
+
+def is_cacheable(query):
+    return not _TIME_SENSITIVE.search(normalize_query(query))
+
+
+class AnswerCache:
+    """SQLite answer store with per-route TTLs and size-bounded LRU eviction."""
+
+    def __init__(self, path, max_bytes=32 * 1024 * 1024, route_ttls=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.route_ttls = dict(DEFAULT_ROUTE_TTLS, **(route_ttls or {}))
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.errors = 0
+        self._conn = None
+        # Set once opening the database failed; the cache then stays disabled
+        self._broken = False
+
+    def _connection(self):
+        """The open database, connecting on first use; None if it can't be opened. Hold the lock."""
+        if self._conn is not None or self._broken:
+            return self._conn
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS answers (
+                    query_key TEXT NOT NULL,
+                    route TEXT NOT NULL,
+                    query TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    expires_at REAL,
+                    last_access REAL NOT NULL,
+                    PRIMARY KEY (query_key, route)
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS answers_last_access ON answers (last_access)")
+            conn.commit()
+        except (sqlite3.Error, OSError) as e:
+            logger.error("answer cache disabled: cannot open %s: %s", self.path, e)
+            self._broken = True
+            self.errors += 1
+            return None
+        self._conn = conn
+        return conn
+
+    def _failed(self, operation, error):
+        # Hold the lock. Roll back so a failed statement doesn't leave a transaction open
+        logger.warning("answer cache %s failed: %s", operation, error)
+        self.errors += 1
+        try:
+            self._conn.rollback()
+        except sqlite3.Error:
+            pass
+
+    @classmethod
+    def from_env(cls):
+        """
+        ANSWER_CACHE_PATH (empty disables the cache), ANSWER_CACHE_MAX_BYTES and
+        ANSWER_CACHE_TTL_CALCULATE / _SEARCH / _GENERAL in seconds (0 = permanent).
+        Returns None when disabled.
+        """
+        path = os.getenv("ANSWER_CACHE_PATH", os.path.join(tempfile.gettempdir(), "answer-cache.sqlite3"))
+        if not path:
+            return None
+        route_ttls = {
+            "calculate": float(os.getenv("ANSWER_CACHE_TTL_CALCULATE", DEFAULT_ROUTE_TTLS["calculate"])),
+            "search": float(os.getenv("ANSWER_CACHE_TTL_SEARCH", DEFAULT_ROUTE_TTLS["search"])),
+            "no tool needed": float(os.getenv("ANSWER_CACHE_TTL_GENERAL", DEFAULT_ROUTE_TTLS["no tool needed"])),
+        }
+        return cls(path, int(os.getenv("ANSWER_CACHE_MAX_BYTES", 32 * 1024 * 1024)), route_ttls)
+
+    def get(self, query, route=None):
+        """
+        Look up a fresh answer.
+
+        Args:
+            route (str, optional): only accept an answer produced by this route;
+                when the route isn't known yet, any route's answer will do
+
+        Returns:
+            tuple: (route, response), or None on a miss
+        """
+        key = normalize_answer_key(query)
+        now = time.time()
+        sql = (
+            "SELECT route, response, last_access FROM answers"
+            " WHERE query_key = ? AND (expires_at IS NULL OR expires_at > ?)"
+        )
+        args = [key, now]
+        if route is not None:
+            sql += " AND route = ?"
+            args.append(route)
+        with self._lock:
+            conn = self._connection()
+            if conn is None:
+                self.misses += 1
+                return None
+            row = None
+            try:
+                row = conn.execute(sql + " ORDER BY created_at DESC LIMIT 1", args).fetchone()
+                if row is not None and now - row[2] >= ACCESS_UPDATE_INTERVAL:
+                    conn.execute(
+                        "UPDATE answers SET last_access = ? WHERE query_key = ? AND route = ?", (now, key, row[0])
+                    )
+                    conn.commit()
+            except sqlite3.Error as e:
+                # A hit whose access time couldn't be written is still a hit
+                self._failed("lookup", e)
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return row[0], row[1]
+
+    def set(self, query, route, response):
+        ttl = self.route_ttls.get(route, DEFAULT_ROUTE_TTLS["search"])
+        now = time.time()
+        size = len(query.encode("utf-8")) + len(response.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            conn = self._connection()
+            if conn is None:
+                return
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (normalize_answer_key(query), route, query, response, size, now, now + ttl if ttl else None, now),
+                )
+                self._evict(now)
+                conn.commit()
+            except sqlite3.Error as e:
+                self._failed("store", e)
+                return
+            self.writes += 1
+
+    def _evict(self, now):
+        """Drop expired rows, then the least recently used ones until under max_bytes."""
+        self._conn.execute("DELETE FROM answers WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM answers").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        victims = []
+        for rowid, size in self._conn.execute("SELECT rowid, size FROM answers ORDER BY last_access").fetchall():
+            victims.append((rowid,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._conn.executemany("DELETE FROM answers WHERE rowid = ?", victims)
+        self.evictions += len(victims)
+
+    def stats(self):
+        with self._lock:
+            conn = self._connection()
+            entries, size = 0, 0
+            if conn is not None:
+                try:
+                    entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM answers").fetchone()
+                except sqlite3.Error as e:
+                    self._failed("stats", e)
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "writes": self.writes,
+                "evictions": self.evictions,
+                "errors": self.errors,
+                "disabled": self._broken,
+                "entries": entries,
+                "bytes": size,
+            }
@@ -1,119 +1,634 @@
 from http.server import BaseHTTPRequestHandler
 import os
+import re
+import sys
 import json
-import requests
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 import base64
 import urllib.parse
 
+# 让共享模块（位于项目根目录）在 Vercel 和本地运行时都能被导入
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_cache import ImageCache, make_cache_key
+from singleflight import SingleFlight, FlightTimeout
+from jobs import JobQueue, QueueFull, create_job_store
+from upstream import get_client
+from image_providers import ProviderRouter, sniff_content_type
+from transcode import Transform, VariantCache, parse_transform
+import capture
+import metrics
+
+DEFAULT_NEGATIVE_PROMPT = "ugly, tiling, poorly drawn face, deformed face, deformed eyes, deformed mouth, deformed hair, deformed body, deformed hands, deformed fingers, deformed toes, deformed ears, deformed tail, deformed antenna, deformed horns, deformed claws, deformed wings"
+
+# 默认生成参数，请求中可以覆盖
+DEFAULT_GENERATION_PARAMS = {
+    "negative_prompt": DEFAULT_NEGATIVE_PROMPT,
+    "width": 512,
+    "height": 512,
+    "num_steps": 5,
+}
+
+# 二进制响应分块写出的大小
+WRITE_CHUNK_SIZE = 64 * 1024
+
+# 等待同一提示词的进行中生成结果的超时时间（秒）
+IMAGE_WAIT_TIMEOUT = float(os.getenv("IMAGE_WAIT_TIMEOUT", 60))
+
+# 批量接口的单次条目上限和默认/最大并发数
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 16))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", 4))
+
+# 图片服务商（默认 Cloudflare 优先，Pollinations 备用），按延迟和健康状况路由。
+# 第一次生成图片时才读取 Cloudflare 等服务商的配置并创建，之后在进程内复用
+_image_router = None
+_image_router_lock = threading.Lock()
+
+
+def get_image_router():
+    global _image_router
+    if _image_router is None:
+        with _image_router_lock:
+            if _image_router is None:
+                _image_router = ProviderRouter.from_env()
+    return _image_router
+
+
+# 进程级图片缓存，函数实例保持温热时可在多次调用之间复用
+image_cache = ImageCache.from_env()
+
+# 转码后的图片变体（WebP/JPEG、缩略图），按原图哈希和转换参数缓存
+image_variants = VariantCache.from_env()
+
+# 合并相同提示词和参数的并发生成请求
+image_flights = SingleFlight()
+
+# 任务路径：/api/jobs/<任务ID> 和 /api/jobs/<任务ID>/result
+JOB_PATH_PATTERN = re.compile(r"/jobs/([0-9a-f]{32})(/result)?$")
+
+
+def request_label(path):
+    """
+    指标中的请求类别：api、batch、jobs 或 other
+
+    路径来自客户端，直接用作指标名会让指标数量无限增长，这里只取固定的几类。
+    """
+    if path.endswith("/batch"):
+        return "batch"
+    if path.endswith("/jobs"):
+        return "jobs"
+    if path in ("", "/api"):
+        return "api"
+    return "other"
+
+
+def parse_generation_params(data):
+    """
+    从请求数据中读取生成参数，未提供的字段使用默认值
+
+    Raises:
+        ValueError: 参数类型或取值范围不合法
+    """
+    params = dict(DEFAULT_GENERATION_PARAMS)
+    if "negative_prompt" in data:
+        if not isinstance(data["negative_prompt"], str):
+            raise ValueError("negative_prompt must be a string")
+        params["negative_prompt"] = data["negative_prompt"]
+
+    limits = {"width": (256, 2048), "height": (256, 2048), "num_steps": (1, 20)}
+    for name, (low, high) in limits.items():
+        if name not in data:
+            continue
+        value = data[name]
+        if isinstance(value, bool) or not isinstance(value, int) or not low <= value <= high:
+            raise ValueError(f"{name} must be an integer between {low} and {high}")
+        params[name] = value
+    return params
+
+
+def parse_accept(accept_header):
+    """
+    解析 Accept 请求头
+
+    Returns:
+        dict: 媒体类型（小写）到 q 值的映射，q 值缺失或无法解析时按 1 处理
+    """
+    types = {}
+    for part in (accept_header or "").lower().split(","):
+        media_type, *params = [item.strip() for item in part.split(";")]
+        if not media_type:
+            continue
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    pass
+        types[media_type] = max(q, types.get(media_type, 0.0))
+    return types
+
+
+def wants_binary(data, accept_header):
+    """
+    判断客户端是否需要原始图片数据而不是 JSON
+
+    请求体中的 format 字段优先（"png"/"binary" 返回图片，"json" 返回 JSON），
+    否则根据 Accept 请求头协商：只列出图片类型，或图片类型的 q 值高于
+    application/json 和 text/html 时才返回图片。浏览器的默认 Accept
+    （text/html,...,image/avif,image/webp,*/*）仍然得到 JSON。
+    """
+    response_format = str(data.get("format", "")).lower()
+    if response_format in ("png", "binary", "image"):
+        return True
+    if response_format == "json":
+        return False
+    types = parse_accept(accept_header)
+    image_q = max((q for t, q in types.items() if t.startswith("image/")), default=0.0)
+    if image_q <= 0:
+        return False
+    if all(t.startswith("image/") for t in types):
+        return True
+    return image_q > max(types.get("application/json", 0.0), types.get("text/html", 0.0))
+
+
+def requires_png(data, accept_header):
+    """客户端是否明确要求 PNG：format 为 "png"，或 Accept 中可接受的图片类型只有 image/png"""
+    if str(data.get("format", "")).lower() == "png":
+        return True
+    types = parse_accept(accept_header)
+    return [t for t, q in types.items() if t.startswith("image/") and q > 0] == ["image/png"]
+
+
+def ensure_png(image_result):
+    """
+    备用服务商返回的不是 PNG 时转码为 PNG，保持 Accept: image/png 的约定
+
+    Returns:
+        dict: 转码失败时返回带 error 和 status 的结果（没有 Pillow 时为 406）
+    """
+    if sniff_content_type(image_result["image_data"]) == "image/png":
+        return image_result
+    converted = apply_transform(image_result, Transform("png"))
+    if not converted.get("success", True) and converted.get("status") == 501:
+        return {
+            "success": False,
+            "status": 406,
+            "error": "PNG was requested but the image is not PNG and transcoding is unavailable (pip install Pillow)"
+        }
+    return converted
+
+
+def generate_image(prompt, params=None):
+    """
+    生成图片，命中缓存时直接返回，不再请求上游
+
+    Returns:
+        dict: 成功时包含图片二进制数据 image_data 和缓存状态 cache（"hit"/"miss"）
+    """
+    if params is None:
+        params = dict(DEFAULT_GENERATION_PARAMS)
+
+    cache_key = make_cache_key(prompt, params)
+    with metrics.stage("cache"):
+        cached, tier = image_cache.get(cache_key)
+    if cached is not None:
+        return {
+            "success": True,
+            "image_data": cached,
+            "cache": "hit",
+            "cache_tier": tier
+        }
+
+    def generate(cancelled):
+        result = fetch_image(prompt, params, cancelled)
+        # 缓存键不含服务商：备用服务商（故障转移或对冲胜出）的结果只返回本次，不写入缓存，
+        # 否则之后同样的请求会一直拿到忽略了部分参数的 JPEG
+        if result.get("success") and result.get("provider") == get_image_router().primary:
+            image_cache.put(cache_key, result["image_data"])
+        return result
+
+    # 相同请求正在生成时直接等待其结果，不再重复调用上游
+    try:
+        with metrics.stage("generate"):
+            result, shared = image_flights.do(cache_key, generate, timeout=IMAGE_WAIT_TIMEOUT)
+    except FlightTimeout:
+        return {
+            "success": False,
+            "status": 504,
+            "error": "Timed out waiting for image generation"
+        }
+
+    # 多个等待者共享同一个结果字典，这里复制一份再补充字段
+    result = dict(result)
+    if result.get("success"):
+        result["cache"] = "miss"
+        result["coalesced"] = shared
+    return result
+
+
+def apply_transform(image_result, transform):
+    """
+    按请求的转码参数替换图片数据，结果中附带转码元数据 transform
+
+    transform 为 None 时原样返回；转码失败时返回带 error 和 status 的结果。
+    """
+    if transform is None:
+        return image_result
+    variant = image_variants.transcode(image_result["image_data"], transform)
+    if not variant["success"]:
+        return variant
+    return dict(image_result, image_data=variant["image_data"], transform=variant["transform"])
+
+
+def image_payload(image_result, prompt):
+    """JSON 响应中的图片字段（base64 编码的图片和其他相关信息），单张和批量请求相同"""
+    with metrics.stage("encode"):
+        image = base64.b64encode(image_result["image_data"]).decode('utf-8')
+    payload = {
+        "success": True,
+        "image": image,
+        "prompt": prompt,
+        "content_type": sniff_content_type(image_result["image_data"]),
+        "cache": image_result["cache"],
+        "coalesced": image_result.get("coalesced", False),
+        "provider": image_result.get("provider")
+    }
+    if "transform" in image_result:
+        payload["transform"] = image_result["transform"]
+    return payload
+
+
+def fetch_image(prompt, params, cancelled=None):
+    """
+    向当前最快的健康服务商请求生成图片，返回原始图片数据
+
+    Args:
+        cancelled (threading.Event, optional): 置位后停止读取响应并放弃本次结果
+    """
+    return get_image_router().generate(prompt, params, cancelled)
+
+
+def warm_up():
+    """提前导入 requests、创建上游客户端和服务商路由，让第一个请求不必等待（长期运行的部署在启动时调用）"""
+    get_client()
+    get_image_router()
+
+
+# 异步任务队列，后台线程在第一次提交任务时才启动。
+# 注意：Vercel 等按请求计费的无服务器环境在响应结束后可能冻结进程，
+# 异步模式更适合长期运行的部署方式。
+image_jobs = JobQueue(
+    create_job_store(os.getenv("JOB_STORE", "memory")),
+    generate_image,
+    workers=int(os.getenv("JOB_WORKERS", 2)),
+    max_queued=int(os.getenv("JOB_MAX_QUEUED", 32)),
+    ttl=float(os.getenv("JOB_TTL", 600)),
+)
+
+metrics.registry.register_collector("image_cache", image_cache.stats)
+metrics.registry.register_collector("image_variants", image_variants.stats)
+metrics.registry.register_collector("coalescing", image_flights.stats)
+metrics.registry.register_collector("jobs", image_jobs.stats)
+metrics.registry.register_collector("upstream_pools", lambda: get_client().stats())
+metrics.registry.register_collector("providers", lambda: get_image_router().stats())
+
+
 class handler(BaseHTTPRequestHandler):
 
+    def do_GET(self):
+        metrics.start_request()
+        try:
+            self.route_get()
+        finally:
+            metrics.finish_request("get")
+
+    def route_get(self):
+        path = urllib.parse.urlsplit(self.path).path.rstrip("/")
+        if path.endswith("/metrics") and metrics.ENABLED:
+            # 各阶段耗时分布、上游状态码、字节数和缓存命中率
+            self.send_json(200, metrics.registry.snapshot())
+            return
+        if path.endswith("/stats"):
+            # 缓存命中情况和合并请求计数
+            self.send_json(200, {
+                "cache": image_cache.stats(),
+                "variants": image_variants.stats(),
+                "coalescing": image_flights.stats(),
+                "jobs": image_jobs.stats(),
+                "upstream": get_client().stats(),
+                "providers": get_image_router().stats()
+            })
+            return
+
+        match = JOB_PATH_PATTERN.search(path)
+        if match:
+            self.handle_job_query(match.group(1), bool(match.group(2)))
+            return
+        self.send_json(404, {"error": "Not found"})
+
     def do_POST(self):
+        metrics.start_request()
+        path = urllib.parse.urlsplit(self.path).path.rstrip("/")
+        # 长连接上同一个处理器实例会处理多个请求，每次重新开始记录
+        self.request_data = None
+        self.response_status = None
+        self.response_bytes = 0
+        start = time.perf_counter()
+        try:
+            self.route_post(path)
+        finally:
+            metrics.finish_request(request_label(path))
+            if capture.ENABLED:
+                # 记录请求参数、耗时和响应大小，供 bench/replay.py 回放
+                capture.record(
+                    "http",
+                    path=path,
+                    accept=self.headers.get('Accept'),
+                    request=self.request_data,
+                    status=self.response_status,
+                    duration_ms=round((time.perf_counter() - start) * 1000, 1),
+                    response_bytes=self.response_bytes,
+                )
+
+    def route_post(self, path):
         # 读取请求体
-        content_length = int(self.headers['Content-Length'])
-        post_data = self.rfile.read(content_length)
+        with metrics.stage("read"):
+            content_length = int(self.headers['Content-Length'])
+            post_data = self.rfile.read(content_length)
+        metrics.incr("http_bytes_in", content_length)
         
         # 解析 JSON 数据
         try:
-            data = json.loads(post_data)
-            # 处理图像生成请求
-            self.handle_image_generation(data)
+            with metrics.stage("parse"):
+                data = json.loads(post_data)
+            self.request_data = data
+            if path.endswith("/batch"):
+                # 处理批量图像生成请求
+                self.handle_batch_generation(data)
+            elif path.endswith("/jobs"):
+                # 提交异步图像生成任务
+                self.handle_job_submit(data)
+            else:
+                # 处理图像生成请求
+                self.handle_image_generation(data)
                 
         except json.JSONDecodeError:
-            self.send_response(400)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({"error": "Invalid JSON"}).encode('utf-8'))
+            self.send_json(400, {"error": "Invalid JSON"})
             return
 
     def handle_image_generation(self, data):
         # 从请求中获取提示词
         prompt = data.get("prompt", "")
         if not prompt:
-            self.send_response(400)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({"error": "Prompt is required"}).encode('utf-8'))
+            self.send_json(400, {"error": "Prompt is required"})
             return
-            
+
         try:
-            # 调用 Cloudflare Stable Diffusion API 生成图像
-            image_result = self.generate_image(prompt)
-            
+            params = parse_generation_params(data)
+            transform = parse_transform(data)
+        except ValueError as e:
+            self.send_json(400, {"error": str(e)})
+            return
+
+        try:
+            image_result = self.produce_image(
+                prompt, params, transform, requires_png(data, self.headers.get('Accept'))
+            )
+
             if image_result and "image_data" in image_result:
+                if wants_binary(data, self.headers.get('Accept')):
+                    self.send_image(image_result, prompt)
+                    return
+
                 # 返回成功结果
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                
-                # 创建返回数据（包含base64编码的图片和其他相关信息）
-                response_data = {
-                    "success": True,
-                    "image": image_result["image_data"],
-                    "prompt": prompt
-                }
-                
-                self.wfile.write(json.dumps(response_data).encode('utf-8'))
+                self.send_json(200, image_payload(image_result, prompt), {'X-Cache': image_result["cache"].upper()})
             else:
                 # 返回错误信息
-                self.send_response(500)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({
+                self.send_json(image_result.get("status", 500), {
                     "success": False,
                     "error": image_result.get("error", "Unknown error occurred")
-                }).encode('utf-8'))
+                })
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端已断开，无法再返回错误信息
+            return
         except Exception as e:
-            self.send_response(500)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({
+            self.send_json(500, {
                 "success": False,
                 "error": str(e)
-            }).encode('utf-8'))
+            })
     
-    def generate_image(self, prompt):
-        # API 配置
-        account_id = os.getenv("CLOUDFLARE_ACCOUNT_ID", "5dff61c28ee86b9ca69d881fb1cfa207")
-        api_key = os.getenv("CLOUDFLARE_API_KEY", "2UR7AkGIEyeqIYoTbr1NFw58Z1aiJNNlvrMkGgSs")
-        api_url = f"https://api.cloudflare.com/client/v4/accounts/{account_id}/ai/run/@cf/stabilityai/stable-diffusion-xl-base-1.0"
-
-        # 设置请求头
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
+    def handle_batch_generation(self, data):
+        """
+        批量生成图片，按完成顺序以 NDJSON 逐行返回结果
 
-        # 设置请求数据
-        data = {
-            "prompt": prompt,
-            "negative_prompt": "ugly, tiling, poorly drawn face, deformed face, deformed eyes, deformed mouth, deformed hair, deformed body, deformed hands, deformed fingers, deformed toes, deformed ears, deformed tail, deformed antenna, deformed horns, deformed claws, deformed wings",
-            "width": 512,
-            "height": 512,
-            "num_steps": 5,
-        }
+        请求体格式：{"prompts": ["提示词", {"prompt": "...", "width": 768}, ...], "concurrency": 4}
+        """
+        items = data.get("prompts") if isinstance(data, dict) else None
+        if not isinstance(items, list) or not items:
+            self.send_json(400, {"error": "prompts must be a non-empty list"})
+            return
+        if len(items) > BATCH_MAX_ITEMS:
+            self.send_json(400, {"error": f"At most {BATCH_MAX_ITEMS} prompts per batch"})
+            return
+
+        concurrency = data.get("concurrency", BATCH_MAX_CONCURRENCY)
+        if isinstance(concurrency, bool) or not isinstance(concurrency, int) or concurrency < 1:
+            self.send_json(400, {"error": "concurrency must be a positive integer"})
+            return
+        concurrency = min(concurrency, BATCH_MAX_CONCURRENCY, len(items))
+
+        self.send_response(200)
+        self.send_header('Content-type', 'application/x-ndjson')
+        self.send_timing_header()
+        # 没有 Content-Length，以关闭连接表示响应结束
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        self.response_status = 200
 
         try:
-            # 发送请求
-            response = requests.post(api_url, headers=headers, json=data)
-            
-            # 检查响应状态
-            if response.status_code == 200:
-                # 获取二进制图片数据并转换为base64
-                image_data = base64.b64encode(response.content).decode('utf-8')
-                
-                return {
-                    "success": True,
-                    "image_data": image_data
-                }
-            else:
-                return {
-                    "success": False,
-                    "error": f"API 返回状态码 {response.status_code}: {response.text}"
-                }
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                futures = [
+                    executor.submit(self.generate_batch_item, index, item)
+                    for index, item in enumerate(items)
+                ]
+                # 谁先完成先返回谁，不必等待最慢的那一张
+                for future in as_completed(futures):
+                    line = json.dumps(future.result()).encode('utf-8') + b"\n"
+                    self.wfile.write(line)
+                    self.wfile.flush()
+                    metrics.incr("http_bytes_out", len(line))
+                    self.response_bytes += len(line)
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端提前断开，剩余结果仍会写入缓存
+            return
 
+    def generate_batch_item(self, index, item):
+        """生成批量请求中的一张图片，错误只影响该条目"""
+        if isinstance(item, str):
+            item = {"prompt": item}
+        if not isinstance(item, dict) or not item.get("prompt"):
+            return {"index": index, "success": False, "error": "Prompt is required"}
+
+        prompt = item["prompt"]
+        try:
+            params = parse_generation_params(item)
+            transform = parse_transform(item)
+            # 批量响应是 NDJSON，只看条目自己的 format，不看请求的 Accept
+            image_result = self.produce_image(prompt, params, transform, requires_png(item, None))
         except Exception as e:
+            return {"index": index, "prompt": prompt, "success": False, "error": str(e)}
+
+        if not image_result.get("success"):
             return {
+                "index": index,
+                "prompt": prompt,
                 "success": False,
-                "error": str(e)
-            }
\ No newline at end of file
+                "error": image_result.get("error", "Unknown error occurred")
+            }
+        return dict(index=index, **image_payload(image_result, prompt))
+
+    def handle_job_submit(self, data):
+        """提交异步生成任务，立即返回任务 ID"""
+        prompt = data.get("prompt", "")
+        if not prompt:
+            self.send_json(400, {"error": "Prompt is required"})
+            return
+        try:
+            params = parse_generation_params(data)
+        except ValueError as e:
+            self.send_json(400, {"error": str(e)})
+            return
+
+        try:
+            job_id = image_jobs.submit(prompt, params)
+        except QueueFull as e:
+            self.send_json(429, {"success": False, "error": str(e)}, {'Retry-After': '5'})
+            return
+
+        base_path = urllib.parse.urlsplit(self.path).path.rstrip("/")
+        self.send_json(202, {
+            "success": True,
+            "job_id": job_id,
+            "status": "queued",
+            "status_url": f"{base_path}/{job_id}",
+            "result_url": f"{base_path}/{job_id}/result"
+        })
+
+    def handle_job_query(self, job_id, want_result):
+        """查询任务状态，或者获取已完成任务的图片"""
+        job = image_jobs.get(job_id)
+        if job is None:
+            self.send_json(404, {"success": False, "error": "Job not found or expired"})
+            return
+
+        status = {
+            "job_id": job_id,
+            "status": job["status"],
+            "prompt": job["prompt"],
+            "created_at": job["created_at"],
+            "updated_at": job["updated_at"]
+        }
+        if job["status"] == "failed":
+            status["error"] = job["error"]
+
+        if not want_result:
+            self.send_json(200, status)
+            return
+
+        if job["status"] == "failed":
+            self.send_json(500, dict(status, success=False))
+            return
+        if job["status"] != "succeeded":
+            # 任务尚未完成
+            self.send_json(202, status)
+            return
+
+        image_result = {"image_data": job["result"], "cache": job["cache"] or "miss"}
+        query = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(self.path).query))
+        if wants_binary(query, self.headers.get('Accept')):
+            if requires_png(query, self.headers.get('Accept')):
+                image_result = ensure_png(image_result)
+                if "image_data" not in image_result:
+                    self.send_json(image_result["status"], image_result)
+                    return
+            self.send_image(image_result, job["prompt"])
+            return
+        self.send_json(200, {
+            "success": True,
+            "image": base64.b64encode(job["result"]).decode('utf-8'),
+            "prompt": job["prompt"],
+            "cache": image_result["cache"]
+        })
+
+    def send_json(self, status, payload, headers=None):
+        with metrics.stage("serialize"):
+            body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_timing_header()
+        self.end_headers()
+        self.wfile.write(body)
+        self.response_status = status
+        self.response_bytes = len(body)
+        metrics.incr("http_bytes_out", len(body))
+
+    def send_timing_header(self):
+        timing = metrics.server_timing_header()
+        if timing:
+            self.send_header('Server-Timing', timing)
+
+    def send_image(self, image_result, prompt):
+        """直接返回图片二进制数据，提示词等元数据放在响应头中"""
+        image_data = image_result["image_data"]
+        self.send_response(200)
+        # Cloudflare 返回 PNG，Pollinations 返回 JPEG
+        self.send_header('Content-type', sniff_content_type(image_data))
+        self.send_header('Content-Length', str(len(image_data)))
+        # 响应头只能包含 latin-1 字符，中文提示词需要 URL 编码
+        self.send_header('X-Prompt', urllib.parse.quote(prompt))
+        self.send_header('X-Cache', image_result["cache"].upper())
+        if image_result.get("provider"):
+            self.send_header('X-Image-Provider', image_result["provider"])
+        transform = image_result.get("transform")
+        if transform:
+            # 转码前后的大小和编码耗时（变体命中缓存时为 0）
+            self.send_header('X-Original-Length', str(transform["original_bytes"]))
+            self.send_header('X-Encode-Ms', str(transform["encode_ms"]))
+            self.send_header('X-Variant-Cache', transform["variant_cache"].upper())
+        self.send_timing_header()
+        self.end_headers()
+
+        # 分块写出，避免额外复制整张图片
+        view = memoryview(image_data)
+        for offset in range(0, len(view), WRITE_CHUNK_SIZE):
+            self.wfile.write(view[offset:offset + WRITE_CHUNK_SIZE])
+        self.response_status = 200
+        self.response_bytes = len(image_data)
+        metrics.incr("http_bytes_out", len(image_data))
+
+    def generate_image(self, prompt, params=None):
+        return generate_image(prompt, params)
+
+    def produce_image(self, prompt, params, transform, png):
+        """
+        单张和批量请求共用的生成流程：缓存或服务商生成，按需转码，要求 PNG 时保证返回 PNG
+
+        Returns:
+            dict: 成功时包含 image_data，失败时包含 error 和 status
+        """
+        # 调用图片服务商生成图像（优先使用缓存）
+        image_result = self.generate_image(prompt, params)
+        if image_result and "image_data" in image_result:
+            # 按需转码为 WebP/JPEG 或缩小尺寸
+            image_result = apply_transform(image_result, transform)
+        if image_result and "image_data" in image_result and transform is None and png:
+            image_result = ensure_png(image_result)
+        return image_result
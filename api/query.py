@@ -0,0 +1,122 @@
+from http.server import BaseHTTPRequestHandler
+import os
+import sys
+import json
+import urllib.parse
+
+# 让共享模块（位于项目根目录）在 Vercel 和本地运行时都能被导入
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools import process_query, process_query_stream
+import metrics
+
+
+def wants_event_stream(data, accept_header):
+    """请求体中 stream 为 true，或 Accept 包含 text/event-stream 时以 SSE 方式返回"""
+    if data.get("stream") in (True, "1", "true"):
+        return True
+    return "text/event-stream" in (accept_header or "").lower()
+
+
+def cache_controls(value, cache_control_header):
+    """
+    回答缓存控制：请求中的 cache 字段为 "bypass"（不读也不写）或 "refresh"（重新生成并覆盖），
+    也可以用 Cache-Control: no-store / no-cache 表达同样的意思
+
+    Returns:
+        dict: process_query 的 bypass_cache 和 refresh_cache 参数
+    """
+    directives = (cache_control_header or "").lower()
+    value = str(value or "").lower()
+    return {
+        "bypass_cache": value == "bypass" or "no-store" in directives,
+        "refresh_cache": value == "refresh" or "no-cache" in directives,
+    }
+
+
+class handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        metrics.start_request()
+        try:
+            self.route_query_get()
+        finally:
+            metrics.finish_request("query_stream")
+
+    def route_query_get(self):
+        # 浏览器的 EventSource 只支持 GET：/api/query?q=问题&pipeline=combined
+        params = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(self.path).query))
+        if "metrics" in params and metrics.ENABLED:
+            # /api/query?metrics=1：问答流程各阶段耗时、缓存命中率和路由统计
+            self.send_query_json(200, metrics.registry.snapshot())
+            return
+        query = params.get("q", "")
+        if not query:
+            self.send_query_json(400, {"error": "Query is required"})
+            return
+        self.send_event_stream(query, params.get("pipeline"),
+                               cache_controls(params.get("cache"), self.headers.get('Cache-Control')))
+
+    def do_POST(self):
+        metrics.start_request()
+        try:
+            self.route_query_post()
+        finally:
+            metrics.finish_request("query")
+
+    def route_query_post(self):
+        # 读取请求体
+        content_length = int(self.headers['Content-Length'])
+        post_data = self.rfile.read(content_length)
+
+        try:
+            data = json.loads(post_data)
+        except json.JSONDecodeError:
+            self.send_query_json(400, {"error": "Invalid JSON"})
+            return
+
+        query = data.get("query", "") if isinstance(data, dict) else ""
+        if not query:
+            self.send_query_json(400, {"error": "Query is required"})
+            return
+
+        controls = cache_controls(data.get("cache"), self.headers.get('Cache-Control'))
+        if wants_event_stream(data, self.headers.get('Accept')):
+            self.send_event_stream(query, data.get("pipeline"), controls)
+            return
+
+        try:
+            self.send_query_json(200, process_query(query, data.get("pipeline"), **controls))
+        except Exception as e:
+            self.send_query_json(500, {"error": str(e)})
+
+    def send_query_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        timing = metrics.server_timing_header()
+        if timing:
+            self.send_header('Server-Timing', timing)
+        self.end_headers()
+        self.wfile.write(body)
+        metrics.incr("http_bytes_out", len(body))
+
+    def send_event_stream(self, query, pipeline=None, controls=None):
+        """以 Server-Sent Events 逐条推送路由决策、工具调用进度和回答片段"""
+        self.send_response(200)
+        self.send_header('Content-type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        # 没有 Content-Length，以关闭连接表示响应结束
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        try:
+            for event in process_query_stream(query, pipeline, **(controls or {})):
+                data = json.dumps(event, ensure_ascii=False)
+                self.wfile.write(f"event: {event['event']}\ndata: {data}\n\n".encode('utf-8'))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端已断开
+            return
@@ -0,0 +1,265 @@
+"""
+Local stand-ins for the paid upstream services, for offline benchmarks.
+
+One threaded HTTP server answers:
+
+- POST /client/v4/accounts/<id>/ai/run/<model>   Cloudflare Workers AI (PNG bytes)
+- POST /openai/v1/chat/completions                Groq chat completions, incl. tool calls and streaming
+- GET  /w/api.php                                 Wikipedia search + extracts
+- GET  /prompt/<prompt>                           Pollinations (JPEG bytes)
+
+Latency, payload size, error rate and 429 rate are configurable per service.
+Run standalone with ``python -m bench.fakes --port 8900``.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SERVICES = ("cloudflare", "groq", "wikipedia", "pollinations")
+
+
+class ServiceProfile:
+    """Simulated behaviour of one upstream service."""
+
+    def __init__(self, latency_ms=50.0, jitter_ms=0.0, payload_bytes=0, error_rate=0.0, rate_limit_rate=0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.payload_bytes = payload_bytes
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+
+
+class FakeConfig:
+    def __init__(self, stream_chunks=20):
+        self.profiles = {
+            "cloudflare": ServiceProfile(latency_ms=300, jitter_ms=50, payload_bytes=400_000),
+            "groq": ServiceProfile(latency_ms=150, jitter_ms=30),
+            "wikipedia": ServiceProfile(latency_ms=60, jitter_ms=10),
+            "pollinations": ServiceProfile(latency_ms=300, jitter_ms=50, payload_bytes=150_000),
+        }
+        # Streamed completions send the answer in this many chunks
+        self.stream_chunks = stream_chunks
+
+
+PNG_HEADER = b"\x89PNG\r\n\x1a\n"
+JPEG_HEADER = b"\xff\xd8\xff\xe0"
+ANSWER = "这是一个用于基准测试的模拟回答，内容长度固定，便于比较不同版本的吞吐和延迟。"
+
+
+def _completion(content=None, tool_calls=None):
+    message = {"role": "assistant", "content": content}
+    if tool_calls:
+        message["tool_calls"] = tool_calls
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": "fake",
+        "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_calls else "stop"}],
+        "usage": {"prompt_tokens": 100, "completion_tokens": 50, "total_tokens": 150},
+    }
+
+
+def _chunk(delta, finish_reason=None):
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": "fake",
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+def _plan_completion(request):
+    """Decide what a real model would plausibly answer: routing text, a tool call, or prose."""
+    messages = request.get("messages", [])
+    last = messages[-1] if messages else {}
+    query = next((m.get("content") or "" for m in messages if m.get("role") == "user"), "")
+
+    if request.get("max_completion_tokens") == 20:
+        return "TOOL: CALCULATE" if re.search(r"\d\s*[-+*/]\s*\d", query) else "TOOL: SEARCH", None
+
+    if request.get("tools") and last.get("role") == "user" and len(messages) == 2:
+        expression = re.search(r"[\d.\s()+\-*/]*\d[\d.\s()+\-*/]*", query)
+        if expression and re.search(r"[-+*/]", expression.group(0)):
+            name, arguments = "calculate", {"expression": expression.group(0).strip()}
+        elif request.get("tool_choice") == "auto" and len(query) < 6:
+            return ANSWER, None
+        else:
+            name, arguments = "web_search", {"query": query}
+        if isinstance(request.get("tool_choice"), dict):
+            name = request["tool_choice"]["function"]["name"]
+        call = {
+            "id": f"call_{random.randrange(1 << 30)}",
+            "type": "function",
+            "function": {"name": name, "arguments": json.dumps(arguments, ensure_ascii=False)},
+        }
+        return None, [call]
+    return ANSWER, None
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = FakeConfig()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _simulate(self, service):
+        """Sleep for the service latency; return False after sending an injected error."""
+        profile = self.config.profiles[service]
+        time.sleep(max(0.0, random.gauss(profile.latency_ms, profile.jitter_ms)) / 1000)
+        roll = random.random()
+        if roll < profile.rate_limit_rate:
+            self._send(429, b'{"error": "rate limited"}', "application/json", {"Retry-After": "1"})
+            return False
+        if roll < profile.rate_limit_rate + profile.error_rate:
+            self._send(500, b'{"error": "injected failure"}', "application/json")
+            return False
+        return True
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_POST(self):
+        path = urllib.parse.urlsplit(self.path).path
+        body = self._read_json()
+        if "/ai/run/" in path:
+            if self._simulate("cloudflare"):
+                size = self.config.profiles["cloudflare"].payload_bytes
+                self._send(200, PNG_HEADER + os.urandom(max(size - len(PNG_HEADER), 0)), "image/png")
+        elif path.endswith("/chat/completions"):
+            if self._simulate("groq"):
+                self._chat(body)
+        else:
+            self._send(404, b"{}", "application/json")
+
+    def do_GET(self):
+        split = urllib.parse.urlsplit(self.path)
+        if split.path.endswith("/api.php"):
+            if self._simulate("wikipedia"):
+                params = dict(urllib.parse.parse_qsl(split.query))
+                query = params.get("gsrsearch") or params.get("srsearch") or ""
+                pages = {
+                    str(1000 + i): {
+                        "pageid": 1000 + i,
+                        "index": i + 1,
+                        "title": f"{query} {i + 1}",
+                        "extract": (f"{query} 的模拟摘要。" * 40),
+                        "fullurl": f"https://zh.wikipedia.org/wiki/{urllib.parse.quote(query)}_{i + 1}",
+                    }
+                    for i in range(3)
+                }
+                body = json.dumps({"query": {"pages": pages}}, ensure_ascii=False).encode("utf-8")
+                self._send(200, body, "application/json")
+        elif split.path.startswith("/prompt/"):
+            if self._simulate("pollinations"):
+                size = self.config.profiles["pollinations"].payload_bytes
+                self._send(200, JPEG_HEADER + os.urandom(max(size - len(JPEG_HEADER), 0)), "image/jpeg")
+        else:
+            self._send(404, b"{}", "application/json")
+
+    def do_HEAD(self):
+        if urllib.parse.urlsplit(self.path).path.startswith("/prompt/") and self._simulate("pollinations"):
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", str(self.config.profiles["pollinations"].payload_bytes))
+            self.end_headers()
+        elif not urllib.parse.urlsplit(self.path).path.startswith("/prompt/"):
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+    def _chat(self, request):
+        content, tool_calls = _plan_completion(request)
+        if not request.get("stream"):
+            body = json.dumps(_completion(content, tool_calls), ensure_ascii=False).encode("utf-8")
+            self._send(200, body, "application/json")
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        events = []
+        if tool_calls:
+            deltas = [dict(call, index=i) for i, call in enumerate(tool_calls)]
+            events.append(_chunk({"role": "assistant", "tool_calls": deltas}))
+            events.append(_chunk({}, "tool_calls"))
+        else:
+            pieces = max(1, self.config.stream_chunks)
+            step = max(1, len(content) // pieces)
+            for start in range(0, len(content), step):
+                events.append(_chunk({"content": content[start:start + step]}))
+            events.append(_chunk({}, "stop"))
+        per_chunk = self.config.profiles["groq"].latency_ms / 1000 / max(len(events), 1)
+        for event in events:
+            self.wfile.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(per_chunk)
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+def make_server(config=None, host="127.0.0.1", port=0):
+    handler = type("ConfiguredFakeHandler", (FakeHandler,), {"config": config or FakeConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def parse_overrides(config, spec, attribute, cast):
+    """Apply "service=value,..." (or a bare value for every service) to one profile attribute."""
+    if not spec:
+        return
+    for part in spec.split(","):
+        service, _, value = part.rpartition("=")
+        for name in ([service] if service else SERVICES):
+            setattr(config.profiles[name], attribute, cast(value))
+
+
+def add_arguments(parser):
+    parser.add_argument("--latency", help="ms per service, e.g. cloudflare=300,groq=150 (or one value for all)")
+    parser.add_argument("--jitter", help="latency standard deviation in ms, same format")
+    parser.add_argument("--payload", help="image size in bytes, e.g. cloudflare=400000")
+    parser.add_argument("--error-rate", help="fraction of 500 responses, e.g. groq=0.01")
+    parser.add_argument("--rate-limit-rate", help="fraction of 429 responses, e.g. groq=0.05")
+
+
+def config_from_args(args):
+    config = FakeConfig()
+    parse_overrides(config, args.latency, "latency_ms", float)
+    parse_overrides(config, args.jitter, "jitter_ms", float)
+    parse_overrides(config, args.payload, "payload_bytes", int)
+    parse_overrides(config, args.error_rate, "error_rate", float)
+    parse_overrides(config, args.rate_limit_rate, "rate_limit_rate", float)
+    return config
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Cloudflare/Groq/Wikipedia/Pollinations server")
+    parser.add_argument("--port", type=int, default=8900)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = make_server(config_from_args(args), port=args.port)
+    print(f"fake upstreams listening on http://127.0.0.1:{server.server_port}", flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
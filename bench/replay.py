@@ -0,0 +1,190 @@
+"""
+Replay captured production traffic (see ``capture.py``) against an endpoint.
+
+Requests are sent at their original pacing, sped up by ``--speed``, or as
+fast as ``--concurrency`` allows with ``--speed 0``. Reports throughput,
+latency percentiles per endpoint next to the latencies recorded at capture
+time, errors, and how far the sender fell behind the schedule.
+
+    CAPTURE_PATH=requests.jsonl python server.py            # capture
+    python -m bench.replay requests.jsonl --target http://127.0.0.1:8000
+    python -m bench.replay requests.jsonl --target http://127.0.0.1:8000 --speed 10
+    python -m bench.replay requests.jsonl --target http://127.0.0.1:8000 --speed 0 --concurrency 32
+
+Captured image requests go back to the path they were made on with the same
+body and Accept header; captured queries go to ``/api/query`` with their
+pipeline, cache options and, for SSE queries, ``"stream": true``.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.run import ROOT, percentile
+
+
+def read_capture(path, kinds=("http", "query"), limit=None):
+    """Captured records of the given kinds, oldest first; malformed lines are skipped."""
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A capture still being written can end in a partial line
+                continue
+            if not isinstance(record, dict) or record.get("kind") not in kinds or "ts" not in record:
+                continue
+            if record["kind"] == "http" and not isinstance(record.get("request"), (dict, list)):
+                continue
+            if record["kind"] == "query" and not record.get("query"):
+                continue
+            records.append(record)
+    records.sort(key=lambda record: record["ts"])
+    return records[:limit] if limit else records
+
+
+def build_request(record):
+    """Return (label, path, body, headers) for a captured record."""
+    headers = {"Content-Type": "application/json"}
+    if record["kind"] == "query":
+        body = {"query": record["query"]}
+        if record.get("pipeline"):
+            body["pipeline"] = record["pipeline"]
+        if record.get("bypass_cache"):
+            body["cache"] = "bypass"
+        elif record.get("refresh_cache"):
+            body["cache"] = "refresh"
+        if record.get("stream"):
+            body["stream"] = True
+        return "query", "/api/query", body, headers
+
+    path = record.get("path") or "/api"
+    if record.get("accept"):
+        headers["Accept"] = record["accept"]
+    return path.rsplit("/", 1)[-1] or "api", path, record["request"], headers
+
+
+def replay(records, target, speed=1.0, concurrency=16):
+    """
+    Send every record and collect the outcomes.
+
+    Args:
+        speed (float): 1 keeps the original gaps between requests, 10 makes them
+            ten times shorter, 0 ignores them
+        concurrency (int): most requests in flight at once; when the schedule
+            needs more, requests start late and the lag is reported
+
+    Returns:
+        dict: {"wall_s", "results": [(label, latency_ms, ok, captured_ms)], "lags_ms": [...]}
+    """
+    from upstream import get_client
+
+    client = get_client()
+    target = target.rstrip("/")
+    results = []
+    lags = []
+    lock = threading.Lock()
+    slots = threading.BoundedSemaphore(concurrency)
+
+    def send(record):
+        try:
+            label, path, body, headers = build_request(record)
+            start = time.perf_counter()
+            try:
+                response = client.post(target + path, json=body, headers=headers)
+                # Read the whole body: time to last byte is what the client sees
+                response.content
+                ok = 200 <= response.status_code < 300
+            except Exception:
+                ok = False
+            latency = (time.perf_counter() - start) * 1000
+            with lock:
+                results.append((label, latency, ok, record.get("duration_ms")))
+        finally:
+            slots.release()
+
+    first_ts = records[0]["ts"] if records else 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for record in records:
+            due = started + (record["ts"] - first_ts) / speed if speed > 0 else started
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            slots.acquire()
+            lags.append(max(0.0, time.perf_counter() - due) * 1000)
+            pool.submit(send, record)
+    return {"wall_s": time.perf_counter() - started, "results": results, "lags_ms": lags}
+
+
+def summarize(results, wall_s):
+    latencies = sorted(latency for _, latency, _, _ in results)
+    captured = sorted(ms for _, _, _, ms in results if ms is not None)
+    return {
+        "requests": len(results),
+        "errors": sum(1 for _, _, ok, _ in results if not ok),
+        "req_per_s": round(len(results) / wall_s, 2) if wall_s else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "p99_ms": round(percentile(latencies, 99), 1),
+        "captured_p50_ms": round(percentile(captured, 50), 1),
+        "captured_p95_ms": round(percentile(captured, 95), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a request capture against an endpoint")
+    parser.add_argument("capture", help="JSONL file written with CAPTURE_PATH")
+    parser.add_argument("--target", required=True, help="base URL, e.g. http://127.0.0.1:8000")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="pacing multiplier: 1 = original, 10 = ten times faster, 0 = no pauses")
+    parser.add_argument("--concurrency", type=int, default=16, help="most requests in flight at once")
+    parser.add_argument("--kind", default="http,query", help="record kinds to replay (http, query)")
+    parser.add_argument("--limit", type=int, help="replay only the first N records")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    records = read_capture(args.capture, tuple(kind.strip() for kind in args.kind.split(",")), args.limit)
+    if not records:
+        parser.error(f"no replayable records in {args.capture}")
+
+    # The shared client's pool has to hold every concurrent request to keep connections alive
+    if args.concurrency > int(os.getenv("UPSTREAM_POOL_MAXSIZE", 10)):
+        os.environ["UPSTREAM_POOL_MAXSIZE"] = str(args.concurrency)
+    sys.path.insert(0, ROOT)
+
+    span = records[-1]["ts"] - records[0]["ts"]
+    pacing = f"{args.speed}x" if args.speed > 0 else "no pauses"
+    print(f"replaying {len(records)} requests captured over {span:.1f}s ({pacing}, concurrency {args.concurrency})")
+    outcome = replay(records, args.target, args.speed, args.concurrency)
+
+    by_label = {}
+    for result in outcome["results"]:
+        by_label.setdefault(result[0], []).append(result)
+    summary = {"total": summarize(outcome["results"], outcome["wall_s"])}
+    summary.update({label: summarize(results, outcome["wall_s"]) for label, results in sorted(by_label.items())})
+
+    print(f"{'endpoint':<10}{'reqs':>7}{'err':>6}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+          f"{'cap p50':>10}{'cap p95':>10}")
+    for label, result in summary.items():
+        print(f"{label:<10}{result['requests']:>7}{result['errors']:>6}{result['req_per_s']:>10}"
+              f"{result['p50_ms']:>10}{result['p95_ms']:>10}{result['p99_ms']:>10}"
+              f"{result['captured_p50_ms']:>10}{result['captured_p95_ms']:>10}")
+
+    lags = sorted(outcome["lags_ms"])
+    summary["schedule_lag"] = {"p95_ms": round(percentile(lags, 95), 1), "max_ms": round(lags[-1], 1)}
+    summary["wall_s"] = round(outcome["wall_s"], 2)
+    print(f"wall {summary['wall_s']}s, schedule lag p95 {summary['schedule_lag']['p95_ms']} ms, "
+          f"max {summary['schedule_lag']['max_ms']} ms")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
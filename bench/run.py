@@ -0,0 +1,257 @@
+"""
+Offline benchmark: drive the real code paths against local fake upstreams.
+
+Starts ``bench.fakes`` in a subprocess, points every upstream URL at it, then
+runs each scenario at each concurrency level and reports throughput, latency
+percentiles, error count and the process's peak RSS.
+
+    python -m bench.run --concurrency 1,8,32 --requests 200
+    python -m bench.run --scenario query --latency groq=50 --rate-limit-rate groq=0.05
+
+Scenarios:
+
+- image         POST /api (JSON + base64) to ``api/index.py``'s handler on a local server
+- image_png     POST /api with ``Accept: image/png``
+- query         ``tools.process_query`` with a mix of calculate/search/general queries
+- pollinations  ``PollinationsAI.generate_image`` (saving to a temp dir)
+- image_curl    ``image_curl.generate_and_save_image`` against the local handler
+
+Prompts are unique per request, so the image cache and request coalescing
+only help where a scenario repeats work by design.
+"""
+import argparse
+import contextlib
+import importlib.util
+import itertools
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer
+
+from bench import fakes
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("image", "image_png", "query", "pollinations", "image_curl")
+
+QUERIES = [
+    "What is 12 * (7 + 5)?",
+    "计算 1024 / 16 + 3",
+    "Who invented the telephone",
+    "长城有多长",
+    "Tell me a short story about a lighthouse keeper",
+    "给我一些学习编程的建议",
+]
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_fakes(args):
+    """Run the fake upstreams in their own process so they don't compete for our GIL."""
+    port = _free_port()
+    command = [sys.executable, "-m", "bench.fakes", "--port", str(port)]
+    for option in ("latency", "jitter", "payload", "error_rate", "rate_limit_rate"):
+        value = getattr(args, option)
+        if value:
+            command += ["--" + option.replace("_", "-"), value]
+    process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.PIPE, text=True)
+    process.stdout.readline()  # "fake upstreams listening on ..."
+    return process, f"http://127.0.0.1:{port}"
+
+
+def configure_environment(fake_url, workdir):
+    """Must run before the modules under test are imported; they read the env at import time."""
+    os.environ.update({
+        "CLOUDFLARE_API_BASE": f"{fake_url}/client/v4",
+        "GROQ_BASE_URL": fake_url,
+        "GROQ_API_KEY": os.getenv("GROQ_API_KEY") or "bench",
+        "WIKIPEDIA_API_URL": f"{fake_url}/w/api.php",
+        "POLLINATIONS_BASE_URL": f"{fake_url}/prompt/",
+        "IMAGE_CACHE_DISK_BYTES": "0",
+        "SEARCH_CACHE_DIR": os.path.join(workdir, "search-cache"),
+        "ANSWER_CACHE_PATH": os.path.join(workdir, "answer-cache.sqlite3"),
+    })
+    sys.path.insert(0, ROOT)
+
+
+def _load(name, filename):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def start_api_server():
+    """Serve api/index.py's handler locally, the way ``vercel dev`` would."""
+    index = _load("bench_api_index", os.path.join("api", "index.py"))
+    quiet_handler = type("QuietHandler", (index.handler,), {"log_message": lambda self, *args: None})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), quiet_handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/api"
+
+
+def build_scenarios(names, api_url, workdir):
+    """Return {name: call(i) -> bool success}; modules are imported only for selected scenarios."""
+    from upstream import get_client
+
+    counter = itertools.count()
+    calls = {}
+
+    def prompt(i):
+        return f"benchmark prompt {i} {next(counter)}"
+
+    if "image" in names:
+        def image(i):
+            response = get_client().post(api_url, json={"prompt": prompt(i)})
+            return response.status_code == 200 and response.json().get("success", False)
+        calls["image"] = image
+
+    if "image_png" in names:
+        def image_png(i):
+            response = get_client().post(api_url, json={"prompt": prompt(i)}, headers={"Accept": "image/png"})
+            return response.status_code == 200 and len(response.content) > 0
+        calls["image_png"] = image_png
+
+    if "query" in names:
+        import tools
+
+        def query(i):
+            return bool(tools.process_query(QUERIES[i % len(QUERIES)] + f" #{next(counter)}")["response"])
+        calls["query"] = query
+
+    if "pollinations" in names:
+        client = _load("bench_text_to_image", "text-to-image.py").PollinationsAI()
+        pollinations_dir = os.path.join(workdir, "pollinations")
+        os.makedirs(pollinations_dir, exist_ok=True)
+
+        def pollinations(i):
+            result = client.generate_image(prompt(i), os.path.join(pollinations_dir, f"{i}.jpg"))
+            return result["success"] and "saved_path" in result
+        calls["pollinations"] = pollinations
+
+    if "image_curl" in names:
+        import image_curl
+        curl_dir = os.path.join(workdir, "image_curl")
+
+        def curl(i):
+            return not image_curl.generate_and_save_image(prompt(i), curl_dir, api_url).startswith("错误")
+        calls["image_curl"] = curl
+
+    return calls
+
+
+def percentile(ordered, p):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def run_level(call, concurrency, requests):
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            ok = call(i)
+        except Exception:
+            ok = False
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "req_per_s": round(requests / wall, 2),
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "p99_ms": round(percentile(latencies, 99), 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark against fake upstream services")
+    parser.add_argument("--scenario", default=",".join(SCENARIOS),
+                        help=f"comma-separated subset of {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=100, help="requests per scenario and level")
+    parser.add_argument("--warmup", type=int, default=2, help="unmeasured requests before each scenario")
+    parser.add_argument("--json", help="also write the results to this file")
+    fakes.add_arguments(parser)
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenario.split(",") if name.strip()]
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+    levels = [int(level) for level in args.concurrency.split(",")]
+
+    process, fake_url = start_fakes(args)
+    results = []
+    try:
+        with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+            configure_environment(fake_url, workdir)
+            server, api_url = start_api_server() if {"image", "image_png", "image_curl"} & set(names) else (None, None)
+            calls = build_scenarios(names, api_url, workdir)
+
+            report = sys.stdout
+            print(f"{'scenario':<14}{'conc':>6}{'reqs':>7}{'err':>6}{'req/s':>10}"
+                  f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'rss MB':>9}", file=report)
+            # image_curl prints a line per saved image; keep the table readable
+            with open(os.devnull, "w") as devnull:
+                for name in names:
+                    with contextlib.redirect_stdout(devnull):
+                        for i in range(args.warmup):
+                            calls[name](-1 - i)
+                    for level in levels:
+                        with contextlib.redirect_stdout(devnull):
+                            result = dict(scenario=name, **run_level(calls[name], level, args.requests))
+                        results.append(result)
+                        print(f"{name:<14}{level:>6}{result['requests']:>7}{result['errors']:>6}"
+                              f"{result['req_per_s']:>10}{result['p50_ms']:>10}{result['p95_ms']:>10}"
+                              f"{result['p99_ms']:>10}{result['peak_rss_mb']:>9}", file=report, flush=True)
+            if server:
+                server.shutdown()
+                server.server_close()
+    finally:
+        process.terminate()
+        process.wait()
+        process.stdout.close()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
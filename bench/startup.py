@@ -0,0 +1,164 @@
+"""
+Cold-start benchmark: import time and time to first byte of a fresh process.
+
+Every sample runs in a new interpreter, the way a serverless cold start does.
+Upstreams are the local fakes from ``bench.fakes``.
+
+    python -m bench.startup --runs 10
+    python -m bench.startup --top 15 --json startup.json
+
+- import   time to import ``tools``, ``api/index.py`` and ``api/query.py``
+- ttfb     from spawning ``server.py`` (with SERVER_WARM_UP=0) to the first
+           byte of the first image / query response; ``first_request`` is the
+           part spent after the server was already accepting connections
+
+``--top`` lists the slowest modules (cumulative, from ``python -X importtime``)
+so a new module-level import shows up by name.
+"""
+import argparse
+import http.client
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench import fakes
+from bench.run import ROOT, _free_port, configure_environment, start_fakes
+
+# api/ is not a package, so its modules are loaded by path
+_LOAD_FILE = "import importlib.util as u; s = u.spec_from_file_location({0!r}, {1!r}); s.loader.exec_module(u.module_from_spec(s))"
+
+IMPORT_TARGETS = {
+    "tools": "import tools",
+    "api/index.py": _LOAD_FILE.format("index", "api/index.py"),
+    "api/query.py": _LOAD_FILE.format("query", "api/query.py"),
+}
+
+TTFB_REQUESTS = {
+    "image": ("/api", "prompt"),
+    "query": ("/api/query", "query"),
+}
+
+
+def measure_import(statement):
+    code = f"import time; start = time.perf_counter(); {statement}; print(time.perf_counter() - start)"
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    return float(output.strip().splitlines()[-1]) * 1000
+
+
+def _top_level_imports(statement):
+    """{module: cumulative ms} for the first two levels of -X importtime (our modules and what they import)."""
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                            cwd=ROOT, capture_output=True, text=True, check=True).stderr
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Deeper entries are already counted in their parents
+        if not name.startswith("     "):
+            modules[name.strip()] = int(cumulative) / 1000
+    return modules
+
+
+def slowest_imports(statement, top):
+    """[(cumulative ms, module)] imported by the statement, slowest first."""
+    # Leave out what the interpreter imports at startup (site, encodings, ...)
+    startup = _top_level_imports("pass")
+    modules = _top_level_imports(statement)
+    return sorted(((ms, name) for name, ms in modules.items() if name not in startup), reverse=True)[:top]
+
+
+def measure_ttfb(path, field, run):
+    """Return (spawn to first byte ms, first request ms) for one fresh server process."""
+    port = _free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "server.py", "--host", "127.0.0.1", "--port", str(port), "--quiet"],
+        cwd=ROOT, env=dict(os.environ, SERVER_WARM_UP="0"), stdout=subprocess.DEVNULL,
+    )
+    try:
+        while True:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+            try:
+                connection.connect()
+                break
+            except ConnectionRefusedError:
+                if process.poll() is not None:
+                    raise RuntimeError("server.py exited during startup")
+                time.sleep(0.002)
+        # Unique per run so neither the image cache nor the answer cache can answer it
+        body = json.dumps({field: f"startup benchmark {run} {time.time()}"})
+        sent = time.perf_counter()
+        connection.request("POST", path, body, {"Content-Type": "application/json"})
+        response = connection.getresponse()
+        response.read(1)
+        first_byte = time.perf_counter()
+        response.read()
+        connection.close()
+        if response.status != 200:
+            raise RuntimeError(f"{path} returned {response.status}")
+        return (first_byte - start) * 1000, (first_byte - sent) * 1000
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def summarize(samples):
+    return {
+        "median_ms": round(statistics.median(samples), 1),
+        "min_ms": round(min(samples), 1),
+        "max_ms": round(max(samples), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start import time and time-to-first-byte benchmark")
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes per measurement")
+    parser.add_argument("--top", type=int, default=8, help="slowest imports to list per target (0 = none)")
+    parser.add_argument("--json", help="also write the results to this file")
+    fakes.add_arguments(parser)
+    args = parser.parse_args()
+
+    process, fake_url = start_fakes(args)
+    results = {"import": {}, "ttfb": {}, "slowest_imports": {}}
+    try:
+        with tempfile.TemporaryDirectory(prefix="bench-startup-") as workdir:
+            configure_environment(fake_url, workdir)
+
+            print(f"{'import':<24}{'median ms':>12}{'min ms':>10}{'max ms':>10}")
+            for name, statement in IMPORT_TARGETS.items():
+                result = summarize([measure_import(statement) for _ in range(args.runs)])
+                results["import"][name] = result
+                print(f"{name:<24}{result['median_ms']:>12}{result['min_ms']:>10}{result['max_ms']:>10}", flush=True)
+                if args.top:
+                    results["slowest_imports"][name] = slowest_imports(statement, args.top)
+
+            print(f"\n{'ttfb':<24}{'median ms':>12}{'min ms':>10}{'max ms':>10}{'1st req ms':>12}")
+            for name, (path, field) in TTFB_REQUESTS.items():
+                samples = [measure_ttfb(path, field, run) for run in range(args.runs)]
+                result = summarize([total for total, _ in samples])
+                result["first_request_median_ms"] = round(statistics.median(request for _, request in samples), 1)
+                results["ttfb"][name] = result
+                print(f"{name:<24}{result['median_ms']:>12}{result['min_ms']:>10}{result['max_ms']:>10}"
+                      f"{result['first_request_median_ms']:>12}", flush=True)
+
+            for name, modules in results["slowest_imports"].items():
+                print(f"\nslowest imports under {name}:")
+                for cumulative, module in modules:
+                    print(f"  {cumulative:>8.1f} ms  {module}")
+    finally:
+        process.terminate()
+        process.wait()
+        process.stdout.close()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
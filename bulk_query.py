@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""
+Run many queries through the tools.py pipeline concurrently.
+
+Queries come from an iterable or a JSONL file ({"id": ..., "query": ...} per
+line, or plain text lines). Calls go through the async Groq client and a
+per-model token-bucket scheduler that respects both requests/min and
+tokens/min and backs off on 429 responses using Retry-After. Each result is
+appended to the output JSONL as soon as it finishes, so an interrupted run
+can be resumed with the same command.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+from groq import AsyncGroq, RateLimitError
+
+import tools
+
+# Requests/min and tokens/min per model; override with --rpm / --tpm
+DEFAULT_LIMITS = {
+    tools.ROUTING_MODEL: {"rpm": 30, "tpm": 6000},
+    tools.TOOL_USE_MODEL: {"rpm": 30, "tpm": 6000},
+    tools.GENERAL_MODEL: {"rpm": 30, "tpm": 6000},
+}
+
+# Completion budget assumed when a call does not set max_completion_tokens
+DEFAULT_COMPLETION_TOKENS = 1024
+
+
+class TokenBucket:
+    """Continuously refilling bucket holding up to `per_minute` units."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until `amount` units are available (amounts above capacity are capped)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self.level -= amount
+
+    def give_back(self, amount):
+        self.level = min(self.capacity, self.level + amount)
+
+
+class ModelLimiter:
+    """Request and token buckets for one model, plus a Retry-After pause."""
+
+    def __init__(self, rpm, tpm):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens):
+        # Callers queue on the lock so the buckets are drained in arrival order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                wait = max(
+                    self.paused_until - now,
+                    self.requests.wait_time(1, now),
+                    self.tokens.wait_time(tokens, now),
+                )
+                if wait <= 0:
+                    self.requests.take(1)
+                    self.tokens.take(tokens)
+                    return
+                await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def refund(self, reserved):
+        """Return tokens reserved for a request the API rejected without running."""
+        self.tokens.give_back(reserved)
+
+    def settle(self, reserved, used):
+        """Correct the token bucket once the real usage is known."""
+        if used < reserved:
+            self.tokens.give_back(reserved - used)
+        else:
+            self.tokens.take(used - reserved)
+
+
+def estimate_tokens(kwargs):
+    """Rough prompt size (about 3 characters per token) plus the completion budget."""
+    chars = 0
+    for message in kwargs.get("messages", []):
+        content = message.get("content") if isinstance(message, dict) else getattr(message, "content", None)
+        chars += len(content or "")
+    if kwargs.get("tools"):
+        chars += len(json.dumps(kwargs["tools"]))
+    return chars // 3 + kwargs.get("max_completion_tokens", DEFAULT_COMPLETION_TOKENS)
+
+
+class RateLimitedGroq:
+    """AsyncGroq wrapper that schedules every chat completion through per-model limiters."""
+
+    def __init__(self, limits=None, max_retries=5, client=None):
+        # The scheduler owns retries, so the SDK's own retry loop is disabled
+        self.client = client or AsyncGroq(api_key=os.getenv("GROQ_API_KEY"), max_retries=0)
+        self.limits = limits or DEFAULT_LIMITS
+        self.max_retries = max_retries
+        self._limiters = {}
+        self.rate_limited = 0
+
+    def limiter(self, model):
+        if model not in self._limiters:
+            limit = self.limits.get(model, {"rpm": 30, "tpm": 6000})
+            self._limiters[model] = ModelLimiter(limit["rpm"], limit["tpm"])
+        return self._limiters[model]
+
+    async def chat(self, **kwargs):
+        limiter = self.limiter(kwargs["model"])
+        reserved = estimate_tokens(kwargs)
+        for attempt in range(self.max_retries + 1):
+            await limiter.acquire(reserved)
+            try:
+                response = await self.client.chat.completions.create(**kwargs)
+            except RateLimitError as e:
+                self.rate_limited += 1
+                limiter.refund(reserved)
+                if attempt == self.max_retries:
+                    raise
+                retry_after = e.response.headers.get("retry-after") if e.response is not None else None
+                try:
+                    delay = float(retry_after)
+                except (TypeError, ValueError):
+                    delay = 2.0 ** attempt
+                limiter.pause(delay)
+                continue
+            usage = getattr(response, "usage", None)
+            if usage is not None and usage.total_tokens:
+                limiter.settle(reserved, usage.total_tokens)
+            return response
+
+
+async def run_tools(messages, response_message, groq):
+    """Async counterpart of tools.answer_with_tool_results."""
+    messages.append(response_message)
+    for tool_call in response_message.tool_calls:
+        # Tools do blocking HTTP or CPU work, so keep them off the event loop
+        function_response = await asyncio.to_thread(
+            tools.execute_tool_call, tool_call.function.name, tool_call.function.arguments
+        )
+        messages.append({
+            "tool_call_id": tool_call.id,
+            "role": "tool",
+            "name": tool_call.function.name,
+            "content": function_response,
+        })
+    messages.append({"role": "user", "content": tools.TOOL_FOLLOW_UP_PROMPT})
+    response = await groq.chat(model=tools.TOOL_USE_MODEL, messages=messages, max_completion_tokens=4096)
+    return response.choices[0].message.content
+
+
+async def aprocess_query(query, groq, pipeline=None):
+    """Async counterpart of tools.process_query, returning the same result dict."""
+    pipeline = pipeline or tools.QUERY_PIPELINE
+    cached = tools.get_cached_answer(query)
+    if cached is not None:
+        return {"query": query, "route": cached[0], "response": cached[1], "pipeline": pipeline, "cached": True}
+    if pipeline == "legacy":
+        route = tools.fast_route(query)
+        if route is None:
+            response = await groq.chat(
+                model=tools.ROUTING_MODEL,
+                messages=tools.build_routing_messages(query),
+                max_completion_tokens=20
+            )
+            route = tools.parse_routing_decision(response.choices[0].message.content)
+            if tools.ROUTER_FAST_PATH:
+                tools.route_cache.set(tools.normalize_query(query), route)
+    else:
+        route = tools.fast_route(query)
+
+    if route is None:
+        messages = [
+            {"role": "system", "content": tools.COMBINED_SYSTEM_PROMPT},
+            {"role": "user", "content": query}
+        ]
+        response = await groq.chat(
+            model=tools.TOOL_USE_MODEL,
+            messages=messages,
+            tools=[tools.CALCULATE_TOOL, tools.WEB_SEARCH_TOOL],
+            tool_choice="auto",
+            max_completion_tokens=4096
+        )
+        response_message = response.choices[0].message
+        if response_message.tool_calls:
+            route = tools.TOOL_ROUTES.get(response_message.tool_calls[0].function.name, "no tool needed")
+            answer = await run_tools(messages, response_message, groq)
+        else:
+            route = "no tool needed"
+            answer = response_message.content
+        # Same as process_query: remember the decision the model made
+        if tools.ROUTER_FAST_PATH:
+            tools.route_cache.set(tools.normalize_query(query), route)
+    elif route in ["calculate", "search"]:
+        tool = tools.CALCULATE_TOOL if route == "calculate" else tools.WEB_SEARCH_TOOL
+        messages = [
+            {"role": "system", "content": tools.TOOL_SYSTEM_PROMPT},
+            {"role": "user", "content": query}
+        ]
+        response = await groq.chat(
+            model=tools.TOOL_USE_MODEL,
+            messages=messages,
+            tools=[tool],
+            tool_choice={"type": "function", "function": {"name": tool["function"]["name"]}},
+            max_completion_tokens=4096
+        )
+        response_message = response.choices[0].message
+        if response_message.tool_calls:
+            answer = await run_tools(messages, response_message, groq)
+        else:
+            answer = response_message.content
+    else:
+        response = await groq.chat(
+            model=tools.GENERAL_MODEL,
+            messages=[
+                {"role": "system", "content": "You are a helpful assistant."},
+                {"role": "user", "content": query}
+            ]
+        )
+        answer = response.choices[0].message.content
+
+    tools.cache_answer(query, route, answer)
+    return {"query": query, "route": route, "response": answer, "pipeline": pipeline, "cached": False}
+
+
+def read_queries(path):
+    """Yield (id, query) pairs from a JSONL file (or "-" for stdin), one line at a time."""
+    stream = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        for line_number, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                item = line
+            if isinstance(item, dict):
+                query = item.get("query") or item.get("prompt")
+                item_id = str(item.get("id", line_number))
+            else:
+                query = str(item)
+                item_id = str(line_number)
+            if query:
+                yield item_id, query
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def completed_ids(output_path):
+    """Ids already answered successfully in a previous run."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash can leave a partial last line
+                continue
+            if "error" not in record:
+                done.add(record["id"])
+    return done
+
+
+def needs_newline(output_path):
+    """True when the output file is non-empty and does not end with a newline."""
+    try:
+        with open(output_path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                return False
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) != b"\n"
+    except FileNotFoundError:
+        return False
+
+
+async def run_bulk(queries, output_path, concurrency=8, groq=None, pipeline=None):
+    """
+    Process (id, query) pairs concurrently and append one JSON line per result.
+
+    Args:
+        queries: iterable of (id, query) pairs, or of plain query strings
+        output_path (str): results JSONL; ids already answered there are skipped
+        concurrency (int): number of queries in flight at once
+
+    Returns:
+        dict: counts of processed, skipped and failed queries
+    """
+    groq = groq or RateLimitedGroq()
+    done = completed_ids(output_path)
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    counts = {"processed": 0, "skipped": 0, "failed": 0}
+
+    with open(output_path, "a", encoding="utf-8") as out:
+        if needs_newline(output_path):
+            # Don't glue the first new record onto a partial line left by a crash
+            out.write("\n")
+
+        async def worker():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                item_id, query = item
+                start = time.perf_counter()
+                try:
+                    record = await aprocess_query(query, groq, pipeline)
+                except Exception as e:
+                    record = {"query": query, "error": str(e)}
+                    counts["failed"] += 1
+                record["id"] = item_id
+                record["elapsed"] = round(time.perf_counter() - start, 3)
+                # One line per result, flushed right away so a crash loses at most the queries in flight
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                counts["processed"] += 1
+
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        for index, item in enumerate(queries, 1):
+            if isinstance(item, str):
+                item = (str(index), item)
+            if item[0] in done:
+                counts["skipped"] += 1
+                continue
+            # Bounded queue: reading the input pauses while workers are busy
+            await queue.put(item)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+
+    counts["rate_limited"] = groq.rate_limited
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process many queries concurrently")
+    parser.add_argument("input", help="JSONL file with {\"id\", \"query\"} objects or plain lines; - for stdin")
+    parser.add_argument("--output", "-o", default="results.jsonl", help="results JSONL (appended, used for resume)")
+    parser.add_argument("--concurrency", "-c", type=int, default=8, help="queries in flight at once")
+    parser.add_argument("--pipeline", choices=["combined", "legacy"], help="query pipeline, see tools.process_query")
+    parser.add_argument("--rpm", type=int, help="requests/min limit applied to every model")
+    parser.add_argument("--tpm", type=int, help="tokens/min limit applied to every model")
+    args = parser.parse_args()
+
+    limits = {model: dict(limit) for model, limit in DEFAULT_LIMITS.items()}
+    for limit in limits.values():
+        if args.rpm:
+            limit["rpm"] = args.rpm
+        if args.tpm:
+            limit["tpm"] = args.tpm
+
+    start = time.perf_counter()
+    counts = asyncio.run(run_bulk(
+        read_queries(args.input),
+        args.output,
+        concurrency=args.concurrency,
+        groq=RateLimitedGroq(limits),
+        pipeline=args.pipeline,
+    ))
+    counts["elapsed"] = round(time.perf_counter() - start, 2)
+    print(json.dumps(counts))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Opt-in capture of production requests for later replay (``bench/replay.py``).
+
+Disabled unless CAPTURE_PATH is set; when disabled ``record()`` returns
+immediately. When enabled, ``record()`` only puts the fields on a bounded
+queue: a background thread serializes them and appends them to the file in
+batches, so a request never waits on JSON encoding or disk. If the writer
+falls behind and the queue fills up, records are dropped and counted rather
+than blocking the caller.
+
+Each batch is appended with a single write to a file opened with O_APPEND,
+so several worker processes can share one capture file without tearing
+lines.
+"""
+import atexit
+import json
+import os
+import queue
+import random
+import threading
+import time
+
+import metrics
+
+# Flush what has been queued at least this often, even when traffic is light
+FLUSH_INTERVAL = 1.0
+
+# Upper bound on the bytes gathered into one write
+MAX_BATCH_BYTES = 256 * 1024
+
+_STOP = object()
+
+
+class CaptureWriter:
+    """Bounded queue drained by one daemon thread that appends JSON lines."""
+
+    def __init__(self, path, max_queued=10000, sample_rate=1.0):
+        self.path = path
+        self.sample_rate = sample_rate
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+
+    @classmethod
+    def from_env(cls):
+        """
+        CAPTURE_PATH (unset or empty disables capture), CAPTURE_QUEUE_SIZE and
+        CAPTURE_SAMPLE_RATE (fraction of requests recorded). Returns None when disabled.
+        """
+        path = os.getenv("CAPTURE_PATH")
+        if not path:
+            return None
+        return cls(
+            path,
+            max_queued=int(os.getenv("CAPTURE_QUEUE_SIZE", 10000)),
+            sample_rate=float(os.getenv("CAPTURE_SAMPLE_RATE", 1.0)),
+        )
+
+    def _ensure_thread(self):
+        # Started on first use, so a pre-forking server starts one per worker
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="capture-writer", daemon=True)
+                self._thread.start()
+
+    def record(self, kind, **fields):
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        if self._thread is None:
+            self._ensure_thread()
+        fields["kind"] = kind
+        fields["ts"] = time.time()
+        try:
+            self._queue.put_nowait(fields)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            metrics.incr("capture_dropped")
+
+    def _run(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            stopping = False
+            while not stopping:
+                try:
+                    item = self._queue.get(timeout=FLUSH_INTERVAL)
+                except queue.Empty:
+                    continue
+                batch = []
+                size = 0
+                # Take whatever else is already queued, up to one batch
+                while True:
+                    if item is _STOP:
+                        stopping = True
+                    else:
+                        try:
+                            line = json.dumps(item, ensure_ascii=False, default=str).encode("utf-8") + b"\n"
+                        except (TypeError, ValueError):
+                            self.errors += 1
+                        else:
+                            batch.append(line)
+                            size += len(line)
+                    self._queue.task_done()
+                    if stopping or size >= MAX_BATCH_BYTES:
+                        break
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                if batch:
+                    try:
+                        os.write(fd, b"".join(batch))
+                        self.written += len(batch)
+                    except OSError:
+                        self.errors += len(batch)
+        finally:
+            os.close(fd)
+
+    def close(self, timeout=2.0):
+        """Write out what is queued (at most ``timeout`` seconds), then stop the thread."""
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "sample_rate": self.sample_rate,
+        }
+
+
+writer = CaptureWriter.from_env()
+ENABLED = writer is not None
+
+
+def record(kind, **fields):
+    """Queue one captured request; a no-op unless CAPTURE_PATH is set."""
+    if writer is not None:
+        writer.record(kind, **fields)
+
+
+def close():
+    """Flush queued records; call before a process exits without running atexit (os._exit)."""
+    if writer is not None:
+        writer.close()
+
+
+if ENABLED:
+    atexit.register(close)
+    metrics.registry.register_collector("capture", writer.stats)
@@ -0,0 +1,90 @@
+import re
+import unicodedata
+
+# Route names shared with tools.route_query
+CALCULATE = "calculate"
+SEARCH = "search"
+NO_TOOL = "no tool needed"
+
+_TRAILING_PUNCTUATION = "?!.。？！~～"
+
+# Wording that often wraps a bare arithmetic expression
+_CALC_PREFIX = re.compile(r"^(请|帮我)?(计算|算一下|算算|求|calculate|compute|evaluate|what is|what's|how much is)\s*[:：]?\s*")
+_CALC_SUFFIX = re.compile(r"\s*(=|等于|是)?\s*(多少|几)?\s*$")
+_ARITHMETIC = re.compile(r"^[\d\s.+\-*/%()^×÷]+$")
+_OPERATOR = re.compile(r"\d\s*(\*\*|[+\-*/%^×÷])\s*-?[\d(]")
+# Dates and ranges written with - / . ("12-25", "2024/1/1", "3.15") read like arithmetic but are not
+_DATE_LIKE = re.compile(r"^(\d{4}|\d{1,2})([-/.])\d{1,2}(\2\d{1,4})?$")
+
+_CHIT_CHAT = {
+    "你好", "您好", "你好啊", "嗨", "哈喽", "早上好", "中午好", "下午好", "晚上好", "晚安",
+    "谢谢", "谢谢你", "多谢", "再见", "拜拜", "你是谁", "你叫什么名字", "你好吗", "最近怎么样",
+    "hi", "hello", "hey", "thanks", "thank you", "good morning", "good afternoon", "good evening",
+    "good night", "bye", "goodbye", "how are you", "how are you doing", "who are you",
+    "what's up", "whats up",
+}
+
+# Questions about the assistant or the user ("what is your name", "谁是你的创造者") look
+# factual but no search result can answer them
+_PERSONAL = re.compile(r"\b(you|your|yours|yourself|i|me|my|mine|myself)\b|你|您|我(?![国们])")
+
+# "what is 7 plus 8" matches the factual patterns, but numbers, operators and math
+# words mean it is a calculation the model should route
+_MATH_HINT = re.compile(
+    r"\d|[+*/=^%×÷√]"
+    r"|\b(plus|minus|times|multiplied|divided|percent|percentage|power|squared|cubed|square root|root"
+    r"|sum|product|factorial|logarithm|log|sqrt)\b"
+    r"|加上|减去|乘以|除以|乘|平方|立方|开方|根号|次方|百分之|阶乘|对数"
+)
+
+_FACTUAL_PATTERNS = [
+    re.compile(r"^(什么是|谁是|哪里是).+"),
+    re.compile(r"^(?!今天|明天|昨天|现在).+是什么.+"),
+    re.compile(r".+(是什么|是谁|是哪里|在哪里|在哪儿|在哪|是什么时候|什么时候建造的|什么时候成立的|有多高|有多长|有多大|有多少人)$"),
+    re.compile(r"^(what|who|where) (is|are|was|were) .+"),
+    re.compile(r"^when (is|was|were|did) .+"),
+    re.compile(r"^who (won|invented|founded|wrote|discovered|created) .+"),
+    re.compile(r"^(define|definition of|tell me about) .+"),
+]
+
+
+def normalize_query(query):
+    """
+    Normalize a query for matching and cache keys.
+
+    Applies NFKC (full-width to half-width), case folding, whitespace
+    collapsing and strips trailing question marks and similar punctuation.
+    """
+    text = unicodedata.normalize("NFKC", query).casefold()
+    text = " ".join(text.split())
+    return text.rstrip(_TRAILING_PUNCTUATION + " ")
+
+
+def _is_arithmetic(text):
+    text = _CALC_PREFIX.sub("", text)
+    text = _CALC_SUFFIX.sub("", text)
+    if not text or _DATE_LIKE.match(text) or text.rstrip(")").endswith(tuple("+-*/%^×÷")):
+        return False
+    return bool(_ARITHMETIC.match(text)) and bool(_OPERATOR.search(text))
+
+
+def local_route(query):
+    """
+    Classify obvious queries without calling the routing model.
+
+    Returns:
+        str or None: a route name, or None when the query is not an obvious
+        case and the LLM router should decide
+    """
+    text = normalize_query(query)
+    if not text:
+        return NO_TOOL
+    if _is_arithmetic(text):
+        return CALCULATE
+    if text.rstrip(",，、 ") in _CHIT_CHAT:
+        return NO_TOOL
+    if _MATH_HINT.search(text):
+        return None
+    if not _PERSONAL.search(text) and any(pattern.match(text) for pattern in _FACTUAL_PATTERNS):
+        return SEARCH
+    return None
@@ -18,25 +18,20 @@ OUTPUT_FILE="image_${TIMESTAMP}.png"
 
 echo "正在生成图片: \"$PROMPT\"..."
 
-# 发送请求并处理响应
-response=$(curl -s -X POST "$API_URL" \
+# 发送请求，直接以 PNG 格式接收图片（无需解析 JSON 和 base64 解码）
+http_code=$(curl -s -X POST "$API_URL" \
     -H "Content-Type: application/json" \
-    -d "{\"prompt\":\"$PROMPT\"}")
+    -H "Accept: image/png" \
+    -d "{\"prompt\":\"$PROMPT\"}" \
+    -o "$OUTPUT_FILE" \
+    -w "%{http_code}")
 
-# 检查是否成功
-success=$(echo "$response" | grep -o '"success":true' || echo "")
-
-if [ -n "$success" ]; then
-    # 从JSON响应中提取base64图片数据
-    echo "$response" | 
-        grep -o '"image":"[^"]*"' | 
-        sed 's/"image":"//;s/"$//' | 
-        base64 --decode > "$OUTPUT_FILE"
-    
+if [ "$http_code" = "200" ]; then
     echo "✓ 图片生成成功！已保存到: $OUTPUT_FILE"
 else
-    # 提取错误信息
-    error=$(echo "$response" | grep -o '"error":"[^"]*"' | sed 's/"error":"//;s/"$//' || echo "未知错误")
-    echo "✗ 图片生成失败: $error"
+    # 出错时服务端返回 JSON，从中提取错误信息
+    error=$(grep -o '"error": *"[^"]*"' "$OUTPUT_FILE" | sed 's/"error": *"//;s/"$//' || echo "未知错误")
+    rm -f "$OUTPUT_FILE"
+    echo "✗ 图片生成失败: ${error:-未知错误}"
     exit 1
 fi 
\ No newline at end of file
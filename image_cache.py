@@ -0,0 +1,225 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+def normalize_prompt(prompt):
+    """
+    规范化提示词：去掉首尾空白、合并连续空白并统一大小写
+
+    SDXL 的 CLIP 分词器本身不区分大小写，因此这些差异不会影响生成结果。
+    """
+    return " ".join(prompt.split()).casefold()
+
+
+def make_cache_key(prompt, params):
+    """
+    根据规范化后的提示词和生成参数计算缓存键
+
+    Args:
+        prompt (str): 图片生成提示词
+        params (dict): 生成参数（negative_prompt、width、height、num_steps 等）
+
+    Returns:
+        str: sha256 十六进制摘要
+    """
+    payload = {"prompt": normalize_prompt(prompt)}
+    payload.update(params)
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class MemoryTier:
+    """进程内 LRU 缓存层，按字节数限制总容量"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        # 单个对象超过预算时直接跳过，避免把整个缓存清空
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._items[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class DiskTier:
+    """磁盘缓存层（默认位于临时目录），超出容量时按最近访问时间淘汰"""
+
+    SUFFIX = ".img"
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(size for _, size, _ in self._entries())
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        # 更新修改时间，作为 LRU 淘汰依据
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        # 先写临时文件再原子替换，避免并发读取到半个文件
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            with self._lock:
+                try:
+                    self.size -= os.path.getsize(path)
+                except OSError:
+                    pass
+                os.replace(tmp_path, path)
+                self.size += len(data)
+                if self.size > self.max_bytes:
+                    self._evict()
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _evict(self):
+        # 重新扫描目录，兼容多个进程共享同一缓存目录的情况
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        self.size = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if self.size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self.size -= size
+            except FileNotFoundError:
+                pass
+
+
+class ImageCache:
+    """
+    两级图片缓存：先查内存层，未命中再查磁盘层，磁盘命中后回填内存层
+    """
+
+    def __init__(self, memory_bytes, disk_dir=None, disk_bytes=0):
+        self.memory = MemoryTier(memory_bytes)
+        self.disk = DiskTier(disk_dir, disk_bytes) if disk_dir and disk_bytes > 0 else None
+        self._lock = threading.Lock()
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls):
+        """
+        根据环境变量创建缓存，IMAGE_CACHE_DISK_BYTES=0 时只使用内存层
+
+        磁盘层默认 256 MiB：Vercel 的 /tmp 总共只有 512 MB，还要容纳变体缓存、
+        答案缓存和搜索缓存
+        """
+        memory_bytes = int(os.getenv("IMAGE_CACHE_MEMORY_BYTES", 64 * 1024 * 1024))
+        disk_bytes = int(os.getenv("IMAGE_CACHE_DISK_BYTES", 256 * 1024 * 1024))
+        disk_dir = os.getenv(
+            "IMAGE_CACHE_DIR",
+            os.path.join(tempfile.gettempdir(), "image-cache")
+        )
+        return cls(memory_bytes, disk_dir, disk_bytes)
+
+    def get(self, key):
+        """
+        查询缓存
+
+        Returns:
+            tuple: (图片二进制数据, 命中层级 "memory"/"disk")，未命中时为 (None, None)
+        """
+        data = self.memory.get(key)
+        if data is not None:
+            self._count("hits_memory")
+            return data, "memory"
+
+        if self.disk is not None:
+            try:
+                data = self.disk.get(key)
+            except OSError:
+                data = None
+            if data is not None:
+                self.memory.put(key, data)
+                self._count("hits_disk")
+                return data, "disk"
+
+        self._count("misses")
+        return None, None
+
+    def put(self, key, data):
+        self.memory.put(key, data)
+        if self.disk is not None:
+            try:
+                self.disk.put(key, data)
+            except OSError:
+                # 磁盘层写入失败不影响正常响应
+                pass
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def stats(self):
+        lookups = self.hits_memory + self.hits_disk + self.misses
+        return {
+            "hits_memory": self.hits_memory,
+            "hits_disk": self.hits_disk,
+            "misses": self.misses,
+            "hit_rate": (self.hits_memory + self.hits_disk) / lookups if lookups else 0.0,
+            "memory_items": len(self.memory),
+            "memory_bytes": self.memory.size,
+            "disk_bytes": self.disk.size if self.disk is not None else 0,
+        }
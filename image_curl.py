@@ -1,80 +1,306 @@
 #!/usr/bin/env python3
-import requests
 import json
+import re
+import sys
 import base64
+import hashlib
 import argparse
 import os
-from datetime import datetime
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-def generate_and_save_image(prompt, output_dir='.'):
+from upstream import get_client
+
+DEFAULT_API_URL = "https://www.covertsonline.com/api"  # 更新为根路径
+CHUNK_SIZE = 64 * 1024
+
+# JSON 响应中 base64 图片字段的开头
+IMAGE_FIELD = re.compile(rb'"image"\s*:\s*"')
+
+# 服务端可能切换到返回 JPEG 的备用服务商，按实际格式选择扩展名
+EXTENSIONS = {"image/png": ".png", "image/jpeg": ".jpg", "image/webp": ".webp", "image/gif": ".gif"}
+
+
+class _HashingWriter:
+    """写入文件的同时计算 sha256，用内容哈希作为文件名"""
+
+    def __init__(self, f):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.f.write(data)
+        self.sha256.update(data)
+        self.size += len(data)
+
+
+def _write_json_image(chunks, out):
     """
-    通过 API 生成图片并保存到本地
-    
+    边接收 JSON 响应边解码其中的 base64 图片，不把整个响应读进内存
+
+    Args:
+        chunks: 响应数据块的迭代器
+        out: 解码后的图片数据写入的目标
+
+    Returns:
+        dict: 响应中除图片以外的字段（success、error 等）
+    """
+    head = b""
+    tail = bytearray()
+    pending = b""
+    state = "head"  # head: 尚未找到图片字段；image: 正在解码；tail: 图片之后的部分
+    for chunk in chunks:
+        if state == "head":
+            head += chunk
+            match = IMAGE_FIELD.search(head)
+            if not match:
+                continue
+            chunk = head[match.end():]
+            head = head[:match.end()]
+            state = "image"
+        if state == "image":
+            end = chunk.find(b'"')
+            # JSON 可能把 "/" 转义成 "\/"
+            data = pending + (chunk if end < 0 else chunk[:end]).replace(b"\\", b"")
+            # base64 以 4 个字符为一组，不完整的一组留到下一块
+            usable = len(data) - len(data) % 4
+            out.write(base64.b64decode(data[:usable]))
+            pending = data[usable:]
+            if end >= 0:
+                tail += chunk[end:]
+                state = "tail"
+        else:
+            tail += chunk
+
+    if state == "image":
+        raise ValueError("响应在图片数据中途结束")
+    if pending:
+        raise ValueError("图片数据不是有效的 base64")
+    # head 以 "image": " 结尾，tail 以闭合引号开头，拼起来是图片字段为空串的完整 JSON
+    return json.loads(head + bytes(tail))
+
+
+def download_image(prompt, output_dir='.', api_url=None, params=None):
+    """
+    生成一张图片，边下载边写入输出目录，文件名取图片内容的 sha256，扩展名取实际图片格式
+
+    内容相同的图片得到同一个文件名，不同图片不会互相覆盖。
+
     Args:
         prompt (str): 图片生成提示词
-        output_dir (str): 输出目录，默认为当前目录
-    
+        output_dir (str): 输出目录
+        api_url (str, optional): 图片生成接口地址，默认读取 IMAGE_API_URL 环境变量
+        params (dict, optional): 额外的生成参数（negative_prompt、width、height、num_steps）
+
     Returns:
-        str: 保存的图片路径或错误信息
+        dict: 成功时包含 path、sha256 和 bytes，失败时包含 error
     """
-    # 确保输出目录存在
     os.makedirs(output_dir, exist_ok=True)
-    
-    # API URL（本地开发时用 localhost，部署后用实际域名）
-    api_url = "https://www.covertsonline.com/api"  # 更新为根路径
-    
+    api_url = api_url or os.getenv("IMAGE_API_URL", DEFAULT_API_URL)
+    body = dict(params or {}, prompt=prompt)
+
+    temp_path = None
     try:
-        # 发送 POST 请求
-        response = requests.post(
+        # 优先请求原始 PNG 数据，省去 base64 和 JSON 解析
+        response = get_client().post(
             api_url,
-            headers={"Content-Type": "application/json"},
-            json={"prompt": prompt}
+            headers={"Content-Type": "application/json", "Accept": "image/png"},
+            json=body,
+            stream=True
         )
-        
-        # 检查响应状态
-        if response.status_code != 200:
-            return f"错误: API 返回状态码 {response.status_code}，响应: {response.text}"
-        
-        # 解析 JSON 响应
-        result = response.json()
-        
-        # 检查响应结构
-        if not result.get("success", False):
-            return f"错误: {result.get('error', '未知错误')}"
-        
-        # 获取 base64 图片数据
-        image_data = result.get("image")
-        if not image_data:
-            return "错误: 响应中没有图片数据"
-        
-        # 生成输出文件名
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"image_{timestamp}.png"
-        output_path = os.path.join(output_dir, filename)
-        
-        # 将 base64 数据转换为二进制并保存
-        with open(output_path, "wb") as f:
-            f.write(base64.b64decode(image_data))
-        
-        print(f"✓ 图片生成成功！已保存到: {output_path}")
-        print(f"提示词: {prompt}")
-        return output_path
-        
+        with response:
+            if response.status_code != 200:
+                return {"success": False, "error": f"API 返回状态码 {response.status_code}，响应: {response.text}"}
+
+            # 先写入临时文件，算出哈希后再改名，中断时不会留下不完整的图片
+            fd, temp_path = tempfile.mkstemp(dir=output_dir, suffix=".part")
+            with os.fdopen(fd, "wb") as f:
+                out = _HashingWriter(f)
+                chunks = response.iter_content(chunk_size=CHUNK_SIZE)
+                content_type = response.headers.get("Content-Type", "")
+                if content_type.startswith("image/"):
+                    for chunk in chunks:
+                        out.write(chunk)
+                else:
+                    # 兼容只支持 JSON 响应的旧版服务
+                    result = _write_json_image(chunks, out)
+                    if not result.get("success", False):
+                        return {"success": False, "error": result.get("error", "未知错误")}
+                    content_type = result.get("content_type", "image/png")
+
+        if out.size == 0:
+            return {"success": False, "error": "响应中没有图片数据"}
+
+        digest = out.sha256.hexdigest()
+        extension = EXTENSIONS.get(content_type.split(";")[0].strip(), ".png")
+        output_path = os.path.join(output_dir, f"image_{digest[:16]}{extension}")
+        os.replace(temp_path, output_path)
+        temp_path = None
+        return {"success": True, "path": output_path, "sha256": digest, "bytes": out.size}
+
     except Exception as e:
-        return f"错误: {str(e)}"
+        return {"success": False, "error": str(e)}
+    finally:
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def generate_and_save_image(prompt, output_dir='.', api_url=None):
+    """
+    通过 API 生成图片并保存到本地
+
+    Args:
+        prompt (str): 图片生成提示词
+        output_dir (str): 输出目录，默认为当前目录
+        api_url (str, optional): 图片生成接口地址，默认读取 IMAGE_API_URL 环境变量
+
+    Returns:
+        str: 保存的图片路径或错误信息
+    """
+    result = download_image(prompt, output_dir, api_url)
+    if not result["success"]:
+        return f"错误: {result['error']}"
+
+    print(f"✓ 图片生成成功！已保存到: {result['path']}")
+    print(f"提示词: {prompt}")
+    return result["path"]
+
+
+def read_prompts(path):
+    """
+    逐行读取批量任务（"-" 表示标准输入）
+
+    每行是 JSON 对象（{"id", "prompt", 以及 width 等生成参数}）或纯文本提示词。
+    没有 id 时用提示词和参数的哈希作为 id，输入文件增删行也不影响断点续传。
+
+    Yields:
+        tuple: (id, prompt, params)
+    """
+    stream = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                item = line
+            if isinstance(item, dict):
+                prompt = item.get("prompt") or item.get("query")
+                params = {k: v for k, v in item.items() if k not in ("id", "prompt", "query")}
+            else:
+                prompt, params = str(item), {}
+            if not prompt:
+                continue
+            if isinstance(item, dict) and "id" in item:
+                item_id = str(item["id"])
+            else:
+                key = json.dumps([prompt, params], sort_keys=True, ensure_ascii=False)
+                item_id = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+            yield item_id, prompt, params
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def completed_ids(manifest_path):
+    """上次运行已成功完成、且图片文件仍然存在的任务 id"""
+    done = set()
+    if not os.path.exists(manifest_path):
+        return done
+    with open(manifest_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 中断时最后一行可能不完整
+                continue
+            if record.get("success") and os.path.exists(record.get("path", "")):
+                done.add(record["id"])
+    return done
+
+
+def run_bulk(items, output_dir='.', api_url=None, workers=4, manifest_path=None):
+    """
+    并发生成一批图片，每完成一张就追加一行到清单文件
+
+    中断后用同样的参数重新运行，清单中已成功的任务会被跳过。
+
+    Args:
+        items: (id, prompt, params) 的可迭代对象
+        output_dir (str): 输出目录
+        api_url (str, optional): 图片生成接口地址
+        workers (int): 同时进行的请求数
+        manifest_path (str, optional): 清单文件，默认为输出目录下的 manifest.jsonl
+
+    Returns:
+        dict: 成功、失败和跳过的数量
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = manifest_path or os.path.join(output_dir, "manifest.jsonl")
+    done = completed_ids(manifest_path)
+    counts = {"succeeded": 0, "failed": 0, "skipped": 0}
+    lock = threading.Lock()
+    # 限制已提交但未完成的任务数，输入很大时也不会一次性读入内存
+    slots = threading.BoundedSemaphore(workers * 2)
+
+    with open(manifest_path, "a", encoding="utf-8") as manifest:
+
+        def work(item_id, prompt, params):
+            try:
+                result = download_image(prompt, output_dir, api_url, params)
+                record = dict(result, id=item_id, prompt=prompt)
+                with lock:
+                    manifest.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    manifest.flush()
+                    counts["succeeded" if result["success"] else "failed"] += 1
+                    finished = counts["succeeded"] + counts["failed"]
+                status = result["path"] if result["success"] else f"错误: {result['error']}"
+                print(f"[{finished}] {item_id}: {status}")
+            finally:
+                slots.release()
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for item_id, prompt, params in items:
+                if item_id in done:
+                    counts["skipped"] += 1
+                    continue
+                done.add(item_id)
+                slots.acquire()
+                pool.submit(work, item_id, prompt, params)
+
+    return counts
+
 
 if __name__ == "__main__":
     # 设置命令行参数
     parser = argparse.ArgumentParser(description="生成并保存 AI 图片")
-    parser.add_argument("prompt", help="图片生成提示词")
+    parser.add_argument("prompt", nargs="?", help="图片生成提示词")
     parser.add_argument("--output", "-o", default=".", help="输出目录，默认为当前目录")
-    
+    parser.add_argument("--bulk", "-b", metavar="FILE",
+                        help="批量模式：JSONL 文件（{\"id\", \"prompt\", ...}）或每行一个提示词，- 表示标准输入")
+    parser.add_argument("--workers", "-j", type=int, default=4, help="批量模式下同时进行的请求数")
+    parser.add_argument("--manifest", help="批量模式的清单文件，默认为输出目录下的 manifest.jsonl")
+
     # 解析命令行参数
     args = parser.parse_args()
-    
+    if not args.prompt and not args.bulk:
+        parser.error("需要提供提示词或 --bulk 文件")
+
+    if args.bulk:
+        # 连接池至少要容纳所有并发请求，否则多出的连接用完即关闭，无法复用
+        if args.workers > int(os.getenv("UPSTREAM_POOL_MAXSIZE", 10)):
+            os.environ["UPSTREAM_POOL_MAXSIZE"] = str(args.workers)
+        counts = run_bulk(read_prompts(args.bulk), args.output, workers=args.workers, manifest_path=args.manifest)
+        print(f"完成: 成功 {counts['succeeded']}，失败 {counts['failed']}，跳过 {counts['skipped']}")
+        sys.exit(1 if counts["failed"] else 0)
+
     # 生成并保存图片
     result = generate_and_save_image(args.prompt, args.output)
-    
+
     # 如果返回的是错误信息，打印出来
     if result.startswith("错误:"):
-        print(result) 
\ No newline at end of file
+        print(result)
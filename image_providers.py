@@ -0,0 +1,423 @@
+import itertools
+import os
+import queue
+import threading
+import time
+import urllib.parse
+from collections import deque
+
+from upstream import get_client
+import metrics
+
+# 读取上游响应时的分块大小，每块之间检查是否已被取消
+READ_CHUNK_SIZE = 64 * 1024
+
+# 等待图片服务商响应的读取超时（秒）。生成期间上游不发送任何数据，取消标记要等到
+# 响应开始后才能生效，被放弃的调用在此之前仍占用连接和并发名额，直到响应或读取超时
+# （GET 请求读取超时后还会按共享客户端的设置重试）
+IMAGE_READ_TIMEOUT = float(os.getenv("IMAGE_READ_TIMEOUT", 60))
+
+# 图片格式的文件头
+_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+]
+
+
+def sniff_content_type(data, default="image/png"):
+    """根据文件头判断图片格式，不同服务商返回的格式不同（Cloudflare 为 PNG，Pollinations 为 JPEG）"""
+    head = bytes(data[:12])
+    for signature, content_type in _SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return default
+
+
+class ProviderHealth:
+    """
+    一个服务商的健康状况：延迟和错误率的指数移动平均，以及熔断器
+
+    连续失败达到阈值后熔断，冷却期内不再把请求发给该服务商；
+    冷却期结束后放行一次试探请求，成功则恢复，失败则再次熔断。
+    """
+
+    def __init__(self, alpha=0.2, failure_threshold=3, cooldown=30.0, window=100):
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self.latency_ewma = None
+        self.error_ewma = 0.0
+        # 最近成功请求的耗时，用于计算对冲请求的等待时间
+        self.samples = deque(maxlen=window)
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.trips = 0
+        self.open_until = 0.0
+        self.trial_in_flight = False
+
+    def record(self, success, latency):
+        with self._lock:
+            self.requests += 1
+            self.error_ewma = self.alpha * (0.0 if success else 1.0) + (1 - self.alpha) * self.error_ewma
+            self.trial_in_flight = False
+            if success:
+                if self.latency_ewma is None:
+                    self.latency_ewma = latency
+                else:
+                    self.latency_ewma = self.alpha * latency + (1 - self.alpha) * self.latency_ewma
+                self.samples.append(latency)
+                self.consecutive_failures = 0
+                self.open_until = 0.0
+                return
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.failure_threshold:
+                self.open_until = time.monotonic() + self.cooldown
+                self.trips += 1
+
+    def release_trial(self):
+        """试探请求被取消、没有结果时，允许下一个请求继续试探"""
+        with self._lock:
+            self.trial_in_flight = False
+
+    def state(self):
+        """"closed"（正常）、"open"（熔断中）或 "half_open"（冷却结束，等待试探）"""
+        with self._lock:
+            if not self.open_until:
+                return "closed"
+            if time.monotonic() < self.open_until or self.trial_in_flight:
+                return "open"
+            return "half_open"
+
+    def acquire(self):
+        """准备发出请求；半开状态只放行一个试探请求，返回 False 表示不可用"""
+        with self._lock:
+            if not self.open_until:
+                return True
+            if time.monotonic() < self.open_until or self.trial_in_flight:
+                return False
+            self.trial_in_flight = True
+            return True
+
+    def percentile(self, p):
+        with self._lock:
+            ordered = sorted(self.samples)
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+    def stats(self):
+        with self._lock:
+            latency = self.latency_ewma
+            result = {
+                "requests": self.requests,
+                "failures": self.failures,
+                "error_rate": round(self.error_ewma, 3),
+                "latency_ms": round(latency * 1000, 1) if latency is not None else None,
+                "trips": self.trips,
+            }
+        result["state"] = self.state()
+        return result
+
+
+class ImageProvider:
+    """图片服务商的基类，子类实现 fetch() 返回原始图片数据"""
+
+    name = None
+
+    def __init__(self, max_concurrency=4, read_timeout=None):
+        # 同时进行的调用上限（整个进程共享），避免触发上游限流
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.health = ProviderHealth()
+        self.read_timeout = read_timeout or IMAGE_READ_TIMEOUT
+
+    def timeout(self):
+        """(连接超时, 读取超时)，连接超时沿用共享客户端的设置"""
+        return (get_client().timeout[0], self.read_timeout)
+
+    def generate(self, prompt, params, cancelled=None):
+        """
+        生成一张图片
+
+        Args:
+            cancelled (optional): 带 is_set() 的对象，置位后停止读取响应并放弃本次结果。
+                上游在生成完成之前不返回响应头，这段时间里无法中断，只受 read_timeout 限制
+
+        Returns:
+            dict: 成功时包含图片二进制数据 image_data，失败时包含 error
+        """
+        try:
+            with self.slots, metrics.stage(f"provider:{self.name}"):
+                return self.fetch(prompt, params, cancelled)
+        except Exception as e:
+            return {
+                "success": False,
+                "error": str(e)
+            }
+
+    def fetch(self, prompt, params, cancelled):
+        raise NotImplementedError
+
+    def read_image(self, response, cancelled):
+        """分块读取响应，被取消时尽早断开连接"""
+        if response.status_code != 200:
+            return {
+                "success": False,
+                "error": f"API 返回状态码 {response.status_code}: {response.text}"
+            }
+        chunks = []
+        for chunk in itertools.chain([b""], response.iter_content(chunk_size=READ_CHUNK_SIZE)):
+            # 第一次检查在读取响应体之前，等待响应头期间被取消时不再下载图片
+            if cancelled is not None and cancelled.is_set():
+                response.close()
+                return {
+                    "success": False,
+                    "cancelled": True,
+                    "error": "Image generation cancelled"
+                }
+            chunks.append(chunk)
+        image_data = b"".join(chunks)
+        if not image_data:
+            return {
+                "success": False,
+                "error": "响应中没有图片数据"
+            }
+        # 保留原始二进制数据，由调用方决定编码方式
+        return {
+            "success": True,
+            "image_data": image_data
+        }
+
+
+class CloudflareProvider(ImageProvider):
+    """Cloudflare Workers AI 上的 Stable Diffusion XL"""
+
+    name = "cloudflare"
+
+    def __init__(self, account_id=None, api_key=None, api_base=None, max_concurrency=None):
+        super().__init__(max_concurrency or int(os.getenv("CLOUDFLARE_MAX_CONCURRENCY", 4)))
+        # API 配置
+        account_id = account_id or os.getenv("CLOUDFLARE_ACCOUNT_ID", "5dff61c28ee86b9ca69d881fb1cfa207")
+        self.api_key = api_key or os.getenv("CLOUDFLARE_API_KEY", "2UR7AkGIEyeqIYoTbr1NFw58Z1aiJNNlvrMkGgSs")
+        api_base = api_base or os.getenv("CLOUDFLARE_API_BASE", "https://api.cloudflare.com/client/v4")
+        self.api_url = f"{api_base}/accounts/{account_id}/ai/run/@cf/stabilityai/stable-diffusion-xl-base-1.0"
+
+    def fetch(self, prompt, params, cancelled):
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        data = {"prompt": prompt}
+        data.update(params)
+        response = get_client().post(self.api_url, headers=headers, json=data, stream=True, timeout=self.timeout())
+        return self.read_image(response, cancelled)
+
+
+class PollinationsProvider(ImageProvider):
+    """Pollinations.AI，提示词放在 URL 中，返回 JPEG"""
+
+    name = "pollinations"
+
+    def __init__(self, base_url=None, max_concurrency=None):
+        super().__init__(max_concurrency or int(os.getenv("POLLINATIONS_MAX_CONCURRENCY", 4)))
+        self.base_url = base_url or os.getenv("POLLINATIONS_BASE_URL", "https://image.pollinations.ai/prompt/")
+
+    def fetch(self, prompt, params, cancelled):
+        # Pollinations 只支持尺寸参数，负面提示词和步数会被忽略
+        query = {name: params[name] for name in ("width", "height") if name in params}
+        url = self.base_url + urllib.parse.quote(prompt)
+        if query:
+            url += "?" + urllib.parse.urlencode(query)
+        response = get_client().get(url, stream=True, timeout=self.timeout())
+        return self.read_image(response, cancelled)
+
+
+PROVIDERS = {
+    CloudflareProvider.name: CloudflareProvider,
+    PollinationsProvider.name: PollinationsProvider,
+}
+
+
+class _Cancellation:
+    """单次尝试的取消标记：自身被置位，或者外层请求被取消"""
+
+    def __init__(self, outer=None):
+        self.outer = outer
+        self.event = threading.Event()
+
+    def set(self):
+        self.event.set()
+
+    def is_set(self):
+        return self.event.is_set() or (self.outer is not None and self.outer.is_set())
+
+
+class ProviderRouter:
+    """
+    在多个图片服务商之间路由请求
+
+    请求发给当前最快的健康服务商（未熔断的服务商中延迟移动平均最低的）；
+    失败时依次换下一个。开启对冲后，如果首选服务商超过其延迟的指定分位数仍未返回，
+    就同时向下一个服务商发出请求，先成功的结果胜出，另一个被取消。
+    """
+
+    # 至少积累这么多次成功请求后才按分位数对冲
+    MIN_HEDGE_SAMPLES = 10
+
+    def __init__(self, providers, hedge_percentile=0):
+        """
+        Args:
+            providers (list): ImageProvider 实例，顺序即没有延迟数据时的优先级
+            hedge_percentile (float): 对冲请求的触发分位数（如 95），0 表示不对冲
+        """
+        self.providers = list(providers)
+        self.hedge_percentile = hedge_percentile
+        self._lock = threading.Lock()
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+
+    @property
+    def primary(self):
+        """配置中的第一个服务商；只有它的结果与生成参数完全对应（其他服务商可能忽略部分参数）"""
+        return self.providers[0].name
+
+    @classmethod
+    def from_env(cls):
+        """
+        IMAGE_PROVIDERS 默认只启用 Cloudflare；Pollinations 会忽略负面提示词和步数并返回 JPEG，
+        需要显式加入（如 "cloudflare,pollinations"）才作为备用
+        """
+        names = [name.strip() for name in os.getenv("IMAGE_PROVIDERS", "cloudflare").split(",") if name.strip()]
+        unknown = [name for name in names if name not in PROVIDERS]
+        if unknown or not names:
+            raise ValueError(f"IMAGE_PROVIDERS must list some of {', '.join(PROVIDERS)}")
+        providers = [PROVIDERS[name]() for name in names]
+        for provider in providers:
+            provider.health = ProviderHealth(
+                failure_threshold=int(os.getenv("IMAGE_PROVIDER_FAILURE_THRESHOLD", 3)),
+                cooldown=float(os.getenv("IMAGE_PROVIDER_COOLDOWN", 30)),
+            )
+        return cls(providers, hedge_percentile=float(os.getenv("IMAGE_HEDGE_PERCENTILE", 0)))
+
+    def ranked(self):
+        """未熔断的服务商，最快的在前"""
+        candidates = [p for p in self.providers if p.health.state() != "open"]
+        known = [p.health.latency_ewma for p in candidates if p.health.latency_ewma is not None]
+        # 还没有成功过的服务商按最快的已知延迟估计，延迟相同时按配置顺序，
+        # 这样刚恢复或刚启用的服务商也有机会被选中
+        best = min(known, default=0.0)
+        order = {provider: i for i, provider in enumerate(self.providers)}
+
+        def key(provider):
+            latency = provider.health.latency_ewma
+            return (best if latency is None else latency, order[provider])
+
+        return sorted(candidates, key=key)
+
+    def _hedge_delay(self, provider):
+        if not self.hedge_percentile or len(provider.health.samples) < self.MIN_HEDGE_SAMPLES:
+            return None
+        return provider.health.percentile(self.hedge_percentile)
+
+    def _attempt(self, provider, prompt, params, token, results):
+        start = time.monotonic()
+        result = provider.generate(prompt, params, token)
+        if result.get("cancelled") or (token.is_set() and not result.get("success")):
+            # 被取消的尝试不计入健康统计
+            provider.health.release_trial()
+        else:
+            provider.health.record(result.get("success", False), time.monotonic() - start)
+        results.put((provider, result))
+
+    def generate(self, prompt, params, cancelled=None):
+        """
+        生成一张图片
+
+        Returns:
+            dict: 成功时包含 image_data 和实际使用的服务商 provider，
+                所有服务商都失败时包含各自的错误信息
+        """
+        remaining = self.ranked()
+        results = queue.Queue()
+        tokens = []
+        errors = []
+
+        def launch():
+            # 跳过刚刚被其他请求占用了试探机会的半开服务商
+            while remaining:
+                provider = remaining.pop(0)
+                if provider.health.acquire():
+                    token = _Cancellation(cancelled)
+                    tokens.append(token)
+                    threading.Thread(
+                        target=self._attempt,
+                        args=(provider, prompt, params, token, results),
+                        daemon=True,
+                    ).start()
+                    return provider
+            return None
+
+        primary = launch()
+        if primary is None:
+            return {
+                "success": False,
+                "status": 503,
+                "error": "No image provider available"
+            }
+        running = 1
+        hedge_delay = self._hedge_delay(primary) if remaining else None
+
+        while running:
+            try:
+                provider, result = results.get(timeout=hedge_delay)
+            except queue.Empty:
+                # 首选服务商比平时慢，同时向下一个服务商发出请求
+                hedge_delay = None
+                if launch() is not None:
+                    running += 1
+                    metrics.incr("provider_hedged")
+                    with self._lock:
+                        self.hedged += 1
+                continue
+
+            running -= 1
+            if result.get("success"):
+                # 取消仍在进行的另一个请求
+                for token in tokens:
+                    token.set()
+                if running and provider is not primary:
+                    # 对冲请求比首选服务商先返回
+                    with self._lock:
+                        self.hedge_wins += 1
+                return dict(result, provider=provider.name)
+
+            errors.append(f"{provider.name}: {result.get('error')}")
+            if cancelled is not None and cancelled.is_set():
+                break
+            if not running:
+                # 换下一个服务商重试
+                fallback = launch()
+                if fallback is not None:
+                    running += 1
+                    metrics.incr("provider_failover")
+                    with self._lock:
+                        self.failovers += 1
+                    hedge_delay = self._hedge_delay(fallback) if remaining else None
+
+        return {
+            "success": False,
+            "error": "; ".join(errors) or "Image generation cancelled"
+        }
+
+    def stats(self):
+        with self._lock:
+            result = {"hedged": self.hedged, "hedge_wins": self.hedge_wins, "failovers": self.failovers}
+        result["providers"] = {provider.name: provider.health.stats() for provider in self.providers}
+        return result
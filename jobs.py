@@ -0,0 +1,261 @@
+import json
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+
+class QueueFull(Exception):
+    """任务队列已满，调用方应稍后重试"""
+
+
+# 任务记录中的字段
+JOB_FIELDS = (
+    "id", "status", "prompt", "params", "result", "error", "cache",
+    "created_at", "updated_at", "expires_at",
+)
+
+
+class MemoryJobStore:
+    """进程内任务存储，适合单实例部署和本地测试"""
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job):
+        with self._lock:
+            self._jobs[job["id"]] = dict(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def purge_expired(self, now):
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items() if job["expires_at"] <= now]
+            for job_id in expired:
+                del self._jobs[job_id]
+            return len(expired)
+
+
+class SQLiteJobStore:
+    """基于 SQLite 的任务存储，进程重启后仍可查询已完成的任务"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                prompt TEXT NOT NULL,
+                params TEXT NOT NULL,
+                result BLOB,
+                error TEXT,
+                cache TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_expires_at ON jobs (expires_at)")
+        self._conn.commit()
+
+    def create(self, job):
+        row = dict(job, params=json.dumps(job["params"]))
+        with self._lock:
+            self._conn.execute(
+                f"INSERT INTO jobs ({', '.join(JOB_FIELDS)}) VALUES ({', '.join('?' * len(JOB_FIELDS))})",
+                [row.get(name) for name in JOB_FIELDS],
+            )
+            self._conn.commit()
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(JOB_FIELDS)} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(JOB_FIELDS, row))
+        job["params"] = json.loads(job["params"])
+        if job["result"] is not None:
+            job["result"] = bytes(job["result"])
+        return job
+
+    def update(self, job_id, **fields):
+        names = [name for name in fields if name in JOB_FIELDS and name != "id"]
+        if not names:
+            return
+        values = [json.dumps(fields[name]) if name == "params" else fields[name] for name in names]
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE jobs SET {', '.join(name + ' = ?' for name in names)} WHERE id = ?",
+                values + [job_id],
+            )
+            self._conn.commit()
+
+    def purge_expired(self, now):
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM jobs WHERE expires_at <= ?", (now,))
+            self._conn.commit()
+            return cursor.rowcount
+
+
+def create_job_store(spec):
+    """
+    根据配置创建任务存储
+
+    Args:
+        spec (str): "memory"，或 "sqlite:<数据库文件路径>"
+    """
+    if not spec or spec == "memory":
+        return MemoryJobStore()
+    if spec.startswith("sqlite:"):
+        return SQLiteJobStore(spec[len("sqlite:"):])
+    raise ValueError(f"Unknown job store: {spec}")
+
+
+class JobQueue:
+    """
+    异步图片生成任务队列
+
+    提交后立即返回任务 ID，由后台线程池执行；队列有上限，满时抛出 QueueFull。
+    任务结束后保留 ttl 秒，过期后被清理；排队和执行中的任务不会过期，不论等待了多久。
+    """
+
+    def __init__(self, store, worker_fn, workers=2, max_queued=32, ttl=600):
+        self.store = store
+        self.worker_fn = worker_fn
+        self.workers = workers
+        self.ttl = ttl
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+
+    def _ensure_workers(self):
+        # 第一次提交任务时才启动工作线程，不影响冷启动
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"image-job-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, prompt, params):
+        """
+        提交任务
+
+        Returns:
+            str: 任务 ID
+
+        Raises:
+            QueueFull: 排队中的任务已达上限
+        """
+        self._ensure_workers()
+        self.purge_expired()
+
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        self.store.create({
+            "id": job_id,
+            "status": "queued",
+            "prompt": prompt,
+            "params": params,
+            "result": None,
+            "error": None,
+            "cache": None,
+            "created_at": now,
+            "updated_at": now,
+            # 结束时才设置真正的过期时间
+            "expires_at": float("inf"),
+        })
+        try:
+            self._queue.put_nowait((job_id, prompt, params))
+        except queue.Full:
+            self.store.update(job_id, status="rejected", expires_at=now)
+            raise QueueFull("Too many queued jobs")
+        return job_id
+
+    def get(self, job_id):
+        self.purge_expired()
+        job = self.store.get(job_id)
+        if job is None or job["expires_at"] <= time.time():
+            return None
+        return job
+
+    def purge_expired(self):
+        # 最多每秒清理一次，避免每个请求都扫描存储
+        now = time.time()
+        if now - self._last_purge < 1:
+            return
+        self._last_purge = now
+        self.store.purge_expired(now)
+
+    def drain(self, timeout):
+        """
+        等待已提交的任务全部执行完毕，用于进程平滑退出
+
+        Returns:
+            bool: 超时仍有未完成的任务时返回 False
+        """
+        deadline = time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def _work(self):
+        while True:
+            job_id, prompt, params = self._queue.get()
+            try:
+                self.store.update(job_id, status="running", updated_at=time.time())
+                try:
+                    result = self.worker_fn(prompt, params)
+                except Exception as e:
+                    result = {"success": False, "error": str(e)}
+
+                now = time.time()
+                if result.get("success"):
+                    self.store.update(
+                        job_id,
+                        status="succeeded",
+                        result=result["image_data"],
+                        cache=result.get("cache"),
+                        updated_at=now,
+                        expires_at=now + self.ttl,
+                    )
+                else:
+                    self.store.update(
+                        job_id,
+                        status="failed",
+                        error=result.get("error", "Unknown error occurred"),
+                        updated_at=now,
+                        expires_at=now + self.ttl,
+                    )
+            finally:
+                self._queue.task_done()
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "max_queued": self._queue.maxsize,
+            "workers": self.workers,
+        }
@@ -0,0 +1,182 @@
+"""
+Lightweight latency and counter instrumentation.
+
+Disabled unless METRICS_ENABLED=1; when disabled ``stage()`` returns a shared
+no-op context manager and ``incr()`` returns immediately, so instrumented
+code pays one function call per stage.
+
+When enabled, every stage duration is recorded in a histogram (p50/p95/p99
+over a bounded window of recent samples) and, if a request is being timed
+on the current thread, added to that request's Server-Timing header.
+"""
+import atexit
+import contextlib
+import contextvars
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+
+ENABLED = os.getenv("METRICS_ENABLED", "0") == "1"
+
+# Number of recent samples each histogram keeps for percentile estimates
+HISTOGRAM_WINDOW = int(os.getenv("METRICS_HISTOGRAM_WINDOW", 2048))
+
+_NULL_CONTEXT = contextlib.nullcontext()
+_current_timing = contextvars.ContextVar("request_timing", default=None)
+
+# Server-Timing metric names must be HTTP tokens
+_NON_TOKEN = re.compile(r"[^A-Za-z0-9!#$%&'*+.^_`|~-]")
+
+
+class Histogram:
+    def __init__(self, window=HISTOGRAM_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def summary(self):
+        ordered = sorted(self.samples)
+
+        def percentile(p):
+            if not ordered:
+                return 0.0
+            return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))], 3)
+
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 3) if self.count else 0.0,
+            "p50": percentile(50),
+            "p95": percentile(95),
+            "p99": percentile(99),
+        }
+
+
+class Registry:
+    """Process-wide histograms (milliseconds), counters and stats collectors."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.collectors = {}
+
+    def observe(self, name, value):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def register_collector(self, name, fn):
+        """Include ``fn()`` (e.g. a cache's stats) in every snapshot under ``name``."""
+        self.collectors[name] = fn
+
+    def snapshot(self):
+        with self._lock:
+            histograms = {name: h.summary() for name, h in sorted(self.histograms.items())}
+            counters = dict(sorted(self.counters.items()))
+        collected = {}
+        for name, fn in self.collectors.items():
+            try:
+                collected[name] = fn()
+            except Exception as e:
+                collected[name] = {"error": str(e)}
+        return {"latency_ms": histograms, "counters": counters, "stats": collected}
+
+
+registry = Registry()
+
+
+class RequestTiming:
+    """Stage durations of one request, rendered as a Server-Timing header."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = []
+
+    def add(self, name, duration_ms):
+        self.stages.append((name, duration_ms))
+
+    def header(self):
+        entries = [f"{_NON_TOKEN.sub('_', name)};dur={duration:.1f}" for name, duration in self.stages]
+        entries.append(f"total;dur={(time.perf_counter() - self.start) * 1000:.1f}")
+        return ", ".join(entries)
+
+
+class _Stage:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = (time.perf_counter() - self.start) * 1000
+        registry.observe(self.name, duration)
+        timing = _current_timing.get()
+        if timing is not None:
+            timing.add(self.name, duration)
+        return False
+
+
+def stage(name):
+    """Context manager timing one stage of the hot path."""
+    if not ENABLED:
+        return _NULL_CONTEXT
+    return _Stage(name)
+
+
+def incr(name, amount=1):
+    if ENABLED:
+        registry.incr(name, amount)
+
+
+def start_request():
+    """Begin collecting Server-Timing entries for the request on this thread."""
+    if not ENABLED:
+        return None
+    timing = RequestTiming()
+    _current_timing.set(timing)
+    return timing
+
+
+def finish_request(route):
+    """Record the total latency of the current request and stop collecting."""
+    timing = _current_timing.get()
+    if timing is None:
+        return
+    registry.observe(f"request:{route}", (time.perf_counter() - timing.start) * 1000)
+    _current_timing.set(None)
+
+
+def server_timing_header():
+    """Server-Timing value for the current request, or None when not timing."""
+    timing = _current_timing.get()
+    return timing.header() if timing is not None else None
+
+
+def _dump_at_exit():
+    path = os.getenv("METRICS_DUMP")
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(registry.snapshot(), f, ensure_ascii=False, indent=2)
+
+
+if ENABLED:
+    # METRICS_DUMP=<path> writes a final snapshot when the process exits (useful for scripts)
+    atexit.register(_dump_at_exit)
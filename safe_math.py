@@ -0,0 +1,191 @@
+"""
+Bounded arithmetic evaluator used by tools.calculate.
+
+Expressions are parsed with ``ast`` and only numeric literals, arithmetic
+operators, a few constants and whitelisted math functions are allowed.
+Operand sizes, exponents and the number of evaluation steps are capped, so
+an expression such as ``9**9**9`` fails fast with a clear error instead of
+pinning a CPU.
+"""
+import ast
+import math
+import operator
+import re
+import unicodedata
+from functools import lru_cache
+
+MAX_EXPRESSION_LENGTH = 500
+MAX_STEPS = 1000
+# Largest integer operand or result, in bits (about 1200 decimal digits)
+MAX_INT_BITS = 4096
+MAX_EXPONENT = 10000
+MAX_FACTORIAL = 450
+
+
+class CalculationError(Exception):
+    """The expression is invalid or exceeds one of the evaluation limits."""
+
+
+def _factorial(n):
+    if isinstance(n, float) and n.is_integer():
+        n = int(n)
+    if not isinstance(n, int) or n < 0:
+        raise CalculationError("factorial() needs a non-negative integer")
+    if n > MAX_FACTORIAL:
+        raise CalculationError(f"factorial() argument exceeds the limit of {MAX_FACTORIAL}")
+    return math.factorial(n)
+
+
+FUNCTIONS = {
+    "abs": abs,
+    "round": round,
+    "min": min,
+    "max": max,
+    "sqrt": math.sqrt,
+    "exp": math.exp,
+    "log": math.log,
+    "log2": math.log2,
+    "log10": math.log10,
+    "sin": math.sin,
+    "cos": math.cos,
+    "tan": math.tan,
+    "asin": math.asin,
+    "acos": math.acos,
+    "atan": math.atan,
+    "atan2": math.atan2,
+    "hypot": math.hypot,
+    "degrees": math.degrees,
+    "radians": math.radians,
+    "floor": math.floor,
+    "ceil": math.ceil,
+    "gcd": math.gcd,
+    "factorial": _factorial,
+}
+
+CONSTANTS = {"pi": math.pi, "e": math.e, "tau": math.tau}
+
+_UNARY_OPERATORS = {ast.UAdd: operator.pos, ast.USub: operator.neg}
+
+
+def _check_int(value):
+    if isinstance(value, complex):
+        raise CalculationError("Result is not a real number")
+    if isinstance(value, int) and value.bit_length() > MAX_INT_BITS:
+        raise CalculationError(f"Intermediate result exceeds {MAX_INT_BITS} bits")
+    return value
+
+
+def _power(base, exponent):
+    if isinstance(exponent, int) and abs(exponent) > MAX_EXPONENT:
+        raise CalculationError(f"Exponent exceeds the limit of {MAX_EXPONENT}")
+    if isinstance(base, int) and isinstance(exponent, int) and exponent > 0:
+        # Predict the result size before computing it
+        if (max(abs(base), 2) - 1).bit_length() * exponent > MAX_INT_BITS:
+            raise CalculationError(f"Result of ** would exceed {MAX_INT_BITS} bits")
+    return base ** exponent
+
+
+def _multiply(left, right):
+    if isinstance(left, int) and isinstance(right, int):
+        if left.bit_length() + right.bit_length() > MAX_INT_BITS + 1:
+            raise CalculationError(f"Result of * would exceed {MAX_INT_BITS} bits")
+    return left * right
+
+
+_BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: _multiply,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: _power,
+}
+
+# A space next to an operator, parenthesis or comma; never dropped between two * or / so "2 * * 3" stays invalid
+_OPERATOR_SPACING = re.compile(r"(?<![*/]) ?(\*\*|//|[-+*/%(),]) ?(?![*/])")
+
+
+class _Evaluator:
+    def __init__(self):
+        self.steps = 0
+
+    def visit(self, node):
+        self.steps += 1
+        if self.steps > MAX_STEPS:
+            raise CalculationError(f"Expression needs more than {MAX_STEPS} evaluation steps")
+
+        if isinstance(node, ast.Expression):
+            return self.visit(node.body)
+        if isinstance(node, ast.Constant):
+            if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+                raise CalculationError("Only numbers are allowed")
+            return _check_int(node.value)
+        if isinstance(node, ast.Name):
+            if node.id not in CONSTANTS:
+                raise CalculationError(f"Unknown name: {node.id}")
+            return CONSTANTS[node.id]
+        if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPERATORS:
+            return _UNARY_OPERATORS[type(node.op)](self.visit(node.operand))
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPERATORS:
+            left = self.visit(node.left)
+            right = self.visit(node.right)
+            return _check_int(_BINARY_OPERATORS[type(node.op)](left, right))
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS or node.keywords:
+                raise CalculationError("Only whitelisted math functions can be called")
+            args = [self.visit(arg) for arg in node.args]
+            return _check_int(FUNCTIONS[node.func.id](*args))
+        raise CalculationError(f"Unsupported syntax: {type(node).__name__}")
+
+
+def normalize_expression(expression):
+    """
+    Canonical form used for parsing and as the memoization key.
+
+    Maps full-width characters, × ÷ and ^ to Python operators and drops
+    whitespace around operators and parentheses. Whitespace between other
+    tokens is kept (collapsed to one space), so "1 2" stays invalid
+    instead of becoming 12.
+    """
+    text = unicodedata.normalize("NFKC", expression)
+    text = text.replace("×", "*").replace("÷", "/").replace("^", "**")
+    text = " ".join(text.split())
+    return _OPERATOR_SPACING.sub(r"\1", text)
+
+
+@lru_cache(maxsize=256)
+def _evaluate_normalized(expression):
+    try:
+        tree = ast.parse(expression, mode="eval")
+    except SyntaxError:
+        raise CalculationError("Invalid expression")
+    try:
+        result = _Evaluator().visit(tree)
+    except CalculationError:
+        raise
+    except ZeroDivisionError:
+        raise CalculationError("Division by zero")
+    except OverflowError:
+        raise CalculationError("Numeric overflow")
+    except (ValueError, TypeError) as e:
+        raise CalculationError(f"Invalid expression: {e}")
+    if isinstance(result, float) and not math.isfinite(result):
+        raise CalculationError("Result is not a finite number")
+    return result
+
+
+def evaluate(expression):
+    """
+    Evaluate an arithmetic expression within the configured limits.
+
+    Results are memoized by normalized expression.
+
+    Raises:
+        CalculationError: the expression is invalid or exceeds a limit
+    """
+    if not isinstance(expression, str) or not expression.strip():
+        raise CalculationError("Expression is required")
+    if len(expression) > MAX_EXPRESSION_LENGTH:
+        raise CalculationError(f"Expression is longer than {MAX_EXPRESSION_LENGTH} characters")
+    return _evaluate_normalized(normalize_expression(expression))
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""
+独立部署用的 HTTP 服务：一个进程同时提供图像接口（api/index.py）和问答接口（api/query.py）
+
+路由与 vercel.json 一致：/api/query 交给问答接口，/api 下的其他路径交给图像接口。
+
+    python server.py --port 8000 --workers 4
+"""
+import argparse
+import importlib.util
+import os
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import urllib.parse
+from http.server import ThreadingHTTPServer
+
+import capture
+import metrics
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# 请求体上限，超过时返回 413
+MAX_BODY_BYTES = int(os.getenv("SERVER_MAX_BODY_BYTES", 1024 * 1024))
+
+# 空闲的长连接保持多久（秒）
+KEEPALIVE_TIMEOUT = float(os.getenv("SERVER_KEEPALIVE_TIMEOUT", 15))
+
+# 收到 SIGTERM 后等待进行中的请求和异步任务完成的最长时间（秒）
+DRAIN_TIMEOUT = float(os.getenv("SERVER_DRAIN_TIMEOUT", 30))
+
+# 各类路由同时处理的请求数上限，0 表示不限制；可用 SERVER_LIMIT_<路由> 覆盖
+DEFAULT_ROUTE_LIMITS = {"image": 32, "batch": 4, "jobs": 64, "query": 32}
+
+# 路由满载时等待空位的时间（秒），仍然没有空位则返回 503
+LIMIT_WAIT = float(os.getenv("SERVER_LIMIT_WAIT", 0.5))
+
+# 工作进程启动时预先创建 Groq、上游 HTTP 客户端和图片服务商路由，设为 0 则在第一个请求时创建
+WARM_UP = os.getenv("SERVER_WARM_UP", "1") != "0"
+
+
+def _load(name, filename):
+    # api 目录不是包，按文件路径加载
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class RouteLimiter:
+    """按路由限制并发请求数，一类请求变慢时不会占满所有线程、拖垮其他接口"""
+
+    def __init__(self, limits, wait=LIMIT_WAIT):
+        self.wait = wait
+        self._slots = {route: threading.BoundedSemaphore(limit) for route, limit in limits.items() if limit > 0}
+        self._lock = threading.Lock()
+        self.limits = dict(limits)
+        self.active = dict.fromkeys(limits, 0)
+        self.rejected = dict.fromkeys(limits, 0)
+
+    @classmethod
+    def from_env(cls):
+        limits = {
+            route: int(os.getenv(f"SERVER_LIMIT_{route.upper()}", default))
+            for route, default in DEFAULT_ROUTE_LIMITS.items()
+        }
+        return cls(limits)
+
+    def acquire(self, route):
+        """
+        Returns:
+            bool: 没有空位时返回 False，调用方应拒绝请求
+        """
+        slots = self._slots.get(route)
+        if slots is not None and not slots.acquire(timeout=self.wait):
+            with self._lock:
+                self.rejected[route] += 1
+            metrics.incr(f"server_rejected:{route}")
+            return False
+        with self._lock:
+            self.active[route] += 1
+        return True
+
+    def release(self, route):
+        with self._lock:
+            self.active[route] -= 1
+        slots = self._slots.get(route)
+        if slots is not None:
+            slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                route: {"active": self.active[route], "limit": self.limits[route], "rejected": self.rejected[route]}
+                for route in self.limits
+            }
+
+
+class AppServer(ThreadingHTTPServer):
+    """
+    每个连接一个线程的 HTTP 服务，记录进行中的请求数以便平滑退出
+
+    传入 sock 时使用已经监听的套接字（多进程模式下由主进程创建、所有子进程共享）。
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, handler_class, sock=None, limiter=None):
+        super().__init__(address, handler_class, bind_and_activate=sock is None)
+        if sock is not None:
+            self.socket.close()
+            self.socket = sock
+            self.server_address = sock.getsockname()
+        self.limiter = limiter or RouteLimiter.from_env()
+        self.draining = False
+        self._in_flight = 0
+        self._idle = threading.Condition()
+
+    def begin_request(self):
+        with self._idle:
+            self._in_flight += 1
+
+    def end_request(self):
+        with self._idle:
+            self._in_flight -= 1
+            if self._in_flight == 0:
+                self._idle.notify_all()
+
+    def wait_idle(self, timeout):
+        """等待进行中的请求全部完成，超时返回 False"""
+        deadline = time.monotonic() + timeout
+        with self._idle:
+            while self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def stats(self):
+        with self._idle:
+            in_flight = self._in_flight
+        return {"pid": os.getpid(), "in_flight": in_flight, "draining": self.draining, "routes": self.limiter.stats()}
+
+
+class ServerHandlerMixin:
+    """
+    在图像和问答两个处理器之上加入长连接、请求体上限和按路由限流
+
+    两个处理器的方法名互不冲突（do_GET / do_POST 除外），这里按路径显式调用各自的 do_GET / do_POST。
+    """
+
+    protocol_version = "HTTP/1.1"
+    # 空闲长连接的读超时，超时后关闭连接、释放线程
+    timeout = KEEPALIVE_TIMEOUT
+
+    image_handler = None
+    query_handler = None
+
+    def do_GET(self):
+        path = urllib.parse.urlsplit(self.path).path.rstrip("/")
+        if path == "/api/query":
+            self.serve("query", self.query_handler.do_GET)
+        elif path == "/api" or path.startswith("/api/"):
+            # /stats、/metrics 和任务查询很轻，不限流
+            self.serve(None, self.image_handler.do_GET)
+        else:
+            self.reject(404, "Not found")
+
+    def do_POST(self):
+        if not self.check_body():
+            return
+        path = urllib.parse.urlsplit(self.path).path.rstrip("/")
+        if path == "/api/query":
+            self.serve("query", self.query_handler.do_POST)
+        elif path == "/api/batch":
+            self.serve("batch", self.image_handler.do_POST)
+        elif path == "/api/jobs":
+            self.serve("jobs", self.image_handler.do_POST)
+        elif path == "/api":
+            self.serve("image", self.image_handler.do_POST)
+        else:
+            self.reject(404, "Not found")
+
+    def check_body(self):
+        """
+        只接受带 Content-Length 且不超过上限的请求体
+
+        拒绝时请求体没有读取，连接无法继续复用，随响应一起关闭。
+        """
+        if self.headers.get("Transfer-Encoding"):
+            self.reject(411, "Content-Length is required", close=True)
+            return False
+        try:
+            length = int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            self.reject(411, "Content-Length is required", close=True)
+            return False
+        if length < 0:
+            self.reject(400, "Invalid Content-Length", close=True)
+            return False
+        if length > MAX_BODY_BYTES:
+            metrics.incr("server_body_too_large")
+            self.reject(413, f"Request body exceeds {MAX_BODY_BYTES} bytes", close=True)
+            return False
+        return True
+
+    def serve(self, route, method):
+        server = self.server
+        if server.draining:
+            self.reject(503, "Server is shutting down")
+            return
+        if route is not None and not server.limiter.acquire(route):
+            self.reject(503, f"Too many concurrent {route} requests", {"Retry-After": "1"})
+            return
+        server.begin_request()
+        try:
+            method(self)
+        finally:
+            server.end_request()
+            if route is not None:
+                server.limiter.release(route)
+
+    def reject(self, status, error, headers=None, close=False):
+        """返回错误；close 为 True 时请求体无法读取，响应后关闭连接"""
+        headers = dict(headers or {})
+        if close:
+            headers["Connection"] = "close"
+        elif self.command == "POST":
+            # 读掉未处理的请求体，连接才能继续复用
+            self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_json(status, {"error": error}, headers)
+
+    def end_headers(self):
+        # 退出过程中通知客户端不要再复用这个连接
+        if self.server.draining and not self.close_connection:
+            self.send_header("Connection", "close")
+        super().end_headers()
+
+
+def create_handler(quiet=False, warm_up=WARM_UP):
+    """加载两个接口模块，组合出服务使用的处理器类"""
+    index = _load("api_index", os.path.join("api", "index.py"))
+    query = _load("api_query", os.path.join("api", "query.py"))
+    if warm_up:
+        # 在开始接受连接之前导入 SDK、创建共享客户端
+        import tools
+        index.warm_up()
+        tools.warm_up()
+    attrs = {"image_handler": index.handler, "query_handler": query.handler, "image_jobs": index.image_jobs}
+    if quiet:
+        attrs["log_message"] = lambda self, *args: None
+    return type("AppHandler", (ServerHandlerMixin, query.handler, index.handler), attrs)
+
+
+def run_worker(sock, quiet=False):
+    """
+    在已监听的套接字上处理请求，直到收到 SIGTERM / SIGINT
+
+    退出时先停止接受新连接，再等待进行中的请求和已提交的异步任务完成（最多 DRAIN_TIMEOUT 秒）。
+    """
+    handler_class = create_handler(quiet)
+    server = AppServer(sock.getsockname(), handler_class, sock=sock)
+    metrics.registry.register_collector("server", server.stats)
+
+    def stop(signum, frame):
+        if server.draining:
+            return
+        server.draining = True
+        # shutdown() 要等 serve_forever() 返回，不能在运行 serve_forever() 的主线程里直接调用
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    print(f"[{os.getpid()}] serving on http://{server.server_address[0]}:{server.server_address[1]}", flush=True)
+    server.serve_forever()
+
+    deadline = time.monotonic() + DRAIN_TIMEOUT
+    drained = server.wait_idle(DRAIN_TIMEOUT)
+    drained = handler_class.image_jobs.drain(max(0.0, deadline - time.monotonic())) and drained
+    print(f"[{os.getpid()}] {'drained' if drained else 'drain timed out'}, exiting", flush=True)
+    server.server_close()
+    # 子进程以 os._exit 退出，不会执行 atexit，先写出还在队列中的记录
+    capture.close()
+
+
+def shared_job_store():
+    """
+    多进程模式下使用的任务存储配置
+
+    内存中的任务存储只对创建任务的进程可见，轮询请求落到其他进程时会得到 404，
+    所以 JOB_STORE 未设置或为 memory 时改用所有工作进程共享的 SQLite 数据库。
+    """
+    spec = os.getenv("JOB_STORE", "memory")
+    if spec and spec != "memory":
+        return spec
+    path = os.getenv("SERVER_JOB_DB", os.path.join(tempfile.gettempdir(), "image-jobs.sqlite3"))
+    return f"sqlite:{path}"
+
+
+def serve(host, port, workers=1, quiet=False):
+    """
+    监听端口并启动 workers 个工作进程（pre-fork）
+
+    套接字在 fork 之前创建，内核在各进程间分配新连接。接口模块在子进程中才加载，
+    缓存、连接池和线程都各自独立；磁盘缓存和 SQLite 数据库在进程间共享，
+    异步任务存储也换成共享的 SQLite（见 shared_job_store）。
+    子进程意外退出时自动补上，收到 SIGTERM / SIGINT 时转发给所有子进程并等待它们平滑退出。
+    """
+    sock = socket.create_server((host, port), backlog=128)
+    if workers <= 1:
+        run_worker(sock, quiet)
+        return
+
+    job_store = shared_job_store()
+    if job_store != os.getenv("JOB_STORE"):
+        print(f"JOB_STORE is in-memory, using {job_store} so all {workers} workers see the same jobs", flush=True)
+    # 子进程在 fork 之后才加载接口模块，会读到这个设置
+    os.environ["JOB_STORE"] = job_store
+
+    children = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                run_worker(sock, quiet)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        children.add(pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(workers):
+        spawn()
+    while children:
+        pid, status = os.wait()
+        children.discard(pid)
+        if not stopping:
+            print(f"worker {pid} exited with status {status}, restarting", file=sys.stderr, flush=True)
+            time.sleep(1)
+            spawn()
+    sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="图像接口和问答接口的独立 HTTP 服务")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", 8000)))
+    parser.add_argument("--workers", "-w", type=int, default=int(os.getenv("SERVER_WORKERS", 1)),
+                        help="工作进程数，通常设为 CPU 核数")
+    parser.add_argument("--quiet", "-q", action="store_true", help="不打印访问日志")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, args.quiet)
+
+
+if __name__ == "__main__":
+    main()
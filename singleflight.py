@@ -0,0 +1,105 @@
+import threading
+
+
+class FlightTimeout(Exception):
+    """等待共享调用结果超时"""
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        # 所有等待者都离开后置位，由执行函数自行检查并提前结束
+        self.cancelled = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    合并相同键的并发调用：同一时刻只有第一个请求真正执行函数，
+    其余请求等待并共享同一个结果。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.calls = 0
+        self.upstream_calls = 0
+        self.shared = 0
+        self.timeouts = 0
+        self.abandoned = 0
+
+    def do(self, key, fn, timeout=None):
+        """
+        执行或加入一次调用
+
+        Args:
+            key (str): 调用的唯一键，键相同的并发调用会被合并
+            fn (callable): 实际执行的函数，接收一个 threading.Event 参数，
+                所有等待者都放弃时该事件会被置位
+            timeout (float, optional): 当前等待者的超时时间（秒）
+
+        Returns:
+            tuple: (函数返回值, 是否复用了其他请求发起的调用)
+
+        Raises:
+            FlightTimeout: 等待超时
+        """
+        with self._lock:
+            self.calls += 1
+            flight = self._flights.get(key)
+            shared = flight is not None
+            if shared:
+                self.shared += 1
+            else:
+                flight = _Flight()
+                self._flights[key] = flight
+                self.upstream_calls += 1
+            flight.waiters += 1
+
+        if not shared:
+            # 在独立线程中执行，使每个等待者（包括发起者）都能单独超时
+            thread = threading.Thread(target=self._run, args=(key, flight, fn), daemon=True)
+            thread.start()
+
+        finished = flight.done.wait(timeout)
+
+        with self._lock:
+            flight.waiters -= 1
+            if not finished:
+                self.timeouts += 1
+                if flight.waiters == 0 and not flight.done.is_set():
+                    # 没有人再等待结果：通知执行函数取消，并让后续请求重新发起调用
+                    flight.cancelled.set()
+                    self.abandoned += 1
+                    if self._flights.get(key) is flight:
+                        del self._flights[key]
+
+        if not finished:
+            raise FlightTimeout(f"Timed out after {timeout} seconds")
+        if flight.error is not None:
+            raise flight.error
+        return flight.result, shared
+
+    def _run(self, key, flight, fn):
+        try:
+            flight.result = fn(flight.cancelled)
+        except Exception as e:
+            flight.error = e
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "upstream_calls": self.upstream_calls,
+                "saved_upstream_calls": self.shared,
+                "timeouts": self.timeouts,
+                "abandoned": self.abandoned,
+                "in_flight": len(self._flights),
+            }
@@ -0,0 +1,36 @@
+import importlib
+import sys
+
+import answer_cache
+from answer_cache import AnswerCache
+
+
+def test_corrupt_file_disables_the_cache(tmp_path, monkeypatch):
+    path = tmp_path / "answers.sqlite3"
+    path.write_bytes(b"this is not a database" * 64)
+    monkeypatch.setenv("ANSWER_CACHE_PATH", str(path))
+    monkeypatch.setenv("GROQ_API_KEY", "test")
+    monkeypatch.delitem(sys.modules, "tools", raising=False)
+
+    tools = importlib.import_module("tools")
+
+    assert tools.get_cached_answer("what is the capital of france") is None
+    tools.cache_answer("what is the capital of france", "search", "Paris")
+    assert tools.get_cached_answer("what is the capital of france") is None
+    stats = tools.answer_cache.stats()
+    assert stats["disabled"] is True
+    assert stats["errors"] == 1
+
+
+def test_hits_only_refresh_stale_access_times(tmp_path, monkeypatch):
+    cache = AnswerCache(str(tmp_path / "answers.sqlite3"))
+    cache.set("1+1", "calculate", "2")
+    conn = cache._connection()
+    stored = conn.execute("SELECT last_access FROM answers").fetchone()[0]
+
+    assert cache.get("1 + 1") == ("calculate", "2")
+    assert conn.execute("SELECT last_access FROM answers").fetchone()[0] == stored
+
+    monkeypatch.setattr(answer_cache.time, "time", lambda: stored + answer_cache.ACCESS_UPDATE_INTERVAL + 1)
+    assert cache.get("1 + 1") == ("calculate", "2")
+    assert conn.execute("SELECT last_access FROM answers").fetchone()[0] > stored
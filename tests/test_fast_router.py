@@ -0,0 +1,28 @@
+import pytest
+
+from fast_router import CALCULATE, NO_TOOL, SEARCH, local_route
+
+
+@pytest.mark.parametrize("query", [
+    "what is 7 plus 8",
+    "what is 15% of 200",
+    "What is 3.5 times 2",
+    "what is 2 to the power of 10",
+    "what is the square root of 144",
+    "什么是三乘以五",
+    "二的平方是什么",
+])
+def test_math_questions_are_left_to_the_model(query):
+    assert local_route(query) is None
+
+
+@pytest.mark.parametrize("query, route", [
+    ("1 + 2", CALCULATE),
+    ("计算 3*4", CALCULATE),
+    ("what is the capital of France", SEARCH),
+    ("谁是爱因斯坦", SEARCH),
+    ("hello", NO_TOOL),
+    ("what is your name", None),
+])
+def test_obvious_queries_are_routed_locally(query, route):
+    assert local_route(query) == route
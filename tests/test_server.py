@@ -0,0 +1,84 @@
+import http.client
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from bench.fakes import FakeConfig, make_server
+from bench.run import ROOT, _free_port
+
+
+@pytest.fixture
+def fake_upstreams():
+    config = FakeConfig()
+    for profile in config.profiles.values():
+        profile.latency_ms = 20
+        profile.jitter_ms = 0
+    server = make_server(config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def request(port, method, path, body=None):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    try:
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        connection.request(method, path, json.dumps(body) if body is not None else None, headers)
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+
+def test_jobs_are_visible_from_every_worker(fake_upstreams, tmp_path):
+    port = _free_port()
+    env = dict(
+        os.environ,
+        CLOUDFLARE_API_BASE=f"{fake_upstreams}/client/v4",
+        GROQ_BASE_URL=fake_upstreams,
+        GROQ_API_KEY="test",
+        IMAGE_PROVIDERS="cloudflare",
+        IMAGE_CACHE_DISK_BYTES="0",
+        SERVER_JOB_DB=str(tmp_path / "jobs.sqlite3"),
+        SERVER_WARM_UP="0",
+    )
+    env.pop("JOB_STORE", None)
+    process = subprocess.Popen(
+        [sys.executable, "server.py", "--host", "127.0.0.1", "--port", str(port), "--workers", "2", "--quiet"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + 20
+        while True:
+            try:
+                status, _ = request(port, "GET", "/api/stats")
+                break
+            except ConnectionError:
+                assert time.monotonic() < deadline, "server did not start"
+                time.sleep(0.05)
+
+        status, body = request(port, "POST", "/api/jobs", {"prompt": "a lighthouse at dusk"})
+        assert status == 202
+        job_id = json.loads(body)["job_id"]
+
+        # Each poll is a new connection, so the kernel spreads them over both workers
+        statuses = []
+        for _ in range(40):
+            status, body = request(port, "GET", f"/api/jobs/{job_id}")
+            assert status == 200, body
+            statuses.append(json.loads(body)["status"])
+            time.sleep(0.02)
+        assert statuses[-1] == "succeeded"
+
+        status, _ = request(port, "GET", f"/api/jobs/{job_id}/result")
+        assert status == 200
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=30)
@@ -0,0 +1,79 @@
+from types import SimpleNamespace
+
+import pytest
+
+import tools
+from answer_cache import AnswerCache
+from ttl_cache import TTLCache
+
+
+def text_chunk(text):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text, tool_calls=None))])
+
+
+def tool_call_chunk(name, arguments):
+    function = SimpleNamespace(name=name, arguments=arguments)
+    call = SimpleNamespace(index=0, id="call_1", function=function)
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=None, tool_calls=[call]))])
+
+
+class FakeGroq:
+    """Replays one canned stream per chat completion call"""
+
+    def __init__(self, *streams):
+        self.streams = list(streams)
+        self.sent = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        for chunk in self.streams.pop(0):
+            self.sent += 1
+            yield chunk
+
+
+@pytest.fixture
+def caches(tmp_path, monkeypatch):
+    monkeypatch.setattr(tools, "answer_cache", AnswerCache(str(tmp_path / "answers.sqlite3")))
+    monkeypatch.setattr(tools, "route_cache", TTLCache())
+    monkeypatch.setattr(tools, "ROUTER_FAST_PATH", True)
+
+
+def test_tool_call_after_flushed_text_runs_the_tool_and_is_not_cached(caches, monkeypatch):
+    query = "so what about blorp anyway"
+    preamble = ["Let me work that out for you. " * 2] * 4
+    monkeypatch.setattr(tools, "STREAM_PREAMBLE_CHARS", 160)
+    groq = FakeGroq(
+        [text_chunk(text) for text in preamble] + [tool_call_chunk("calculate", '{"expression": "6*7"}')],
+        [text_chunk("The answer is 42.")],
+    )
+    monkeypatch.setattr(tools, "get_groq_client", lambda: groq)
+
+    events = list(tools.process_query_stream(query))
+
+    kinds = [event["event"] for event in events]
+    assert sum(len(text) for text in preamble) == 240
+    assert kinds.count("route") == 2
+    assert "tool_result" in kinds
+    done = events[-1]
+    assert done["event"] == "done"
+    assert done["route"] == "calculate"
+    assert done["response"] == "".join(preamble) + "The answer is 42."
+    assert "".join(event["content"] for event in events if event["event"] == "token") == done["response"]
+    assert tools.route_cache.get(tools.normalize_query(query)) is None
+    assert tools.answer_cache.get(query) is None
+
+
+def test_text_is_streamed_before_the_reply_ends_by_default(caches, monkeypatch):
+    query = "so what about blorp anyway"
+    stream = FakeGroq([text_chunk("Blorp "), text_chunk("is not a word.")])
+    monkeypatch.setattr(tools, "get_groq_client", lambda: stream)
+
+    events = tools.process_query_stream(query)
+
+    assert next(events) == {"event": "route", "route": "no tool needed"}
+    assert next(events) == {"event": "token", "content": "Blorp "}
+    # Sent before the rest of the reply has been read
+    assert stream.sent == 1
+    done = list(events)[-1]
+    assert done["response"] == "Blorp is not a word."
+    assert tools.answer_cache.get(query) == ("no tool needed", "Blorp is not a word.")
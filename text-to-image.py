@@ -1,17 +1,24 @@
-import requests
+import asyncio
 import urllib.parse
 import os
-from typing import Optional, Dict, Union
+import tempfile
+from typing import AsyncIterator, Dict, List, Optional, Union
+
+from upstream import get_client
 
 class PollinationsAI:
     """A simple client for the Pollinations.AI image generation API"""
     
-    def __init__(self):
-        self.base_url = "https://image.pollinations.ai/prompt/"
+    def __init__(self, base_url: Optional[str] = None):
+        self.base_url = base_url or os.getenv("POLLINATIONS_BASE_URL", "https://image.pollinations.ai/prompt/")
     
     def generate_image(self, prompt: str, save_path: Optional[str] = None) -> Dict[str, Union[bool, str]]:
         """
         Generate an image from a text prompt using Pollinations.AI
+
+        A single streamed GET both checks that generation succeeded and, when
+        save_path is given, downloads the image chunk by chunk; without
+        save_path the body is read and discarded.
         
         Args:
             prompt (str): The text prompt to generate the image
@@ -25,26 +32,30 @@ class PollinationsAI:
             encoded_prompt = urllib.parse.quote(prompt)
             image_url = self.base_url + encoded_prompt
             
-            # Verify if the URL is accessible
-            response = requests.head(image_url)
-            if response.status_code != 200:
-                return {
-                    "success": False,
-                    "error": f"Failed to generate image: Status code {response.status_code}"
+            with get_client().get(image_url, stream=True) as response:
+                if response.status_code != 200:
+                    return {
+                        "success": False,
+                        "error": f"Failed to generate image: Status code {response.status_code}"
+                    }
+                
+                result = {
+                    "success": True,
+                    "image_url": image_url,
+                    "prompt": prompt
                 }
-            
-            result = {
-                "success": True,
-                "image_url": image_url,
-                "prompt": prompt
-            }
-            
-            # Save the image if a path is provided
-            if save_path:
-                if self._save_image(image_url, save_path):
-                    result["saved_path"] = save_path
+                
+                # Save the image if a path is provided
+                if save_path:
+                    if self._save_image(response, save_path):
+                        result["saved_path"] = save_path
+                    else:
+                        result["save_error"] = "Failed to save image"
                 else:
-                    result["save_error"] = "Failed to save image"
+                    # Read the body to the end so the connection goes back to the pool;
+                    # closing it half-read would drop the connection instead
+                    for _ in response.iter_content(chunk_size=65536):
+                        pass
             
             return result
             
@@ -54,50 +65,80 @@ class PollinationsAI:
                 "error": str(e)
             }
     
-    def _save_image(self, url: str, filename: str) -> bool:
+    def _save_image(self, response, filename: str) -> bool:
         """
-        Download and save an image from a URL
+        Write a streamed image response to disk
+
+        The image is written to a temporary file next to ``filename`` and moved
+        into place once complete, so a failed download leaves no partial file.
         
         Args:
-            url (str): The URL of the image
+            response: The open response of the image request
             filename (str): The path where to save the image
             
         Returns:
             bool: True if successful, False otherwise
         """
+        tmp_path = None
         try:
-            response = requests.get(url, stream=True)
-            if response.status_code == 200:
-                with open(filename, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        f.write(chunk)
-                return True
-            return False
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)), suffix=".tmp")
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=8192):
+                    f.write(chunk)
+            os.replace(tmp_path, filename)
+            tmp_path = None
+            return True
         except Exception as e:
             print(f"Error saving image: {str(e)}")
             return False
+        finally:
+            if tmp_path is not None:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
 
-def main():
-    # 创建 PollinationsAI 客户端
-    client = PollinationsAI()
-    
-    # 示例提示词
-    prompts = [
-        "conceptual isometric world of pollinations ai surreal hyperrealistic digital garden",
-        "beautiful sunset over mountains in watercolor style",
-        "cyberpunk city at night with neon lights and flying cars"
-    ]
-    
-    # 为每个提示词生成图片
-    for i, prompt in enumerate(prompts, 1):
-        print(f"\n生成图片 {i}/{len(prompts)}")
-        print(f"提示词: {prompt}")
+    async def generate_many(self, prompts: List[str], concurrency: int = 4,
+                            output_dir: Optional[str] = None) -> AsyncIterator[Dict[str, Union[bool, str, int]]]:
+        """
+        Generate several images in parallel, yielding each result as soon as it completes
+
+        Downloads run in worker threads over the shared connection pool, at most
+        ``concurrency`` at a time, and are written to disk chunk by chunk.
         
-        # 生成图片并保存
-        result = client.generate_image(
-            prompt=prompt,
-            save_path=f"generated_image_{i}.jpg"
-        )
+        Args:
+            prompts (list): The text prompts
+            concurrency (int): Maximum number of images generated at once
+            output_dir (str, optional): Directory to save the images in, as
+                generated_image_<n>.jpg with n the 1-based position in prompts
+            
+        Yields:
+            dict: The generate_image result plus "index", the position in prompts
+        """
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def generate(index: int, prompt: str):
+            save_path = os.path.join(output_dir, f"generated_image_{index + 1}.jpg") if output_dir else None
+            async with semaphore:
+                result = await asyncio.to_thread(self.generate_image, prompt, save_path)
+            return dict(result, index=index)
+
+        tasks = [asyncio.ensure_future(generate(i, prompt)) for i, prompt in enumerate(prompts)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # The caller stopped early: don't start the remaining downloads
+            for task in tasks:
+                task.cancel()
+
+async def generate_all(client: PollinationsAI, prompts: List[str]):
+    # 并行生成，按完成顺序显示结果
+    async for result in client.generate_many(prompts, concurrency=len(prompts), output_dir="."):
+        print(f"\n图片 {result['index'] + 1}/{len(prompts)}")
+        print(f"提示词: {result.get('prompt', prompts[result['index']])}")
         
         # 显示结果
         if result["success"]:
@@ -111,5 +152,18 @@ def main():
         
         print("-" * 50)
 
+def main():
+    # 创建 PollinationsAI 客户端
+    client = PollinationsAI()
+    
+    # 示例提示词
+    prompts = [
+        "conceptual isometric world of pollinations ai surreal hyperrealistic digital garden",
+        "beautiful sunset over mountains in watercolor style",
+        "cyberpunk city at night with neon lights and flying cars"
+    ]
+    
+    asyncio.run(generate_all(client, prompts))
+
 if __name__ == "__main__":
     main()
@@ -1,79 +1,212 @@
-from groq import Groq
 import json
 import os
-import requests
+import tempfile
+import threading
+import time
+from upstream import get_client, httpx_event_hooks
+from ttl_cache import TTLCache
+from answer_cache import AnswerCache, is_cacheable
+from fast_router import local_route, normalize_query
+from safe_math import evaluate, CalculationError
+import capture
+import metrics
 
-# Initialize the Groq client 
-client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+# The Groq client is created on first use: importing the SDK alone costs a few
+# hundred milliseconds, which requests that never reach a model shouldn't pay
+_groq_client = None
+_groq_client_lock = threading.Lock()
+
+def get_groq_client():
+    """Process-wide Groq client, reused across invocations while the instance stays warm"""
+    global _groq_client
+    if _groq_client is None:
+        with _groq_client_lock:
+            if _groq_client is None:
+                from groq import DefaultHttpxClient, Groq
+                options = {}
+                if metrics.ENABLED:
+                    # Count Groq calls in the upstream latency, status and byte metrics
+                    options["http_client"] = DefaultHttpxClient(event_hooks=httpx_event_hooks())
+                _groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"), **options)
+    return _groq_client
+
+def __getattr__(name):
+    # `tools.client` still works for callers written before the client became lazy
+    if name == "client":
+        return get_groq_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def warm_up():
+    """Import the SDKs and build the shared clients ahead of the first request (for long-running servers)"""
+    get_groq_client()
+    get_client()
 
 # Define models
 ROUTING_MODEL = "llama3-70b-8192"
 TOOL_USE_MODEL = "llama-3.3-70b-versatile"
 GENERAL_MODEL = "llama3-70b-8192"
 
+# Wikipedia language edition used by web_search
+WIKIPEDIA_LANG = os.getenv("WIKIPEDIA_LANG", "zh")
+WIKIPEDIA_API_URL = os.getenv("WIKIPEDIA_API_URL", f"https://{WIKIPEDIA_LANG}.wikipedia.org/w/api.php")  # 默认使用中文维基百科
+
+# Local index built with `python wiki_index.py build <dump>`; when set, web_search
+# answers from it and only calls the Wikipedia API on a miss
+WIKI_INDEX_PATH = os.getenv("WIKI_INDEX_PATH")
+wiki_index = None
+if WIKI_INDEX_PATH:
+    from wiki_index import WikiIndex
+    wiki_index = WikiIndex(WIKI_INDEX_PATH)
+
+# Search results keyed by language and normalized query, kept in memory and on disk
+search_cache = TTLCache(
+    max_entries=int(os.getenv("SEARCH_CACHE_ENTRIES", 512)),
+    ttl=float(os.getenv("SEARCH_CACHE_TTL", 3600)),
+    directory=os.getenv("SEARCH_CACHE_DIR", os.path.join(tempfile.gettempdir(), "search-cache")),
+    max_disk_entries=int(os.getenv("SEARCH_CACHE_DISK_ENTRIES", 4096)),
+)
+
+# Earlier routing decisions keyed by normalized query (memory only)
+route_cache = TTLCache(
+    max_entries=int(os.getenv("ROUTE_CACHE_ENTRIES", 1024)),
+    ttl=float(os.getenv("ROUTE_CACHE_TTL", 3600)),
+)
+
+# Final answers keyed by normalized query and route, persisted in SQLite
+# (None when ANSWER_CACHE_PATH is set to an empty string)
+answer_cache = AnswerCache.from_env()
+
+# Answers starting with this are error messages and must not be cached
+ERROR_RESPONSE_PREFIX = "抱歉，处理您的请求时出现了错误"
+
+# Set ROUTER_FAST_PATH=0 to always ask the routing model
+ROUTER_FAST_PATH = os.getenv("ROUTER_FAST_PATH", "1") != "0"
+
+# How each routing decision was made: local rules, cache, the routing model,
+# or the combined route-and-answer call
+router_counts = {"local": 0, "cached": 0, "llm": 0, "combined": 0}
+_router_counts_lock = threading.Lock()
+
+metrics.registry.register_collector("search_cache", lambda: search_cache.stats())
+metrics.registry.register_collector("route_cache", lambda: route_cache.stats())
+metrics.registry.register_collector("router", lambda: router_stats())
+if answer_cache is not None:
+    metrics.registry.register_collector("answer_cache", answer_cache.stats)
+if wiki_index is not None:
+    metrics.registry.register_collector("wiki_index", wiki_index.stats)
+
+def _count_route(source):
+    with _router_counts_lock:
+        router_counts[source] += 1
+
+def router_stats():
+    """Routing decision counts and the share of separate routing model calls avoided"""
+    with _router_counts_lock:
+        counts = dict(router_counts)
+    total = sum(counts.values())
+    avoided = total - counts["llm"]
+    counts["llm_calls_avoided"] = avoided / total if total else 0.0
+    return counts
+
 def calculate(expression):
     """Tool to evaluate a mathematical expression"""
     try:
-        result = eval(expression)
+        result = evaluate(expression)
         return json.dumps({"result": result})
-    except:
-        return json.dumps({"error": "Invalid expression"})
+    except CalculationError as e:
+        return json.dumps({"error": str(e)})
+
+def _normalize_search_query(query):
+    """Fold case and whitespace so trivially different queries share a cache entry"""
+    return " ".join(query.split()).casefold()
 
 def web_search(query):
     """Tool to perform a search using Wikipedia API"""
     try:
+        cache_key = f"{WIKIPEDIA_LANG}:{_normalize_search_query(query)}"
+        cached = search_cache.get(cache_key)
+        if cached is not None:
+            return json.dumps({"results": cached})
+
+        if wiki_index is not None:
+            with metrics.stage("wiki_index"):
+                results = wiki_index.search(query)
+            if results:
+                metrics.incr("wiki_index_hit")
+                return json.dumps({"results": results})
+            metrics.incr("wiki_index_miss")
+
         # Wikipedia API endpoint
-        base_url = "https://zh.wikipedia.org/w/api.php"  # 使用中文维基百科
+        base_url = WIKIPEDIA_API_URL
         
-        # First, search for relevant pages
-        search_params = {
+        # Search and fetch the intro extracts of the matching pages in one request
+        params = {
             "action": "query",
             "format": "json",
-            "list": "search",
-            "srsearch": query,
-            "srlimit": 3,  # Limit to top 3 results
+            "generator": "search",
+            "gsrsearch": query,
+            "gsrlimit": 3,  # Limit to top 3 results
+            "prop": "extracts|info",
+            "exintro": True,  # Only get the introduction section
+            "explaintext": True,  # Get plain text instead of HTML
+            "exlimit": 3,
+            "inprop": "url",
             "utf8": 1
         }
         
-        search_response = requests.get(base_url, params=search_params)
+        search_response = get_client().get(base_url, params=params)
         if search_response.status_code != 200:
             return json.dumps({"error": f"Search failed with status code {search_response.status_code}"})
             
         search_data = search_response.json()
-        if "query" not in search_data or "search" not in search_data["query"]:
+        if "query" not in search_data or "pages" not in search_data["query"]:
             return json.dumps({"error": "No results found"})
-            
+        
+        # Pages come back keyed by page id; "index" carries the search ranking
+        pages = sorted(search_data["query"]["pages"].values(), key=lambda page: page.get("index", 0))
         results = []
-        for item in search_data["query"]["search"]:
-            # Get detailed page content for each search result
-            content_params = {
-                "action": "query",
-                "format": "json",
-                "prop": "extracts|info",
-                "exintro": True,  # Only get the introduction section
-                "explaintext": True,  # Get plain text instead of HTML
-                "inprop": "url",
-                "pageids": item["pageid"],
-                "utf8": 1
-            }
-            
-            content_response = requests.get(base_url, params=content_params)
-            if content_response.status_code == 200:
-                content_data = content_response.json()
-                page = list(content_data["query"]["pages"].values())[0]
-                
-                results.append({
-                    "title": page.get("title", ""),
-                    "snippet": page.get("extract", "")[:500] + "...",  # Limit snippet length
-                    "link": page.get("fullurl", "")
-                })
+        for page in pages:
+            results.append({
+                "title": page.get("title", ""),
+                "snippet": page.get("extract", "")[:500] + "...",  # Limit snippet length
+                "link": page.get("fullurl", "")
+            })
         
+        search_cache.set(cache_key, results)
         return json.dumps({"results": results})
     except Exception as e:
         return json.dumps({"error": str(e)})
 
+def fast_route(query):
+    """Route from local rules or the decision cache; None when the model has to decide"""
+    if not ROUTER_FAST_PATH:
+        return None
+
+    route = local_route(query)
+    if route is not None:
+        _count_route("local")
+        return route
+
+    route = route_cache.get(normalize_query(query))
+    if route is not None:
+        _count_route("cached")
+        return route
+    return None
+
 def route_query(query):
-    """Routing logic to let LLM decide if tools are needed"""
+    """Pick a route, trying local rules and the decision cache before the routing model"""
+    route = fast_route(query)
+    if route is not None:
+        return route
+
+    _count_route("llm")
+    route = route_query_llm(query)
+    if ROUTER_FAST_PATH:
+        route_cache.set(normalize_query(query), route)
+    return route
+
+def build_routing_messages(query):
+    """Messages asking the routing model whether a tool is needed"""
     routing_prompt = f"""
     Given the following user query, determine if any tools are needed to answer it.
     
@@ -99,17 +232,14 @@ def route_query(query):
 
     Response:
     """
-    
-    response = client.chat.completions.create(
-        model=ROUTING_MODEL,
-        messages=[
-            {"role": "system", "content": "You are a routing assistant. Your job is to determine if external tools are needed to accurately answer the user's query."},
-            {"role": "user", "content": routing_prompt}
-        ],
-        max_completion_tokens=20  # We only need a short response
-    )
-    
-    routing_decision = response.choices[0].message.content.strip()
+    return [
+        {"role": "system", "content": "You are a routing assistant. Your job is to determine if external tools are needed to accurately answer the user's query."},
+        {"role": "user", "content": routing_prompt}
+    ]
+
+def parse_routing_decision(routing_decision):
+    """Map the routing model's reply to a route name"""
+    routing_decision = routing_decision.strip()
     
     if "TOOL: CALCULATE" in routing_decision:
         return "calculate"
@@ -118,16 +248,135 @@ def route_query(query):
     else:
         return "no tool needed"
 
+def route_query_llm(query):
+    """Routing logic to let LLM decide if tools are needed"""
+    with metrics.stage("route_llm"):
+        response = get_groq_client().chat.completions.create(
+            model=ROUTING_MODEL,
+            messages=build_routing_messages(query),
+            max_completion_tokens=20  # We only need a short response
+        )
+    
+    return parse_routing_decision(response.choices[0].message.content)
+
+# Tool schemas offered to the tool use model
+CALCULATE_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "calculate",
+        "description": "Evaluate a mathematical expression",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "expression": {
+                    "type": "string",
+                    "description": "The mathematical expression to evaluate",
+                }
+            },
+            "required": ["expression"],
+        },
+    },
+}
+
+WEB_SEARCH_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "web_search",
+        "description": "Perform a web search query",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "query": {
+                    "type": "string",
+                    "description": "The search query to perform",
+                }
+            },
+            "required": ["query"],
+        },
+    },
+}
+
+TOOL_SYSTEM_PROMPT = """You are an assistant that can perform calculations and web searches. 
+            When using search results, summarize the information in a clear and natural way.
+            For calculations, show both the calculation and the result.
+            Always respond in the same language as the user's query.
+            DO NOT show the function call format in your response."""
+
+COMBINED_SYSTEM_PROMPT = """You are a helpful assistant that can perform calculations and web searches.
+            Call the calculate tool when the query needs a mathematical calculation.
+            Call the web_search tool when the query asks about facts, definitions, technical concepts, current events or general knowledge.
+            If the query is conversational or opinion-based, answer it directly without calling any tool.
+            Always respond in the same language as the user's query.
+            DO NOT show the function call format in your response."""
+
+TOOL_FOLLOW_UP_PROMPT = """请根据上述工具返回的结果，用自然的语言回答我的问题。
+                如果是搜索结果，请总结主要信息；如果是计算结果，请展示计算过程和结果。
+                注意：请直接给出答案，不要显示函数调用的格式。"""
+
+# Tool name reported by the model -> route name
+TOOL_ROUTES = {"calculate": "calculate", "web_search": "search"}
+
+# Set QUERY_PIPELINE=legacy to route with a separate LLM call before the tool call
+QUERY_PIPELINE = os.getenv("QUERY_PIPELINE", "combined")
+
+# When streaming the combined pipeline, text can be held back until it grows past this many
+# characters (or the reply ends) so a short preamble before a tool call is never shown.
+# Off by default: holding text back delays the first token of every direct answer
+STREAM_PREAMBLE_CHARS = int(os.getenv("STREAM_PREAMBLE_CHARS", 0))
+
+def execute_tool_call(function_name, arguments):
+    """Run one tool call from the model and return its JSON result"""
+    function_args = json.loads(arguments)
+    
+    # The name comes from the model; unknown names share one label so they can't grow the metrics
+    label = function_name if function_name in TOOL_ROUTES else "unknown"
+    # Execute the appropriate function
+    with metrics.stage(f"tool:{label}"):
+        if function_name == "calculate":
+            return calculate(function_args.get("expression"))
+        elif function_name == "web_search":
+            return web_search(function_args.get("query"))
+    return json.dumps({"error": f"Unknown tool: {function_name}"})
+
+def answer_with_tool_results(messages, response_message):
+    """Execute the requested tools and make the follow-up call that writes the answer"""
+    # Add the assistant's message with tool calls
+    messages.append(response_message)
+    
+    # Process each tool call
+    for tool_call in response_message.tool_calls:
+        function_response = execute_tool_call(tool_call.function.name, tool_call.function.arguments)
+        
+        # Add the function response to messages
+        messages.append({
+            "tool_call_id": tool_call.id,
+            "role": "tool",
+            "name": tool_call.function.name,
+            "content": function_response,
+        })
+    
+    # Add a prompt to guide the final response
+    messages.append({
+        "role": "user",
+        "content": TOOL_FOLLOW_UP_PROMPT
+    })
+    
+    # Second API call to get the final response
+    with metrics.stage("completion"):
+        second_response = get_groq_client().chat.completions.create(
+            model=TOOL_USE_MODEL,
+            messages=messages,
+            max_completion_tokens=4096
+        )
+    
+    return second_response.choices[0].message.content
+
 def run_with_tool(query, tool_type):
     """Use the tool use model to perform the calculation or search"""
     messages = [
         {
             "role": "system",
-            "content": """You are an assistant that can perform calculations and web searches. 
-            When using search results, summarize the information in a clear and natural way.
-            For calculations, show both the calculation and the result.
-            Always respond in the same language as the user's query.
-            DO NOT show the function call format in your response.""",
+            "content": TOOL_SYSTEM_PROMPT,
         },
         {
             "role": "user",
@@ -136,132 +385,395 @@ def run_with_tool(query, tool_type):
     ]
     
     # Define available tools
-    if tool_type == "calculate":
-        tools = [{
-            "type": "function",
-            "function": {
-                "name": "calculate",
-                "description": "Evaluate a mathematical expression",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "expression": {
-                            "type": "string",
-                            "description": "The mathematical expression to evaluate",
-                        }
-                    },
-                    "required": ["expression"],
-                },
-            },
-        }]
-    else:  # search
-        tools = [{
-            "type": "function",
-            "function": {
-                "name": "web_search",
-                "description": "Perform a web search query",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "query": {
-                            "type": "string",
-                            "description": "The search query to perform",
-                        }
-                    },
-                    "required": ["query"],
-                },
-            },
-        }]
+    tools = [CALCULATE_TOOL] if tool_type == "calculate" else [WEB_SEARCH_TOOL]
 
     try:
         # First API call to get tool calls
-        response = client.chat.completions.create(
-            model=TOOL_USE_MODEL,
-            messages=messages,
-            tools=tools,
-            tool_choice={"type": "function", "function": {"name": tools[0]["function"]["name"]}},
-            max_completion_tokens=4096
-        )
+        with metrics.stage("tool_call"):
+            response = get_groq_client().chat.completions.create(
+                model=TOOL_USE_MODEL,
+                messages=messages,
+                tools=tools,
+                tool_choice={"type": "function", "function": {"name": tools[0]["function"]["name"]}},
+                max_completion_tokens=4096
+            )
         
         response_message = response.choices[0].message
-        tool_calls = response_message.tool_calls
+        if response_message.tool_calls:
+            return answer_with_tool_results(messages, response_message)
         
-        if tool_calls:
-            # Add the assistant's message with tool calls
-            messages.append(response_message)
-            
-            # Process each tool call
-            for tool_call in tool_calls:
-                function_name = tool_call.function.name
-                function_args = json.loads(tool_call.function.arguments)
-                
-                # Execute the appropriate function
-                if function_name == "calculate":
-                    function_response = calculate(function_args.get("expression"))
-                elif function_name == "web_search":
-                    function_response = web_search(function_args.get("query"))
-                
-                # Parse the function response
-                parsed_response = json.loads(function_response)
-                
-                # Add the function response to messages
-                messages.append({
-                    "tool_call_id": tool_call.id,
-                    "role": "tool",
-                    "name": function_name,
-                    "content": function_response,
-                })
-            
-            # Add a prompt to guide the final response
-            messages.append({
-                "role": "user",
-                "content": """请根据上述工具返回的结果，用自然的语言回答我的问题。
-                如果是搜索结果，请总结主要信息；如果是计算结果，请展示计算过程和结果。
-                注意：请直接给出答案，不要显示函数调用的格式。"""
-            })
-            
-            # Second API call to get the final response
-            second_response = client.chat.completions.create(
+        # If no tool calls were made, return the original response
+        return response_message.content
+        
+    except Exception as e:
+        return f"{ERROR_RESPONSE_PREFIX}: {str(e)}"
+
+def run_combined(query):
+    """
+    Offer both tools in a single call and let the model decide.
+
+    Returns:
+        tuple: (route, response). A reply without tool calls is used directly
+        as the general answer; only real tool use needs a follow-up call.
+        The route is None when the call failed before the model picked one.
+    """
+    messages = [
+        {"role": "system", "content": COMBINED_SYSTEM_PROMPT},
+        {"role": "user", "content": query}
+    ]
+
+    route = None
+    try:
+        with metrics.stage("tool_call"):
+            response = get_groq_client().chat.completions.create(
                 model=TOOL_USE_MODEL,
                 messages=messages,
+                tools=[CALCULATE_TOOL, WEB_SEARCH_TOOL],
+                tool_choice="auto",
                 max_completion_tokens=4096
             )
-            
-            return second_response.choices[0].message.content
         
-        # If no tool calls were made, return the original response
-        return response_message.content
+        response_message = response.choices[0].message
+        if not response_message.tool_calls:
+            return "no tool needed", response_message.content
+
+        route = TOOL_ROUTES.get(response_message.tool_calls[0].function.name, "no tool needed")
+        return route, answer_with_tool_results(messages, response_message)
         
     except Exception as e:
-        return f"抱歉，处理您的请求时出现了错误: {str(e)}"
+        return route, f"{ERROR_RESPONSE_PREFIX}: {str(e)}"
 
 def run_general(query):
     """Use the general model to answer the query since no tool is needed"""
-    response = client.chat.completions.create(
-        model=GENERAL_MODEL,
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": query}
-        ]
-    )
+    with metrics.stage("completion"):
+        response = get_groq_client().chat.completions.create(
+            model=GENERAL_MODEL,
+            messages=[
+                {"role": "system", "content": "You are a helpful assistant."},
+                {"role": "user", "content": query}
+            ]
+        )
     return response.choices[0].message.content
 
-def process_query(query):
-    """Process the query and route it to the appropriate model"""
-    route = route_query(query)
-    if route in ["calculate", "search"]:
+def _use_answer_cache(query, bypass_cache):
+    return answer_cache is not None and not bypass_cache and is_cacheable(query)
+
+def _lookup_answer(query):
+    with metrics.stage("answer_cache"):
+        return answer_cache.get(query)
+
+def _store_answer(query, route, response):
+    if response and not response.startswith(ERROR_RESPONSE_PREFIX):
+        answer_cache.set(query, route, response)
+
+def get_cached_answer(query):
+    """Cached (route, response) for the query, or None on a miss or when the query is not cached"""
+    if not _use_answer_cache(query, bypass_cache=False):
+        return None
+    return _lookup_answer(query)
+
+def cache_answer(query, route, response):
+    """Store an answer produced outside process_query, under the same rules as process_query"""
+    if _use_answer_cache(query, bypass_cache=False):
+        _store_answer(query, route, response)
+
+def process_query(query, pipeline=None, bypass_cache=False, refresh_cache=False):
+    """
+    Process the query and route it to the appropriate model
+
+    Args:
+        pipeline (str, optional): "combined" picks the tool in the same call that
+            uses it; "legacy" asks the routing model first. Defaults to QUERY_PIPELINE.
+        bypass_cache (bool): neither read nor write the answer cache
+        refresh_cache (bool): ignore a cached answer and store the new one
+    """
+    if not capture.ENABLED:
+        return _process_query(query, pipeline, bypass_cache, refresh_cache)
+
+    start = time.perf_counter()
+    result = None
+    try:
+        result = _process_query(query, pipeline, bypass_cache, refresh_cache)
+        return result
+    finally:
+        _capture_query(query, pipeline, bypass_cache, refresh_cache, start, result)
+
+def _capture_query(query, pipeline, bypass_cache, refresh_cache, start, result, stream=False):
+    # Record the query, its options, route, timing and answer size for bench/replay.py
+    capture.record(
+        "query",
+        query=query,
+        pipeline=pipeline,
+        bypass_cache=bypass_cache,
+        refresh_cache=refresh_cache,
+        stream=stream,
+        route=result["route"] if result else None,
+        cached=result["cached"] if result else None,
+        error=result is None,
+        duration_ms=round((time.perf_counter() - start) * 1000, 1),
+        response_bytes=len(result["response"].encode("utf-8")) if result else 0,
+    )
+
+def _process_query(query, pipeline, bypass_cache, refresh_cache):
+    pipeline = pipeline or QUERY_PIPELINE
+    use_cache = _use_answer_cache(query, bypass_cache)
+    if use_cache and not refresh_cache:
+        cached = _lookup_answer(query)
+        if cached is not None:
+            return {
+                "query": query,
+                "route": cached[0],
+                "response": cached[1],
+                "pipeline": pipeline,
+                "cached": True
+            }
+
+    if pipeline == "legacy":
+        route = route_query(query)
+    else:
+        route = fast_route(query)
+
+    if route is None:
+        # Nothing obvious: one call both routes and, for general queries, answers
+        _count_route("combined")
+        route, response = run_combined(query)
+        # Only a decision the model actually made is remembered; a failed call says nothing
+        if ROUTER_FAST_PATH and route is not None:
+            route_cache.set(normalize_query(query), route)
+    elif route in ["calculate", "search"]:
         response = run_with_tool(query, route)
     else:
         response = run_general(query)
+
+    if use_cache:
+        _store_answer(query, route, response)
     
     return {
         "query": query,
         "route": route,
-        "response": response
+        "response": response,
+        "pipeline": pipeline,
+        "cached": False
+    }
+
+def _stream_chat(**kwargs):
+    """
+    Stream a chat completion.
+
+    Yields ("token", text) for each content delta, ("tool_call_start", None) when the
+    first tool call delta arrives, and finally ("tool_calls", calls), where calls is a
+    list of {"id", "name", "arguments"} assembled from the deltas.
+    """
+    tool_calls = {}
+    for chunk in get_groq_client().chat.completions.create(stream=True, **kwargs):
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta.content:
+            yield "token", delta.content
+        for call in delta.tool_calls or []:
+            if not tool_calls:
+                yield "tool_call_start", None
+            entry = tool_calls.setdefault(call.index, {"id": None, "name": "", "arguments": ""})
+            if call.id:
+                entry["id"] = call.id
+            if call.function is not None:
+                entry["name"] += call.function.name or ""
+                entry["arguments"] += call.function.arguments or ""
+    yield "tool_calls", [tool_calls[index] for index in sorted(tool_calls)]
+
+def _stream_tool_answer(messages, tool_calls):
+    """Run the tools, emitting progress events, then stream the follow-up answer"""
+    messages.append({
+        "role": "assistant",
+        "tool_calls": [
+            {"id": call["id"], "type": "function", "function": {"name": call["name"], "arguments": call["arguments"]}}
+            for call in tool_calls
+        ],
+    })
+    for call in tool_calls:
+        yield {"event": "tool_call", "name": call["name"], "arguments": call["arguments"]}
+        function_response = execute_tool_call(call["name"], call["arguments"])
+        yield {"event": "tool_result", "name": call["name"], "result": json.loads(function_response)}
+        messages.append({
+            "tool_call_id": call["id"],
+            "role": "tool",
+            "name": call["name"],
+            "content": function_response,
+        })
+    messages.append({"role": "user", "content": TOOL_FOLLOW_UP_PROMPT})
+
+    for _, text in _stream_chat(model=TOOL_USE_MODEL, messages=messages, max_completion_tokens=4096):
+        if text:
+            yield {"event": "token", "content": text}
+
+def process_query_stream(query, pipeline=None, bypass_cache=False, refresh_cache=False):
+    """
+    Streaming variant of process_query.
+
+    Yields event dicts: "route" once the route is known, "tool_call" and
+    "tool_result" around each tool execution, "token" for each piece of the
+    answer as the model produces it, then "done" with the full response
+    (or "error" if something failed). A cached answer arrives as one token.
+    """
+    if not capture.ENABLED:
+        yield from _process_query_stream(query, pipeline, bypass_cache, refresh_cache)
+        return
+
+    start = time.perf_counter()
+    for event in _process_query_stream(query, pipeline, bypass_cache, refresh_cache):
+        if event["event"] in ("done", "error"):
+            # Recorded before the last event is sent, in case the client disconnects
+            result = event if event["event"] == "done" else None
+            _capture_query(query, pipeline, bypass_cache, refresh_cache, start, result, stream=True)
+        yield event
+
+def _process_query_stream(query, pipeline, bypass_cache, refresh_cache):
+    pipeline = pipeline or QUERY_PIPELINE
+    parts = []
+    route = None
+    # Set when the answer mixes a preamble with a tool answer; neither it nor its route is cached
+    late_tool_call = False
+    use_cache = _use_answer_cache(query, bypass_cache)
+    try:
+        if use_cache and not refresh_cache:
+            cached = _lookup_answer(query)
+            if cached is not None:
+                yield {"event": "route", "route": cached[0]}
+                yield {"event": "token", "content": cached[1]}
+                yield {
+                    "event": "done",
+                    "query": query,
+                    "route": cached[0],
+                    "response": cached[1],
+                    "pipeline": pipeline,
+                    "cached": True
+                }
+                return
+
+        route = route_query(query) if pipeline == "legacy" else fast_route(query)
+
+        if route is None:
+            _count_route("combined")
+            messages = [
+                {"role": "system", "content": COMBINED_SYSTEM_PROMPT},
+                {"role": "user", "content": query}
+            ]
+            tool_calls = []
+            # Text is held back until it is clearly the answer: a model that calls a tool
+            # may write a short preamble first, which then never reaches the client
+            preamble = []
+            preamble_chars = 0
+            calling_tool = False
+            for kind, value in _stream_chat(
+                model=TOOL_USE_MODEL,
+                messages=messages,
+                tools=[CALCULATE_TOOL, WEB_SEARCH_TOOL],
+                tool_choice="auto",
+                max_completion_tokens=4096
+            ):
+                if kind == "tool_calls":
+                    tool_calls = value
+                elif kind == "tool_call_start":
+                    calling_tool = True
+                elif route is not None:
+                    parts.append(value)
+                    yield {"event": "token", "content": value}
+                elif not calling_tool:
+                    preamble.append(value)
+                    preamble_chars += len(value)
+                    if preamble_chars > STREAM_PREAMBLE_CHARS:
+                        # Long enough to be the answer itself, though a tool call may still follow
+                        route = "no tool needed"
+                        yield {"event": "route", "route": route}
+                        for text in preamble:
+                            parts.append(text)
+                            yield {"event": "token", "content": text}
+
+            if tool_calls:
+                # A tool call after text was already sent: the text was a preamble after all,
+                # so the tool round still runs, and the route is announced again
+                late_tool_call = route is not None
+                route = TOOL_ROUTES.get(tool_calls[0]["name"], "no tool needed")
+                yield {"event": "route", "route": route}
+                for event in _stream_tool_answer(messages, tool_calls):
+                    if event["event"] == "token":
+                        parts.append(event["content"])
+                    yield event
+            elif route is None:
+                route = "no tool needed"
+                yield {"event": "route", "route": route}
+                for text in preamble:
+                    parts.append(text)
+                    yield {"event": "token", "content": text}
+            if ROUTER_FAST_PATH and not late_tool_call:
+                route_cache.set(normalize_query(query), route)
+
+        elif route in ["calculate", "search"]:
+            yield {"event": "route", "route": route}
+            tool = CALCULATE_TOOL if route == "calculate" else WEB_SEARCH_TOOL
+            messages = [
+                {"role": "system", "content": TOOL_SYSTEM_PROMPT},
+                {"role": "user", "content": query}
+            ]
+            # The forced tool call carries no answer text, so it is not streamed
+            response = get_groq_client().chat.completions.create(
+                model=TOOL_USE_MODEL,
+                messages=messages,
+                tools=[tool],
+                tool_choice={"type": "function", "function": {"name": tool["function"]["name"]}},
+                max_completion_tokens=4096
+            )
+            response_message = response.choices[0].message
+            if response_message.tool_calls:
+                tool_calls = [
+                    {"id": call.id, "name": call.function.name, "arguments": call.function.arguments}
+                    for call in response_message.tool_calls
+                ]
+                for event in _stream_tool_answer(messages, tool_calls):
+                    if event["event"] == "token":
+                        parts.append(event["content"])
+                    yield event
+            elif response_message.content:
+                parts.append(response_message.content)
+                yield {"event": "token", "content": response_message.content}
+
+        else:
+            yield {"event": "route", "route": route}
+            for _, text in _stream_chat(
+                model=GENERAL_MODEL,
+                messages=[
+                    {"role": "system", "content": "You are a helpful assistant."},
+                    {"role": "user", "content": query}
+                ]
+            ):
+                if text:
+                    parts.append(text)
+                    yield {"event": "token", "content": text}
+
+    except Exception as e:
+        yield {"event": "error", "error": f"{ERROR_RESPONSE_PREFIX}: {str(e)}"}
+        return
+
+    response = "".join(parts)
+    if use_cache and not late_tool_call:
+        _store_answer(query, route, response)
+    yield {
+        "event": "done",
+        "query": query,
+        "route": route,
+        "response": response,
+        "pipeline": pipeline,
+        "cached": False
     }
 
 # Example usage
 if __name__ == "__main__":
+    import sys
+
+    # Optional first argument picks the pipeline ("combined" or "legacy") for latency comparison
+    pipeline = sys.argv[1] if len(sys.argv) > 1 else None
+
     # Test queries with different types of questions
     test_queries = [
         "中国的首都在哪里？",      # 地理知识查询
@@ -274,7 +786,11 @@ if __name__ == "__main__":
     for query in test_queries:
         print("\n" + "="*50)
         print(f"查询: {query}")
-        result = process_query(query)
+        start = time.perf_counter()
+        result = process_query(query, pipeline)
         print(f"路由: {result['route']}")
         print(f"回答: {result['response']}")
-        print("="*50)
\ No newline at end of file
+        print(f"耗时: {time.perf_counter() - start:.2f}s ({result['pipeline']})")
+        print("="*50)
+
+    print(f"路由统计: {router_stats()}")
\ No newline at end of file
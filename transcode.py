@@ -0,0 +1,181 @@
+import hashlib
+import io
+import os
+import tempfile
+import time
+
+from image_cache import ImageCache
+import metrics
+
+# 可选依赖：只有请求转码时才导入 Pillow，没有安装时其他功能照常可用
+_pil = None
+
+FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "jpg": ("JPEG", "image/jpeg"),
+    "png": ("PNG", "image/png"),
+}
+
+DEFAULT_QUALITY = 80
+MAX_SIZE_RANGE = (16, 2048)
+
+
+def _load_pillow():
+    global _pil
+    if _pil is None:
+        try:
+            from PIL import Image
+        except ImportError:
+            return None
+        _pil = Image
+    return _pil
+
+
+class Transform:
+    """一次转码的目标：输出格式、质量和最长边尺寸"""
+
+    def __init__(self, output_format, quality=DEFAULT_QUALITY, max_size=None):
+        self.output_format = "jpeg" if output_format == "jpg" else output_format
+        self.quality = quality
+        self.max_size = max_size
+
+    @property
+    def content_type(self):
+        return FORMATS[self.output_format][1]
+
+    def key(self):
+        """变体缓存键中的转换部分，例如 "webp-q80-s256"（PNG 无损，不区分质量）"""
+        quality = "" if self.output_format == "png" else f"-q{self.quality}"
+        size = f"-s{self.max_size}" if self.max_size else ""
+        return f"{self.output_format}{quality}{size}"
+
+
+def parse_transform(data):
+    """
+    从请求数据中读取转码参数：output_format（webp/jpeg/png）、quality（1-100）和 max_size（最长边像素）
+
+    Returns:
+        Transform: 没有任何转码参数时返回 None，保持原图
+
+    Raises:
+        ValueError: 参数类型或取值范围不合法
+    """
+    if not any(name in data for name in ("output_format", "quality", "max_size")):
+        return None
+
+    output_format = str(data.get("output_format", "png")).lower()
+    if output_format not in FORMATS:
+        raise ValueError("output_format must be one of webp, jpeg, png")
+
+    quality = data.get("quality", DEFAULT_QUALITY)
+    if isinstance(quality, bool) or not isinstance(quality, int) or not 1 <= quality <= 100:
+        raise ValueError("quality must be an integer between 1 and 100")
+
+    max_size = data.get("max_size")
+    low, high = MAX_SIZE_RANGE
+    if max_size is not None and (isinstance(max_size, bool) or not isinstance(max_size, int) or not low <= max_size <= high):
+        raise ValueError(f"max_size must be an integer between {low} and {high}")
+
+    return Transform(output_format, quality, max_size)
+
+
+def encode(image_data, transform):
+    """
+    按转换参数重新编码图片
+
+    Returns:
+        bytes: 转码后的图片数据
+
+    Raises:
+        RuntimeError: 没有安装 Pillow
+    """
+    Image = _load_pillow()
+    if Image is None:
+        raise RuntimeError("Image transcoding requires Pillow (pip install Pillow)")
+
+    pil_format = FORMATS[transform.output_format][0]
+    with Image.open(io.BytesIO(image_data)) as image:
+        if transform.max_size and max(image.size) > transform.max_size:
+            # 只缩小不放大，保持宽高比
+            image.thumbnail((transform.max_size, transform.max_size), Image.LANCZOS)
+        if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+
+        options = {}
+        if pil_format in ("JPEG", "WEBP"):
+            options["quality"] = transform.quality
+        out = io.BytesIO()
+        image.save(out, pil_format, **options)
+    return out.getvalue()
+
+
+class VariantCache:
+    """
+    转码结果缓存，键为原图内容的 sha256 加转换参数
+
+    同一张图片的同一种变体只编码一次，之后的请求直接返回缓存的数据。
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    @classmethod
+    def from_env(cls):
+        """磁盘层默认 64 MiB，和图片缓存共用临时目录的空间"""
+        memory_bytes = int(os.getenv("IMAGE_VARIANT_CACHE_MEMORY_BYTES", 16 * 1024 * 1024))
+        disk_bytes = int(os.getenv("IMAGE_VARIANT_CACHE_DISK_BYTES", 64 * 1024 * 1024))
+        disk_dir = os.getenv(
+            "IMAGE_VARIANT_CACHE_DIR",
+            os.path.join(tempfile.gettempdir(), "image-variants")
+        )
+        return cls(ImageCache(memory_bytes, disk_dir, disk_bytes))
+
+    def transcode(self, image_data, transform):
+        """
+        获取图片的指定变体，未缓存时编码并写入缓存
+
+        Returns:
+            dict: 成功时包含 image_data、content_type 和转码元数据 transform，
+                失败时包含 error 和 status（没有 Pillow 时为 501，原图无法解码时为 500）
+        """
+        source_hash = hashlib.sha256(image_data).hexdigest()
+        key = hashlib.sha256(f"{source_hash}:{transform.key()}".encode("ascii")).hexdigest()
+
+        with metrics.stage("variant_cache"):
+            data, _ = self.cache.get(key)
+        variant_cache = "hit"
+        encode_ms = 0.0
+        if data is None:
+            variant_cache = "miss"
+            start = time.perf_counter()
+            try:
+                with metrics.stage("transcode"):
+                    data = encode(image_data, transform)
+            except RuntimeError as e:
+                return {"success": False, "status": 501, "error": str(e)}
+            except Exception as e:
+                return {"success": False, "status": 500, "error": f"Transcoding failed: {e}"}
+            encode_ms = (time.perf_counter() - start) * 1000
+            self.cache.put(key, data)
+
+        original_bytes = len(image_data)
+        return {
+            "success": True,
+            "image_data": data,
+            "content_type": transform.content_type,
+            "transform": {
+                "output_format": transform.output_format,
+                "quality": transform.quality,
+                "max_size": transform.max_size,
+                "original_bytes": original_bytes,
+                "bytes": len(data),
+                "saved_bytes": original_bytes - len(data),
+                "saved_ratio": round(1 - len(data) / original_bytes, 3) if original_bytes else 0.0,
+                "encode_ms": round(encode_ms, 1),
+                "variant_cache": variant_cache,
+            }
+        }
+
+    def stats(self):
+        return self.cache.stats()
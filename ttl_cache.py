@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Two-level cache for JSON-serializable values with per-entry expiry.
+
+    The in-process tier is an LRU bounded by entry count. The optional
+    on-disk tier stores one JSON file per key and evicts the least recently
+    used files once it holds more than ``max_disk_entries``, down to 90% of
+    the limit. The file count is tracked in memory, so the directory is only
+    listed when it is over the limit or every ``RECOUNT_INTERVAL`` writes.
+    """
+
+    SUFFIX = ".json"
+    # The directory is rescanned at least every this many disk writes, so files
+    # written by other processes sharing it are eventually counted too
+    RECOUNT_INTERVAL = 100
+
+    def __init__(self, max_entries=256, ttl=3600, directory=None, max_disk_entries=4096):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.directory = directory
+        self.max_disk_entries = max_disk_entries
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # Files in the directory as of the last scan plus new files written since; None until scanned
+        self._disk_count = None
+        self._disk_writes = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest + self.SUFFIX)
+
+    def get(self, key):
+        """Return the cached value, or None if it is missing or expired."""
+        now = time.time()
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at is None or expires_at > now:
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._items[key]
+
+        value, expires_at = self._disk_get(key, now)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._memory_set(key, value, expires_at)
+        return value
+
+    def set(self, key, value, ttl=None):
+        """Store a value; ``ttl`` overrides the default, and 0 means no expiry."""
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._memory_set(key, value, expires_at)
+        self._disk_set(key, value, expires_at)
+
+    def _memory_set(self, key, value, expires_at):
+        self._items[key] = (expires_at, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_entries:
+            self._items.popitem(last=False)
+
+    def _disk_get(self, key, now):
+        if not self.directory:
+            return None, None
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None, None
+        if entry.get("key") != key:
+            return None, None
+        expires_at = entry.get("expires_at")
+        if expires_at is not None and expires_at <= now:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None, None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry.get("value"), expires_at
+
+    def _disk_set(self, key, value, expires_at):
+        if not self.directory:
+            return
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"key": key, "expires_at": expires_at, "value": value}, f, ensure_ascii=False)
+            path = self._path(key)
+            is_new = not os.path.exists(path)
+            os.replace(tmp_path, path)
+            tmp_path = None
+        except (OSError, TypeError, ValueError):
+            # The disk tier is best effort; the memory tier already has the value.
+            return
+        finally:
+            if tmp_path is not None:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+        with self._lock:
+            self._disk_writes += 1
+            if self._disk_count is not None and is_new:
+                self._disk_count += 1
+            due = (
+                self._disk_count is None
+                or self._disk_count > self.max_disk_entries
+                or self._disk_writes % self.RECOUNT_INTERVAL == 0
+            )
+        if due:
+            try:
+                self._disk_evict()
+            except OSError:
+                pass
+
+    def _disk_evict(self):
+        """Rescan the directory and remove the least recently used files above the limit."""
+        names = [name for name in os.listdir(self.directory) if name.endswith(self.SUFFIX)]
+        remaining = len(names)
+        if remaining > self.max_disk_entries:
+            # Evict a tenth below the limit so the next few new files don't each trigger a scan
+            keep = self.max_disk_entries - self.max_disk_entries // 10
+            entries = []
+            for name in names:
+                path = os.path.join(self.directory, name)
+                try:
+                    entries.append((os.stat(path).st_mtime, path))
+                except OSError:
+                    continue
+            entries.sort()
+            for _, path in entries[:len(entries) - keep]:
+                try:
+                    os.remove(path)
+                    remaining -= 1
+                except OSError:
+                    pass
+        with self._lock:
+            self._disk_count = remaining
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._items),
+        }
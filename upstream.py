@@ -0,0 +1,150 @@
+import os
+import threading
+import time
+import urllib.parse
+
+import metrics
+
+
+class UpstreamClient:
+    """
+    所有上游调用（Cloudflare、维基百科、Pollinations 等）共用的 HTTP 客户端
+
+    底层的 Session 按主机维护连接池并保持长连接，在同一个进程内的多次请求之间复用，
+    省去重复的 TCP/TLS 握手。连接失败时按指数退避自动重试。
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=10, connect_timeout=5.0,
+                 read_timeout=120.0, retries=2, backoff_factor=0.3):
+        """
+        Args:
+            pool_connections (int): 最多缓存多少个主机的连接池
+            pool_maxsize (int): 每个主机连接池保留的最大连接数
+            connect_timeout (float): 建立连接的超时时间（秒）
+            read_timeout (float): 等待响应数据的超时时间（秒）
+            retries (int): 连接错误的重试次数
+            backoff_factor (float): 重试退避系数，第 n 次重试前等待 backoff_factor * 2^(n-1) 秒
+        """
+        # requests 导入较慢，推迟到第一次创建客户端时，不用上游的请求不必为它付出冷启动时间
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        self.timeout = (connect_timeout, read_timeout)
+        self._request_error = requests.RequestException
+        # 连接错误对所有方法都可以安全重试（请求尚未发出）；
+        # 读取错误只对幂等方法（GET/HEAD 等）重试；不根据状态码重试
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=0,
+            redirect=5,
+            backoff_factor=backoff_factor,
+            raise_on_status=False,
+        )
+        self._adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=retry,
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", self._adapter)
+        self.session.mount("http://", self._adapter)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            pool_connections=int(os.getenv("UPSTREAM_POOL_CONNECTIONS", 10)),
+            pool_maxsize=int(os.getenv("UPSTREAM_POOL_MAXSIZE", 10)),
+            connect_timeout=float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", 5)),
+            read_timeout=float(os.getenv("UPSTREAM_READ_TIMEOUT", 120)),
+            retries=int(os.getenv("UPSTREAM_RETRIES", 2)),
+            backoff_factor=float(os.getenv("UPSTREAM_BACKOFF", 0.3)),
+        )
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        if not metrics.ENABLED:
+            return self.session.request(method, url, **kwargs)
+
+        # 记录上游耗时（到收到响应头为止）、状态码和响应字节数
+        host = urllib.parse.urlsplit(url).hostname
+        try:
+            with metrics.stage(f"upstream:{host}"):
+                response = self.session.request(method, url, **kwargs)
+        except self._request_error:
+            metrics.incr(f"upstream_error:{host}")
+            raise
+        metrics.incr(f"upstream_status:{host}:{response.status_code}")
+        content_length = response.headers.get("Content-Length")
+        if content_length and content_length.isdigit():
+            metrics.incr("upstream_bytes_in", int(content_length))
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def stats(self):
+        """
+        各主机连接池的复用情况
+
+        Returns:
+            dict: 以 "scheme://host:port" 为键，包含新建连接数、请求数和复用的请求数
+        """
+        pools = self._adapter.poolmanager.pools
+        result = {}
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            name = f"{pool.scheme}://{pool.host}:{pool.port}"
+            result[name] = {
+                "connections": pool.num_connections,
+                "requests": pool.num_requests,
+                "reused": max(pool.num_requests - pool.num_connections, 0),
+            }
+        return result
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """获取进程级共享客户端，函数实例保持温热时在多次调用之间复用"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = UpstreamClient.from_env()
+    return _client
+
+
+def httpx_event_hooks():
+    """
+    httpx 客户端（Groq SDK）的事件钩子，记录与 UpstreamClient.request 相同的上游指标
+
+    耗时同样计到收到响应头为止；未启用指标时不需要安装。
+    """
+    def on_request(request):
+        request.extensions["metrics_start"] = time.perf_counter()
+
+    def on_response(response):
+        request = response.request
+        host = request.url.host
+        start = request.extensions.get("metrics_start")
+        if start is not None:
+            metrics.registry.observe(f"upstream:{host}", (time.perf_counter() - start) * 1000)
+        metrics.incr(f"upstream_status:{host}:{response.status_code}")
+        content_length = response.headers.get("Content-Length")
+        if content_length and content_length.isdigit():
+            metrics.incr("upstream_bytes_in", int(content_length))
+
+    return {"request": [on_request], "response": [on_response]}
@@ -0,0 +1,298 @@
+"""
+Local full-text index of Wikipedia titles and intro extracts.
+
+Built once from a downloaded dump and then used by ``tools.web_search``
+before (and instead of) the live API. Two dump formats are read, plain or
+compressed with gzip/bz2:
+
+- the abstract dump, e.g. ``zhwiki-latest-abstract.xml.gz``
+  (``<doc><title>Wikipedia: …</title><url>…</url><abstract>…</abstract></doc>``)
+- the CirrusSearch content dump, e.g. ``zhwiki-…-cirrussearch-content.json.gz``
+  (alternating index/document JSON lines with ``title`` and ``opening_text``)
+
+Both are streamed, so memory stays flat however large the dump is. Running
+``build`` again against a newer dump only rewrites pages whose content hash
+changed and drops pages that disappeared.
+
+    python wiki_index.py build zhwiki-latest-abstract.xml.gz --index wiki.sqlite3
+    python wiki_index.py search "长城" --index wiki.sqlite3
+"""
+import argparse
+import bz2
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+import urllib.parse
+import xml.etree.ElementTree as ElementTree
+
+# Rows written per transaction while ingesting
+BATCH_SIZE = 1000
+
+# Share of the query's trigrams that the best page must contain to count as a hit
+MIN_COVERAGE = float(os.getenv("WIKI_INDEX_MIN_COVERAGE", 0.6))
+
+SNIPPET_LENGTH = 500
+
+
+def _open_dump(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    return open(path, "rb")
+
+
+def _local_name(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def read_abstract_dump(path):
+    """Yield (title, url, extract) from an abstract XML dump."""
+    with _open_dump(path) as f:
+        root = None
+        for event, element in ElementTree.iterparse(f, events=("start", "end")):
+            if root is None:
+                root = element
+            if event != "end" or _local_name(element.tag) != "doc":
+                continue
+            fields = {_local_name(child.tag): child.text or "" for child in element}
+            title = fields.get("title", "")
+            if title.startswith("Wikipedia:"):
+                title = title[len("Wikipedia:"):].strip()
+            if title and fields.get("abstract"):
+                yield title, fields.get("url", ""), fields["abstract"].strip()
+            # Drop finished documents so memory stays bounded
+            root.clear()
+
+
+def read_cirrus_dump(path, lang):
+    """Yield (title, url, extract) from a CirrusSearch content dump."""
+    with _open_dump(path) as f:
+        for line in f:
+            try:
+                doc = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "index" in doc or doc.get("namespace", 0) != 0:
+                continue
+            title = doc.get("title")
+            extract = (doc.get("opening_text") or doc.get("text") or "").strip()
+            if title and extract:
+                url = f"https://{lang}.wikipedia.org/wiki/{urllib.parse.quote(title.replace(' ', '_'))}"
+                yield title, url, extract
+
+
+def read_dump(path, lang="zh"):
+    name = path.lower()
+    for suffix in (".gz", ".bz2"):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    if name.endswith(".json") or name.endswith(".ndjson"):
+        return read_cirrus_dump(path, lang)
+    return read_abstract_dump(path)
+
+
+def _normalize(text):
+    return " ".join(unicodedata.normalize("NFKC", text).split()).casefold()
+
+
+def _trigrams(term):
+    if len(term) < 3:
+        return [term]
+    return [term[i:i + 3] for i in range(len(term) - 2)]
+
+
+class WikiIndex:
+    """SQLite FTS5 (trigram tokenizer) index of page titles and extracts."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS pages (
+                id INTEGER PRIMARY KEY,
+                title TEXT NOT NULL UNIQUE,
+                url TEXT NOT NULL,
+                extract TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                generation INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+            CREATE VIRTUAL TABLE IF NOT EXISTS pages_fts USING fts5(
+                title, extract, content='pages', content_rowid='id', tokenize='trigram'
+            );
+            CREATE TRIGGER IF NOT EXISTS pages_ai AFTER INSERT ON pages BEGIN
+                INSERT INTO pages_fts (rowid, title, extract) VALUES (new.id, new.title, new.extract);
+            END;
+            CREATE TRIGGER IF NOT EXISTS pages_ad AFTER DELETE ON pages BEGIN
+                INSERT INTO pages_fts (pages_fts, rowid, title, extract) VALUES ('delete', old.id, old.title, old.extract);
+            END;
+            CREATE TRIGGER IF NOT EXISTS pages_au AFTER UPDATE OF title, extract ON pages BEGIN
+                INSERT INTO pages_fts (pages_fts, rowid, title, extract) VALUES ('delete', old.id, old.title, old.extract);
+                INSERT INTO pages_fts (rowid, title, extract) VALUES (new.id, new.title, new.extract);
+            END;
+            """
+        )
+        self._conn.commit()
+
+    def _meta(self, key, default=None):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def build(self, pages, prune=True, progress=None):
+        """
+        Ingest (title, url, extract) tuples, touching only pages whose content changed.
+
+        Args:
+            pages: iterable of (title, url, extract), typically ``read_dump(path)``
+            prune (bool): delete pages not seen in this run (use with full dumps only)
+            progress (callable, optional): called with the counts every BATCH_SIZE pages
+
+        Returns:
+            dict: added / updated / unchanged / removed counts
+        """
+        counts = {"added": 0, "updated": 0, "unchanged": 0, "removed": 0}
+        with self._lock:
+            generation = int(self._meta("generation", 0)) + 1
+            conn = self._conn
+            for i, (title, url, extract) in enumerate(pages, 1):
+                digest = hashlib.sha1(f"{url}\0{extract}".encode("utf-8")).hexdigest()
+                row = conn.execute("SELECT id, hash FROM pages WHERE title = ?", (title,)).fetchone()
+                if row is None:
+                    conn.execute(
+                        "INSERT INTO pages (title, url, extract, hash, generation) VALUES (?, ?, ?, ?, ?)",
+                        (title, url, extract, digest, generation),
+                    )
+                    counts["added"] += 1
+                elif row[1] != digest:
+                    conn.execute(
+                        "UPDATE pages SET url = ?, extract = ?, hash = ?, generation = ? WHERE id = ?",
+                        (url, extract, digest, generation, row[0]),
+                    )
+                    counts["updated"] += 1
+                else:
+                    conn.execute("UPDATE pages SET generation = ? WHERE id = ?", (generation, row[0]))
+                    counts["unchanged"] += 1
+                if i % BATCH_SIZE == 0:
+                    conn.commit()
+                    if progress:
+                        progress(counts)
+
+            if prune:
+                counts["removed"] = conn.execute("DELETE FROM pages WHERE generation < ?", (generation,)).rowcount
+            conn.execute("INSERT OR REPLACE INTO meta VALUES ('generation', ?)", (str(generation),))
+            conn.execute("INSERT OR REPLACE INTO meta VALUES ('built_at', ?)", (str(time.time()),))
+            conn.commit()
+            conn.execute("INSERT INTO pages_fts (pages_fts) VALUES ('optimize')")
+            conn.commit()
+        return counts
+
+    def search(self, query, limit=3):
+        """
+        Find the pages best matching a query.
+
+        Short terms (under three characters, which the trigram index can't match)
+        are looked up as titles; longer ones go through FTS5 with titles weighted
+        above extracts. CJK text without spaces is matched by its trigrams.
+
+        Returns:
+            list: web_search style {"title", "snippet", "link"} dicts, empty on a miss
+                (including when the best page neither is named in the query nor
+                covers enough of it)
+        """
+        terms = _normalize(query).split()
+        if not terms:
+            return []
+        # Titles are stored with their original case
+        titles = [term for term in unicodedata.normalize("NFKC", query).split() if len(term) < 3]
+        grams = [gram for term in terms for gram in _trigrams(term)]
+        match = " OR ".join('"' + gram.replace('"', '""') + '"' for gram in set(grams) if len(gram) >= 3)
+
+        rows = []
+        with self._lock:
+            for title in titles:
+                rows += self._conn.execute(
+                    "SELECT id, title, url, extract FROM pages WHERE title = ?", (title,)
+                ).fetchall()
+            if match:
+                rows += self._conn.execute(
+                    """
+                    SELECT pages.id, pages.title, pages.url, pages.extract FROM pages_fts
+                    JOIN pages ON pages.id = pages_fts.rowid
+                    WHERE pages_fts MATCH ?
+                    ORDER BY bm25(pages_fts, 10.0, 1.0)
+                    LIMIT ?
+                    """,
+                    (match, limit),
+                ).fetchall()
+
+        results = []
+        seen = set()
+        for page_id, title, url, extract in rows:
+            if page_id in seen:
+                continue
+            seen.add(page_id)
+            results.append({"title": title, "snippet": extract[:SNIPPET_LENGTH] + "...", "link": url})
+        if not results:
+            return []
+
+        # A question naming the page ("长城是什么时候建造的") is a hit even though
+        # most of its trigrams are question words
+        best = rows[0]
+        if _normalize(best[1]) in " ".join(terms):
+            return results[:limit]
+        text = _normalize(best[1] + " " + best[3])
+        covered = sum(1 for gram in grams if gram in text)
+        if covered / len(grams) < MIN_COVERAGE:
+            return []
+        return results[:limit]
+
+    def stats(self):
+        with self._lock:
+            pages = self._conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+            built_at = self._meta("built_at")
+        return {"pages": pages, "built_at": float(built_at) if built_at else None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the local Wikipedia index")
+    parser.add_argument("--index", default=os.getenv("WIKI_INDEX_PATH", "wiki.sqlite3"), help="index database path")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="ingest (or refresh from) an abstract or CirrusSearch dump")
+    build.add_argument("dump", help="dump file (.xml / .json, optionally .gz or .bz2)")
+    build.add_argument("--lang", default=os.getenv("WIKIPEDIA_LANG", "zh"), help="language, used to build URLs")
+    build.add_argument("--no-prune", action="store_true", help="keep pages missing from this dump (partial dumps)")
+
+    search = commands.add_parser("search", help="query the index")
+    search.add_argument("query")
+    search.add_argument("--limit", type=int, default=3)
+
+    args = parser.parse_args()
+    index = WikiIndex(args.index)
+
+    if args.command == "build":
+        start = time.perf_counter()
+
+        def progress(counts):
+            print(f"\r{sum(counts.values())} pages ({counts})", end="", flush=True)
+
+        counts = index.build(read_dump(args.dump, args.lang), prune=not args.no_prune, progress=progress)
+        print(f"\r{counts} in {time.perf_counter() - start:.1f}s")
+    else:
+        start = time.perf_counter()
+        results = index.search(args.query, args.limit)
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        print(f"{(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()